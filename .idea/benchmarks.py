@@ -0,0 +1,343 @@
+"""Замеры производительности аналитики на синтетических данных.
+
+Запуск: python benchmarks.py [название ...]; без аргументов выполняются все замеры.
+Базы создаются во временном каталоге и удаляются после замера.
+"""
+import os
+import sys
+import random
+import multiprocessing
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from main import BranchReplicator, DatabaseManager, SalesForecaster, SalesService, SalesSnapshot, ServiceClient
+
+
+def measure(title, fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"  {title}: {elapsed * 1000:.2f} мс")
+    return result
+
+
+def create_database(directory, branches, days, today):
+    """База с branches филиалами и продажами за days дней до today (по одной продаже в день)"""
+    db = DatabaseManager(os.path.join(directory, "benchmark.db"))
+    first_day = today - timedelta(days=days)
+    weekday_factors = [1.0, 0.9, 0.95, 1.0, 1.2, 1.5, 0.6]
+    branch_rows = [(f"Филиал {number}", "", "", "") for number in range(1, branches + 1)]
+    sale_rows = []
+    for branch_id in range(1, branches + 1):
+        level = random.uniform(5000, 50000)
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            revenue = round(level * weekday_factors[day.weekday()] * random.uniform(0.8, 1.2), 2)
+            sale_rows.append((day.isoformat(), revenue, 10, None, branch_id, "", 1))
+
+    def fill(cursor):
+        cursor.executemany("INSERT INTO branches (name, address, manager, phone) VALUES (?, ?, ?, ?)", branch_rows)
+        cursor.executemany('''
+            INSERT INTO sales (date, revenue, transactions, employee_id, branch_id, notes, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', sale_rows)
+        return []
+
+    db.execute_transaction(fill)
+    db.invalidate_tables('branches')
+    return db
+
+
+def bench_forecast(branches=1000):
+    """Пакетный прогноз SalesForecaster по всем филиалам"""
+    today = datetime.now().date()
+    days = SalesForecaster.HISTORY_DAYS
+    matrix = np.random.uniform(0, 50000, (branches, days))
+
+    print(f"Прогноз: {branches} филиалов × {days} дней")
+    measure("расчёт одним векторным проходом", lambda: SalesForecaster.fit(matrix, 0), repeat=20)
+    measure("тот же расчёт по одному филиалу",
+            lambda: [SalesForecaster.fit(matrix[index:index + 1], 0) for index in range(branches)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = measure("подготовка базы", lambda: create_database(directory, branches, days, today))
+        forecaster = SalesForecaster(db)
+        measure("загрузка истории из daily_sales", lambda: forecaster.load_history(today), repeat=5)
+        measure("полный пересчёт с сохранением", lambda: forecaster.run(today), repeat=5)
+        measure("чтение прогноза по всем филиалам", lambda: db.get_weekday_forecast(None), repeat=20)
+
+
+def measure_memory(title, fn):
+    tracemalloc.start()
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  {title}: {size / 1024 / 1024:.1f} МБ")
+    return result
+
+
+def bench_snapshot(branches=100, days=2000):
+    """Память и скорость столбцового снимка продаж против списка кортежей get_all_sales"""
+    today = datetime.now().date()
+    print(f"Снимок продаж: {branches * days} записей")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, branches, days, today)
+        rows = measure_memory("список кортежей get_all_sales", db.get_all_sales)
+        del rows
+        snapshot = measure_memory("столбцовый снимок", lambda: SalesSnapshot(db))
+        measure("построение снимка", snapshot.build)
+        measure("поиск по имени филиала", lambda: snapshot.search("филиал 42"), repeat=5)
+        measure("поиск по сумме", lambda: snapshot.search("100.5"), repeat=5)
+        sale_id = int(snapshot.sale_ids([0])[0])
+        measure("обновление одной продажи",
+                lambda: db.update_sale(sale_id, today.isoformat(), 1000, 10, None, 1, "", 1), repeat=20)
+
+
+def bench_memory(branches=500, days=2000):
+    """Байт памяти на одну продажу: список кортежей get_all_sales против столбцового снимка"""
+    today = datetime.now().date()
+    count = branches * days
+    print(f"Память на продажу: {count} записей")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, branches, days, today)
+        for title, load in [("кортежи get_all_sales", db.get_all_sales), ("SalesSnapshot", lambda: SalesSnapshot(db))]:
+            tracemalloc.start()
+            data = load()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"  {title}: {size / count:.1f} байт")
+            del data
+
+
+def bench_cold_start(branches=100):
+    """Время открытия снимка продаж при разной длине истории: полное чтение и отображение сохранённого"""
+    today = datetime.now().date()
+    for days in (500, 2000, 8000):
+        print(f"Холодный старт: {branches * days} записей")
+        with tempfile.TemporaryDirectory() as directory:
+            db = create_database(directory, branches, days, today)
+            measure("первый запуск: чтение sales и сохранение", lambda: SalesSnapshot(db))
+            measure("повторный запуск: отображение файлов", lambda: SalesSnapshot(db), repeat=5)
+            for _ in range(100):
+                db.add_sale(today.isoformat(), 1000, 10, None, 1, "", 1)
+            measure("повторный запуск после 100 новых продаж", lambda: SalesSnapshot(db))
+
+
+def bench_schema(branches=200, days=2000):
+    """Диапазонные суммы и сортировка: прежняя таблица (дата TEXT, суммы REAL) против sales_records"""
+    today = datetime.now().date()
+    print(f"Схема продаж: {branches * days} записей")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, branches, days, today)
+        conn = sqlite3.connect(db.db_name)
+        conn.execute("CREATE TABLE legacy_sales AS SELECT * FROM sales")
+        conn.execute("CREATE INDEX idx_legacy_sales_date ON legacy_sales (date)")
+        conn.commit()
+        start, end = today - timedelta(days=365), today
+        legacy = measure("сумма за год, TEXT/REAL", lambda: conn.execute(
+            "SELECT SUM(revenue) FROM legacy_sales WHERE date BETWEEN ? AND ?",
+            (start.isoformat(), end.isoformat())).fetchone()[0], repeat=5)
+        exact = measure("сумма за год, копейки/номер дня", lambda: conn.execute(
+            "SELECT SUM(revenue_kopecks) FROM sales_records WHERE day BETWEEN ? AND ?",
+            (DatabaseManager.to_day(start), DatabaseManager.to_day(end))).fetchone()[0], repeat=5)
+        print(f"  расхождение суммы REAL с точной: {legacy - exact / 100:.10f} руб")
+        measure("сортировка по дате, TEXT/REAL",
+                lambda: conn.execute("SELECT id, date, revenue FROM legacy_sales ORDER BY date DESC").fetchall())
+        measure("сортировка по дате, копейки/номер дня",
+                lambda: conn.execute("SELECT id, day, revenue_kopecks FROM sales_records ORDER BY day DESC").fetchall())
+        measure("get_all_sales", db.get_all_sales)
+        conn.close()
+
+
+def bench_cache(branches=500, employees=2000, repeat=200):
+    """Справочники для выпадающих списков: запрос к базе на каждое обращение против кеша запросов"""
+    today = datetime.now().date()
+    print(f"Кеш запросов: {branches} филиалов, {employees} сотрудников")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, branches, 1, today)
+        for number in range(employees):
+            db.add_employee(f"Сотрудник {number}", "Кассир", "", random.randint(1, branches))
+        for branch_id in range(1, branches + 1):
+            db.add_sales_plan(branch_id, today.year, today.month, 1000, 30000)
+
+        def load_references():
+            db.get_all_branches()
+            db.get_all_employees()
+            db.get_sales_plans()
+
+        measure("без кеша", lambda: [db.execute_query(query) for query in (
+            "SELECT * FROM branches ORDER BY name", "SELECT * FROM employees ORDER BY name",
+            "SELECT sp.*, b.name FROM sales_plans sp LEFT JOIN branches b ON sp.branch_id = b.id")], repeat=repeat)
+        measure("с кешем", load_references, repeat=repeat)
+        measure("с кешем после изменения сотрудника",
+                lambda: (db.update_employee(1, "Сотрудник 0", "Кассир", "", 1), load_references()), repeat=20)
+        print(f"  счётчики: {db.cache_stats()}")
+
+
+def clerk_session(db_name, settings, operations, seed):
+    """Работа одного кассира в отдельном процессе: 60% новых продаж, 20% исправлений, 20% отчётов.
+    Результат: (начало, конец, [(вид операции, задержка в секундах, успешно)])"""
+    for name, value in settings.items():
+        setattr(DatabaseManager, name, value)
+    db = DatabaseManager(db_name)
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    sale_ids, results = [], []
+    started = time.time()
+    for _ in range(operations):
+        day = (today - timedelta(days=rng.randint(0, 30))).isoformat()
+        revenue, transactions, branch_id = round(rng.uniform(100, 5000), 2), rng.randint(1, 20), rng.randint(1, 20)
+        roll = rng.random()
+        operation_started = time.perf_counter()
+        if roll < 0.6 or not sale_ids:
+            kind, sale_id = "добавление", db.add_sale(day, revenue, transactions, None, branch_id, "", 1)
+            success = sale_id is not None
+            if success:
+                sale_ids.append(sale_id)
+        elif roll < 0.8:
+            kind = "исправление"
+            success = db.update_sale(rng.choice(sale_ids), day, revenue, transactions, None, branch_id, "", 1) is not None
+        else:
+            kind = "отчёт"
+            success = db.get_period_totals(None, (today - timedelta(days=30)).isoformat(), today.isoformat()) is not None
+        results.append((kind, time.perf_counter() - operation_started, success))
+        time.sleep(rng.uniform(0, 0.002))  # пауза кассира между операциями
+    return started, time.time(), results
+
+
+def bench_concurrency(clerks=(1, 4, 8, 16), operations=200):
+    """Одновременная работа кассиров в отдельных процессах с одной базой:
+    прежний режим (rollback-журнал без повторов) против WAL с ожиданием и повторами"""
+    today = datetime.now().date()
+    modes = [
+        ("rollback-журнал, без повторов", {'JOURNAL_MODE': "DELETE", 'WRITE_RETRIES': 0}),
+        ("WAL, ожидание и повторы", {'JOURNAL_MODE': "WAL", 'WRITE_RETRIES': DatabaseManager.WRITE_RETRIES}),
+    ]
+    defaults = {name: getattr(DatabaseManager, name) for name in modes[0][1]}
+    for title, settings in modes:
+        for count in clerks:
+            print(f"Нагрузка: {title}, {count} кассиров × {operations} операций")
+            with tempfile.TemporaryDirectory() as directory:
+                for name, value in settings.items():
+                    setattr(DatabaseManager, name, value)
+                db = create_database(directory, 20, 365, today)
+                for name, value in defaults.items():
+                    setattr(DatabaseManager, name, value)
+                with multiprocessing.Pool(count) as pool:
+                    sessions = pool.starmap(clerk_session, [(db.db_name, settings, operations, seed)
+                                                            for seed in range(count)])
+            elapsed = max(end for _, end, _ in sessions) - min(start for start, _, _ in sessions)
+            results = [result for _, _, session in sessions for result in session]
+            failed = sum(1 for _, _, success in results if not success)
+            print(f"  пропускная способность: {len(results) / elapsed:.0f} операций/с, ошибок: {failed}")
+            for kind in ("добавление", "исправление", "отчёт"):
+                latencies = np.array([latency for result_kind, latency, _ in results if result_kind == kind]) * 1000
+                if len(latencies):
+                    print(f"  {kind}: p50 {np.percentile(latencies, 50):.1f} мс, "
+                          f"p99 {np.percentile(latencies, 99):.1f} мс")
+
+
+def run_service(db_name, port):
+    SalesService(DatabaseManager(db_name)).run(port=port)
+
+
+def bench_service(calls=300, port=8799):
+    """Локальная служба: вызовы через постоянное соединение, с новым соединением на вызов и пакетами"""
+    today = datetime.now().date()
+    print(f"Служба HTTP/JSON: {calls} отчётов за месяц")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, 20, 365, today)
+        service = multiprocessing.Process(target=run_service, args=(db.db_name, port), daemon=True)
+        service.start()
+        try:
+            client = ServiceClient(port=port)
+            while not client.ping():
+                time.sleep(0.05)
+            params = (None, (today - timedelta(days=30)).isoformat(), today.isoformat())
+            measure("напрямую через DatabaseManager", lambda: [db.get_period_totals(*params) for _ in range(calls)])
+            measure("по одному вызову, keep-alive", lambda: [client.call('get_period_totals', *params)
+                                                            for _ in range(calls)])
+            measure("новое соединение на вызов", lambda: [ServiceClient(port=port).call('get_period_totals', *params)
+                                                         for _ in range(calls)])
+            measure("пакетами по 50 вызовов", lambda: [client.batch([('get_period_totals', params)] * 50)
+                                                       for _ in range(calls // 50)])
+        finally:
+            service.terminate()
+            service.join()
+
+
+def bench_sync(branches=50, changes=100):
+    """Перенос базы филиала в центральную: первая синхронизация против переноса changes новых изменений"""
+    today = datetime.now().date()
+    for days in (500, 4000):
+        print(f"Синхронизация: {branches * days} записей, затем {changes} изменений")
+        with tempfile.TemporaryDirectory() as directory:
+            source = create_database(directory, branches, days, today)
+            central = DatabaseManager(os.path.join(directory, "central.db"))
+            replicator = BranchReplicator(source, central)
+            measure("первая синхронизация (все строки)", replicator.sync)
+            for number in range(changes):
+                source.add_sale(today.isoformat(), 1000 + number, 10, None, random.randint(1, branches), "", 1)
+            measure(f"синхронизация {changes} изменений", replicator.sync)
+            measure("повторная синхронизация без изменений", replicator.sync, repeat=5)
+
+
+def bench_entry(sales=200, batch=20):
+    """Ввод продаж подряд: отдельная транзакция на продажу против пачек быстрого ввода"""
+    today = datetime.now().date()
+    rows = [(today.isoformat(), 100 + number, 2, None, 1, "", 1) for number in range(sales)]
+    print(f"Ввод продаж: {sales} чеков, пачки по {batch}")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, 10, 365, today)
+        measure("транзакция на каждую продажу", lambda: [db.add_sale(*row) for row in rows])
+        measure("пачками add_sales", lambda: [db.add_sales(rows[start:start + batch])
+                                              for start in range(0, sales, batch)])
+
+
+def bench_archive(branches=100, days=1800):
+    """Продажи за несколько лет в одной таблице против переноса закрытых лет в архивы"""
+    today = datetime.now().date()
+    print(f"Архив закрытых лет: {branches * days} записей за {days} дней")
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_database(directory, branches, days, today)
+        # Поиск по примечаниям индексом не пользуется и читает всю таблицу продаж
+        scan = "SELECT COUNT(*), SUM(revenue_kopecks) FROM sales_records WHERE notes LIKE '%заказ%'"
+        for title in ("вся история в sales_records", "закрытые годы в архивах"):
+            print(f" {title}:")
+            measure("полный просмотр sales_records", lambda: db.execute_query(scan), repeat=5)
+            measure("продажи за всю историю (get_all_sales)", db.get_all_sales)
+            measure("VACUUM основной базы", lambda: db.execute_query("VACUUM"))
+            if title.startswith("вся"):
+                years = db.get_archivable_years()
+                measure(f"перенос в архив {len(years)} лет", lambda: [db.archive_sales(year) for year in years])
+
+
+BENCHMARKS = {
+    "forecast": bench_forecast,
+    "snapshot": bench_snapshot,
+    "cold_start": bench_cold_start,
+    "memory": bench_memory,
+    "schema": bench_schema,
+    "cache": bench_cache,
+    "concurrency": bench_concurrency,
+    "service": bench_service,
+    "sync": bench_sync,
+    "entry": bench_entry,
+    "archive": bench_archive,
+}
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    np.random.seed(1)
+    for name in sys.argv[1:] or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Неизвестный замер: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
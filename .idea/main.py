@@ -1,12 +1,23 @@
+import os
 import sys
+import json
 import math
 import sqlite3
 import random
+import threading
+import uuid
+import time
+import asyncio
+import inspect
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFrame, QMessageBox, QTabWidget, QTableWidget, QTableWidgetItem, QDateEdit, QDoubleSpinBox, QDialog, QHeaderView, QFormLayout, QGroupBox, QComboBox, QProgressBar,QSpinBox, QTextEdit)
-from PySide6.QtCore import Qt, QDate, QTimer
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFrame, QMessageBox, QTabWidget, QTableWidget, QTableWidgetItem, QDateEdit, QDoubleSpinBox, QDialog, QHeaderView, QFormLayout, QGroupBox, QComboBox, QProgressBar,QSpinBox, QTextEdit, QCheckBox)
+from PySide6.QtCore import Qt, QDate, QTimer, QObject, QRunnable, QThreadPool, Signal
 from PySide6.QtGui import QFont, QPainter, QLinearGradient, QColor, QPen, QRadialGradient, QRegularExpressionValidator
 from PySide6.QtCore import QRegularExpression
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
@@ -21,13 +32,102 @@ except ImportError:
     print("Предупреждение: openpyxl не установлен. Экспорт в Excel будет недоступен.")
 
 class DatabaseManager:
+    # Кеш результатов запросов к редко меняющимся таблицам, общий для всех экземпляров (каждое окно создаёт
+    # свой DatabaseManager): (БД, запрос, параметры) -> (версии таблиц при чтении, строки). Запись в таблицу
+    # увеличивает её версию, и прочитанные до этого результаты больше не выдаются
+    QUERY_CACHE_SIZE = 256
+    _query_cache = OrderedDict()
+    _table_versions = {}
+    _cache_stats = {}
+    _cache_lock = threading.Lock()
+    # Словари id -> имя по таблицам (get_name_map): (БД, таблица) -> (версия таблицы, словарь)
+    NAME_QUERIES = {
+        'branches': "SELECT id, name FROM branches",
+        'employees': "SELECT id, name FROM employees",
+        'users': "SELECT id, full_name FROM users",
+    }
+    _name_maps = {}
+    # Годы архивов по имени БД: (версия таблицы sales_archives, годы); проверяются при каждом вводе продажи
+    _archived_years = {}
+    # Подписчики на изменения продаж по имени БД (куб продаж и другие представления в памяти)
+    _sale_listeners = {}
+    # Подписчики на любую зафиксированную через DatabaseManager запись по имени БД (шина изменений)
+    _write_listeners = {}
+    # Версия схемы в PRAGMA user_version; migrate_schema доводит до неё базы, созданные раньше
+    SCHEMA_VERSION = 1
+    # Номер дня 1970-01-01 в григорианском календаре: даты продаж хранятся номерами дней от этой даты
+    EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+    # Средний чек в рублях по выручке в копейках и числу транзакций (для строк и итогов за период)
+    AVERAGE_CHECK_SQL = "CASE WHEN transactions > 0 THEN revenue_kopecks / 100.0 / transactions ELSE 0 END"
+    # Несколько процессов с одной базой: в режиме WAL чтение не ждёт записи; занятую базу подключение ждёт
+    # BUSY_TIMEOUT секунд, затем запрос повторяется до WRITE_RETRIES раз с растущей паузой от RETRY_DELAY.
+    # WAL требует общей памяти процессов одного компьютера и на сетевом диске (SMB, NFS) портит базу -
+    # там используется NETWORK_JOURNAL_MODE, а ожидание занятой базы остаётся тем же
+    JOURNAL_MODE = "WAL"
+    NETWORK_JOURNAL_MODE = "DELETE"
+    NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'ceph', 'glusterfs',
+                           'fuse.glusterfs', 'fuse.sshfs', 'lustre', 'gpfs'}
+    BUSY_TIMEOUT = 5.0
+    WRITE_RETRIES = 4
+    RETRY_DELAY = 0.05
+    # Ссылки на удаляемый филиал снимаются порциями по BRANCH_DELETE_BATCH строк в отдельных транзакциях,
+    # между которыми другие подключения получают BRANCH_DELETE_PAUSE секунд на свою запись
+    BRANCH_DELETE_BATCH = 1000
+    BRANCH_DELETE_PAUSE = 0.01
+    # Продажи перенесённого в архив года удаляются из sales_records так же - порциями с паузами
+    ARCHIVE_DELETE_BATCH = 1000
+    ARCHIVE_DELETE_PAUSE = 0.01
+
+    # Клиент локальной службы (ServiceClient); если задан, DatabaseManager() создаёт ServiceDatabaseManager
+    service = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls is DatabaseManager and cls.service is not None:
+            cls = ServiceDatabaseManager
+        return super().__new__(cls)
+
     def __init__(self, db_name="sales_system.db"):
         self.db_name = db_name
         self.init_database()
 
+    @classmethod
+    def is_network_path(cls, path):
+        """Файл на сетевом диске: UNC-путь или сетевой диск Windows, сетевая файловая система в /proc/mounts
+        (Linux); где тип файловой системы не узнать, файл считается локальным"""
+        path = os.path.realpath(path)
+        if os.name == 'nt':
+            if path.startswith('\\\\'):
+                return True
+            import ctypes
+            drive = os.path.splitdrive(path)[0]
+            return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4  # DRIVE_REMOTE
+        try:
+            with open('/proc/mounts', encoding='utf-8') as mounts:
+                entries = [line.split()[1:3] for line in mounts if len(line.split()) > 2]
+        except OSError:
+            return False
+        # Файловая система пути - та, что смонтирована в самый длинный подходящий каталог
+        fs_type = None
+        length = -1
+        for mount_point, mount_type in entries:
+            mount_point = mount_point.replace('\\040', ' ')
+            if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > length:
+                fs_type, length = mount_type, len(mount_point)
+        return fs_type in cls.NETWORK_FILESYSTEMS
+
+    def journal_mode(self):
+        return self.NETWORK_JOURNAL_MODE if self.is_network_path(self.db_name) else self.JOURNAL_MODE
+
     def init_database(self):
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self.get_connection()
+            journal_mode = self.journal_mode()
+            try:
+                conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            except sqlite3.OperationalError as e:
+                # Режим журнала не меняется, пока базу держат другие подключения; он сохраняется в файле,
+                # поэтому достаточно переключить его при одном из следующих запусков
+                print(f"Не удалось включить режим журнала {journal_mode}: {e}")
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -49,22 +149,7 @@ class DatabaseManager:
                     FOREIGN KEY (branch_id) REFERENCES branches (id) ON DELETE SET NULL
                 )
             ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sales (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
-                    revenue REAL NOT NULL,
-                    transactions INTEGER NOT NULL,
-                    average_check REAL,
-                    employee_id INTEGER,
-                    branch_id INTEGER,
-                    notes TEXT,
-                    user_id INTEGER NOT NULL,
-                    FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE SET NULL,
-                    FOREIGN KEY (branch_id) REFERENCES branches (id) ON DELETE SET NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
+            self.create_sales_records(cursor)
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS branches (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -87,20 +172,207 @@ class DatabaseManager:
                     FOREIGN KEY (branch_id) REFERENCES branches (id) ON DELETE CASCADE
                 )
             ''')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS idx_sales_plans_branch_period ON sales_plans (branch_id, year, month)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_plans_period ON sales_plans (year, month)')
+            self.migrate_schema(cursor)
+            # Дневные итоги по филиалам и сотрудникам (0 - филиал/сотрудник не указан),
+            # поддерживаются триггерами на sales и всегда совпадают с исходными данными
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_sales (
+                    branch_id INTEGER NOT NULL,
+                    employee_id INTEGER NOT NULL,
+                    day INTEGER NOT NULL,
+                    revenue_kopecks INTEGER NOT NULL DEFAULT 0,
+                    transactions INTEGER NOT NULL DEFAULT 0,
+                    sales_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (branch_id, employee_id, day)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_sales_day ON daily_sales (day, branch_id)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS branch_monthly_totals (
+                    branch_id INTEGER NOT NULL,
+                    year INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    revenue_kopecks INTEGER NOT NULL DEFAULT 0,
+                    transactions INTEGER NOT NULL DEFAULT 0,
+                    sales_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (branch_id, year, month)
+                )
+            ''')
+            # Ожидаемая дневная выручка филиала по дням недели (weekday_0 - понедельник),
+            # пересчитывается SalesForecaster раз в день сразу для всех филиалов
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sales_forecasts (
+                    branch_id INTEGER PRIMARY KEY,
+                    computed_on TEXT NOT NULL,
+                    weekday_0 REAL NOT NULL DEFAULT 0,
+                    weekday_1 REAL NOT NULL DEFAULT 0,
+                    weekday_2 REAL NOT NULL DEFAULT 0,
+                    weekday_3 REAL NOT NULL DEFAULT 0,
+                    weekday_4 REAL NOT NULL DEFAULT 0,
+                    weekday_5 REAL NOT NULL DEFAULT 0,
+                    weekday_6 REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            # Состояние потокового детектора отклонений по филиалам и отмеченные им дни (AnomalyDetector)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS anomaly_state (
+                    branch_id INTEGER PRIMARY KEY,
+                    open_date TEXT,
+                    day_revenue REAL NOT NULL DEFAULT 0,
+                    day_transactions INTEGER NOT NULL DEFAULT 0,
+                    days_seen INTEGER NOT NULL DEFAULT 0,
+                    revenue_mean REAL NOT NULL DEFAULT 0,
+                    revenue_var REAL NOT NULL DEFAULT 0,
+                    check_mean REAL NOT NULL DEFAULT 0,
+                    check_var REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS revenue_anomalies (
+                    branch_id INTEGER NOT NULL,
+                    date TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    expected REAL NOT NULL,
+                    score REAL NOT NULL,
+                    PRIMARY KEY (branch_id, date, metric)
+                )
+            ''')
+            # Служебные сведения о базе; instance_id отличает пересозданную базу с тем же именем файла
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS database_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO database_info (key, value) VALUES ('instance_id', ?)",
+                           (uuid.uuid4().hex,))
+            # Копия файла получает тот же instance_id: файл, в котором база создана, запоминается, чтобы
+            # синхронизация отказывалась работать с копией, пока ей не задан свой id (set_instance)
+            cursor.execute("INSERT OR IGNORE INTO database_info (key, value) VALUES ('instance_file', ?)",
+                           (self.file_identity(),))
+            # Центральная база, в которую BranchReplicator переносит изменения баз филиалов: номера последних
+            # перенесённых записей журналов каждого источника и соответствие id строк источника своим id
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS replication_sources (
+                    source TEXT PRIMARY KEY,
+                    sales_seq INTEGER NOT NULL,
+                    data_seq INTEGER NOT NULL,
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS replication_map (
+                    source TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    source_id INTEGER NOT NULL,
+                    central_id INTEGER NOT NULL,
+                    PRIMARY KEY (source, table_name, source_id)
+                )
+            ''')
+            # Изменения источника, которые нельзя перенести: продажи года, уже перенесённого в архив
+            # центральной базы, не меняются - такие изменения пропускаются и остаются здесь для разбора
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS replication_conflicts (
+                    source TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    source_id INTEGER NOT NULL,
+                    op TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (source, table_name, source_id)
+                )
+            ''')
+            # Архивы закрытых лет (archive_sales): файл рядом с основной базой и состояние переноса -
+            # 'copying', пока продажи копируются, 'removing', пока они порциями удаляются из sales_records,
+            # и 'done', когда удалены все
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sales_archives (
+                    year INTEGER PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'copying',
+                    sales_count INTEGER NOT NULL DEFAULT 0,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Журнал изменённых продаж: по номеру seq сохранённый снимок продаж догружает только новые изменения
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sales_change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sale_id INTEGER NOT NULL,
+                    op TEXT NOT NULL DEFAULT 'update'
+                )
+            ''')
+            # Такой же журнал для справочников: по нему шина изменений сообщает окнам, какие строки изменились
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS data_change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    op TEXT NOT NULL
+                )
+            ''')
+            # Прежняя таблица sales для сторонних отчётов и скриптов. Постоянное представление не может читать
+            # подключаемые архивы, поэтому в нём только продажи основной базы - без лет, перенесённых в архив
+            # (archive_sales); ту же выборку по всей истории даёт временное представление all_sales
+            # на подключениях с архивами (execute_query(..., with_archives=True))
+            cursor.execute(f'''
+                CREATE VIEW IF NOT EXISTS sales AS
+                SELECT id, {self.sql_date('day')} AS date, revenue_kopecks / 100.0 AS revenue, transactions,
+                       average_check, employee_id, branch_id, notes, user_id
+                FROM sales_records
+            ''')
+            for statement in (self.sales_view_triggers() + self.sales_rollup_triggers()
+                              + self.sales_change_log_triggers() + self.data_change_log_triggers()
+                              + self.sales_archive_triggers()):
+                cursor.execute(statement)
             cursor.execute('''
                 INSERT OR IGNORE INTO users (full_name, email, password, role)
                 VALUES (?, ?, ?, ?)
             ''', ('Администратор', 'admin@system.com', 'admin123', 'admin'))
+            # Первичное заполнение итогов для базы, созданной до их появления
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM daily_sales), EXISTS (SELECT 1 FROM sales_records)')
+            totals_filled, has_sales = cursor.fetchone()
+            if has_sales and not totals_filled:
+                self.rebuild_daily_sales(cursor)
             conn.commit()
             conn.close()
         except Exception as e:
             print(f"Ошибка инициализации БД: {e}")
 
+    def create_sales_records(self, cursor, schema="main"):
+        """Таблица продаж в основной базе или в подключённом архиве schema.
+        Суммы в целых копейках, дата - номер дня от 1970-01-01 (точные суммы, компактные индексы); прежний вид
+        с датой-строкой и суммами в рублях даёт представление sales. Средний чек не хранится, а вычисляется
+        SQLite из выручки и числа транзакций"""
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.sales_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                day INTEGER NOT NULL,
+                revenue_kopecks INTEGER NOT NULL,
+                transactions INTEGER NOT NULL,
+                employee_id INTEGER,
+                branch_id INTEGER,
+                notes TEXT,
+                user_id INTEGER NOT NULL,
+                average_check REAL GENERATED ALWAYS AS ({self.AVERAGE_CHECK_SQL}) VIRTUAL,
+                FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE SET NULL,
+                FOREIGN KEY (branch_id) REFERENCES branches (id) ON DELETE SET NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_sales_records_day ON sales_records (day)')
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {schema}.idx_sales_records_branch_day ON sales_records (branch_id, day)')
+
     def create_user(self, full_name, email, password, role='employee'):
         try:
             if self.user_exists(email):
                 return False, "Пользователь с таким email уже существует"
-            conn = sqlite3.connect(self.db_name)
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO users (full_name, email, password, role)
@@ -108,6 +380,7 @@ class DatabaseManager:
             ''', (full_name, email, password, role))
             conn.commit()
             conn.close()
+            self.invalidate_tables('users')
             return True, "Пользователь успешно создан"
         except sqlite3.IntegrityError:
             return False, "Пользователь с таким email уже существует"
@@ -116,7 +389,7 @@ class DatabaseManager:
 
     def authenticate_user(self, email, password):
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, full_name, email, role FROM users 
@@ -131,7 +404,7 @@ class DatabaseManager:
 
     def user_exists(self, email):
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
             user = cursor.fetchone()
@@ -141,83 +414,1104 @@ class DatabaseManager:
             print(f"Ошибка при проверке пользователя: {e}")
             return False
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_name)
+    def get_connection(self, with_archives=False):
+        # Транзакция записи сразу берёт блокировку (BEGIN IMMEDIATE): ожидание занятой базы происходит
+        # до начала изменений, а не при повышении чтения до записи, где SQLite ошибается без ожидания
+        conn = sqlite3.connect(self.db_name, timeout=self.BUSY_TIMEOUT, isolation_level='IMMEDIATE')
+        if with_archives:
+            try:
+                self.attach_archives(conn)
+            except Exception:
+                conn.close()
+                raise
+        return conn
+
+    # Столбцы sales_records, которые копируются в архив и объединяются с ним (без вычисляемого среднего чека)
+    SALE_RECORD_FIELDS = "id, day, revenue_kopecks, transactions, employee_id, branch_id, notes, user_id"
+
+    def archive_path(self, file_name):
+        """Путь к файлу архива: архивы лежат рядом с основной базой"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_name)), file_name)
+
+    def attach_archives(self, conn):
+        """Подключение архивов закрытых лет и временного представления all_sales_records - продаж
+        основной базы и всех архивов (all_sales - то же в столбцах прежней таблицы sales). Архивы подключают
+        только запросы по всей истории: запросы за текущий период читают sales_records и итоги основной базы
+        и файлы архивов не открывают"""
+        fields = f"{self.SALE_RECORD_FIELDS}, average_check"
+        selects = [f"SELECT {fields} FROM main.sales_records"]
+        archives = conn.execute("SELECT year, file, status FROM sales_archives WHERE status IN ('removing', 'done') "
+                                "ORDER BY year").fetchall()
+        for year, file_name, status in archives:
+            conn.execute(f"ATTACH DATABASE ? AS archive_{year}", (self.archive_path(file_name),))
+            selects.append(f"SELECT {fields} FROM archive_{year}.sales_records a{self.not_in_main(status)}")
+        conn.execute(f"CREATE TEMP VIEW all_sales_records AS {' UNION ALL '.join(selects)}")
+        conn.execute(f'''
+            CREATE TEMP VIEW all_sales AS
+            SELECT id, {self.sql_date('day')} AS date, revenue_kopecks / 100.0 AS revenue, transactions,
+                   average_check, employee_id, branch_id, notes, user_id
+            FROM all_sales_records
+        ''')
+
+    @staticmethod
+    def not_in_main(status):
+        """Условие на строки архива a: пока продажи удаляются из sales_records порциями ('removing'),
+        ещё не удалённые читаются из основной базы, а из архива - только остальные"""
+        if status != 'removing':
+            return ""
+        return " WHERE NOT EXISTS (SELECT 1 FROM main.sales_records m WHERE m.id = a.id)"
+
+    @staticmethod
+    def is_busy_error(error):
+        """Ошибка из-за занятой другим подключением базы ("database is locked")"""
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is None:
+            return 'locked' in str(error) or 'busy' in str(error)
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+    def run_with_retry(self, attempt):
+        """attempt() с повторами, пока база занята; пауза удваивается и случайно растягивается,
+        чтобы ожидающие процессы не повторяли запись одновременно"""
+        for retry in range(self.WRITE_RETRIES + 1):
+            try:
+                return attempt()
+            except sqlite3.OperationalError as e:
+                if retry == self.WRITE_RETRIES or not self.is_busy_error(e):
+                    raise
+                time.sleep(self.RETRY_DELAY * 2 ** retry * random.uniform(0.5, 1.5))
+
+    def execute_query(self, query, params=(), with_archives=False):
+        """Выполнение запроса; with_archives - с подключёнными архивами и представлением all_sales_records"""
+        def attempt():
+            conn = self.get_connection(with_archives)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                conn.commit()
+                return cursor.fetchall(), conn.total_changes
+            finally:
+                conn.close()
 
-    def execute_query(self, query, params=()):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-            result = cursor.fetchall()
-            conn.close()
-            return result
+            result, changed = self.run_with_retry(attempt)
         except Exception as e:
             print(f"Ошибка выполнения запроса: {str(e)}")
             return None
+        if changed:
+            self.notify_write_listeners()
+        return result
+
+    def cached_query(self, tables, query, params=()):
+        """execute_query с кешем; tables - таблицы, от которых зависит результат"""
+        key = (self.db_name, query, tuple(params))
+        with self._cache_lock:
+            versions = tuple(self._table_versions.get((self.db_name, table), 0) for table in tables)
+            stats = self._cache_stats.setdefault(self.db_name, {'hits': 0, 'misses': 0})
+            entry = self._query_cache.get(key)
+            if entry is not None and entry[0] == versions:
+                self._query_cache.move_to_end(key)
+                stats['hits'] += 1
+                return list(entry[1])
+            stats['misses'] += 1
+        rows = self.execute_query(query, params)
+        if rows is not None:
+            with self._cache_lock:
+                # Версии взяты до чтения: если таблицу изменили во время запроса, запись сразу окажется устаревшей
+                self._query_cache[key] = (versions, rows)
+                self._query_cache.move_to_end(key)
+                while len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+            rows = list(rows)
+        return rows
+
+    def invalidate_tables(self, *tables):
+        """Отметка записи в таблицы: закешированные по ним результаты устаревают"""
+        with self._cache_lock:
+            for table in tables:
+                key = (self.db_name, table)
+                self._table_versions[key] = self._table_versions.get(key, 0) + 1
+
+    def cache_stats(self):
+        """Счётчики кеша запросов по этой БД: {'hits', 'misses', 'size'}"""
+        with self._cache_lock:
+            stats = dict(self._cache_stats.get(self.db_name, {'hits': 0, 'misses': 0}))
+            stats['size'] = sum(1 for key in self._query_cache if key[0] == self.db_name)
+        return stats
+
+    def execute_transaction(self, operation, with_archives=False):
+        """Выполнение operation(cursor) в одной транзакции; None при ошибке.
+        Если база занята, транзакция откатывается и operation выполняется заново"""
+        def attempt():
+            conn = self.get_connection(with_archives)
+            try:
+                cursor = conn.cursor()
+                result = operation(cursor)
+                conn.commit()
+                return result, conn.total_changes
+            finally:
+                conn.close()
+
+        try:
+            result, changed = self.run_with_retry(attempt)
+        except Exception as e:
+            print(f"Ошибка выполнения запроса: {str(e)}")
+            return None
+        if changed:
+            self.notify_write_listeners()
+        return result
+
+    @classmethod
+    def to_day(cls, date):
+        """Дата ('YYYY-MM-DD', date или datetime) в номер дня от 1970-01-01"""
+        if isinstance(date, str):
+            date = datetime.strptime(date, "%Y-%m-%d")
+        return date.toordinal() - cls.EPOCH_ORDINAL
+
+    @classmethod
+    def from_day(cls, day):
+        """Номер дня от 1970-01-01 в строку 'YYYY-MM-DD'"""
+        return datetime.fromordinal(day + cls.EPOCH_ORDINAL).strftime("%Y-%m-%d")
+
+    @staticmethod
+    def to_kopecks(amount):
+        """Сумма в рублях в целые копейки; None остаётся None"""
+        return None if amount is None else int(round(amount * 100))
+
+    @staticmethod
+    def sql_date(day):
+        """SQL-выражение: номер дня в строку 'YYYY-MM-DD'"""
+        return f"date({day} * 86400, 'unixepoch')"
+
+    @staticmethod
+    def sql_day(date):
+        """SQL-выражение: строка 'YYYY-MM-DD' в номер дня"""
+        return f"CAST(julianday({date}) - 2440587.5 AS INTEGER)"
+
+    @staticmethod
+    def sql_kopecks(amount):
+        """SQL-выражение: сумма в рублях в целые копейки"""
+        return f"CAST(round({amount} * 100) AS INTEGER)"
+
+    def migrate_schema(self, cursor):
+        """Обновление схемы базы, созданной прежней версией программы, до SCHEMA_VERSION"""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # Таблица sales с датами-строками и суммами REAL переносится в sales_records,
+            # на её месте остаётся представление; итоги пересчитываются в копейках
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = 'sales'")
+            row = cursor.fetchone()
+            if row and row[0] == 'table':
+                # Перенос - одна транзакция: при ошибке прежняя таблица остаётся как была
+                if not cursor.connection.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                # Строки, которые не переносятся без искажения (дата не 'YYYY-MM-DD', сумма или число транзакций
+                # не число), миграцию не останавливают: они как есть откладываются в sales_migration_rejects,
+                # откуда их можно исправить и добавить вручную
+                valid = ("COALESCE(date(date) = substr(date, 1, 10), 0) AND typeof(revenue) IN ('integer', 'real') "
+                         "AND typeof(transactions) = 'integer'")
+                cursor.execute(f"SELECT COUNT(*) FROM sales WHERE NOT ({valid})")
+                rejected = cursor.fetchone()[0]
+                if rejected:
+                    cursor.execute("CREATE TABLE IF NOT EXISTS sales_migration_rejects AS SELECT * FROM sales WHERE 0")
+                    cursor.execute(f"INSERT INTO sales_migration_rejects SELECT * FROM sales WHERE NOT ({valid})")
+                    print(f"Миграция продаж: {rejected} строк с некорректной датой или суммой не перенесены "
+                          f"и сохранены в таблице sales_migration_rejects")
+                cursor.execute(f'''
+                    INSERT INTO sales_records (id, day, revenue_kopecks, transactions, employee_id, branch_id, notes,
+                                               user_id)
+                    SELECT id, {self.sql_day('date')}, {self.sql_kopecks('revenue')}, transactions, employee_id,
+                           branch_id, notes, user_id
+                    FROM sales WHERE {valid}
+                ''')
+                # Счётчик id продолжается с прежнего значения, чтобы id удалённых продаж не выдавались повторно
+                cursor.execute('''
+                    UPDATE sqlite_sequence
+                    SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'sales'), 0))
+                    WHERE name = 'sales_records'
+                ''')
+                cursor.execute('''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT 'sales_records', seq FROM sqlite_sequence
+                    WHERE name = 'sales' AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'sales_records')
+                ''')
+                cursor.execute("DROP TABLE sales")
+        cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    @classmethod
+    def sales_view_triggers(cls):
+        """Триггеры, передающие запись в представление sales в таблицу sales_records
+        (записанный в представление средний чек не используется - он вычисляется)"""
+        def values(row):
+            return f'''{cls.sql_day(f'{row}.date')}, {cls.sql_kopecks(f'{row}.revenue')}, {row}.transactions,
+                       {row}.employee_id, {row}.branch_id, {row}.notes, {row}.user_id'''
+
+        return [
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_view_insert INSTEAD OF INSERT ON sales
+                BEGIN
+                    INSERT INTO sales_records (id, day, revenue_kopecks, transactions, employee_id, branch_id, notes,
+                                               user_id)
+                    VALUES (NEW.id, {values('NEW')});
+                END''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_view_update INSTEAD OF UPDATE ON sales
+                BEGIN
+                    UPDATE sales_records
+                    SET (id, day, revenue_kopecks, transactions, employee_id, branch_id, notes, user_id) =
+                        (NEW.id, {values('NEW')})
+                    WHERE id = OLD.id;
+                END''',
+            '''CREATE TRIGGER IF NOT EXISTS trg_sales_view_delete INSTEAD OF DELETE ON sales
+               BEGIN DELETE FROM sales_records WHERE id = OLD.id; END''',
+        ]
+
+    @staticmethod
+    def sales_rollup_triggers():
+        """Триггеры, переносящие каждое изменение sales_records в daily_sales и branch_monthly_totals"""
+        def add_row(row, sign):
+            return f'''
+                INSERT INTO daily_sales (branch_id, employee_id, day, revenue_kopecks, transactions, sales_count)
+                VALUES (COALESCE({row}.branch_id, 0), COALESCE({row}.employee_id, 0), {row}.day,
+                        {sign}{row}.revenue_kopecks, {sign}{row}.transactions, {sign}1)
+                ON CONFLICT (branch_id, employee_id, day) DO UPDATE SET
+                    revenue_kopecks = revenue_kopecks + excluded.revenue_kopecks,
+                    transactions = transactions + excluded.transactions,
+                    sales_count = sales_count + excluded.sales_count;
+                INSERT INTO branch_monthly_totals (branch_id, year, month, revenue_kopecks, transactions, sales_count)
+                VALUES (COALESCE({row}.branch_id, 0), CAST(strftime('%Y', {row}.day * 86400, 'unixepoch') AS INTEGER),
+                        CAST(strftime('%m', {row}.day * 86400, 'unixepoch') AS INTEGER), {sign}{row}.revenue_kopecks,
+                        {sign}{row}.transactions, {sign}1)
+                ON CONFLICT (branch_id, year, month) DO UPDATE SET
+                    revenue_kopecks = revenue_kopecks + excluded.revenue_kopecks,
+                    transactions = transactions + excluded.transactions,
+                    sales_count = sales_count + excluded.sales_count;
+            '''
+
+        def remove_row(row):
+            return add_row(row, '-') + f'''
+                DELETE FROM daily_sales
+                WHERE branch_id = COALESCE({row}.branch_id, 0) AND employee_id = COALESCE({row}.employee_id, 0)
+                      AND day = {row}.day AND sales_count <= 0;
+                DELETE FROM branch_monthly_totals
+                WHERE branch_id = COALESCE({row}.branch_id, 0)
+                      AND year = CAST(strftime('%Y', {row}.day * 86400, 'unixepoch') AS INTEGER)
+                      AND month = CAST(strftime('%m', {row}.day * 86400, 'unixepoch') AS INTEGER)
+                      AND sales_count <= 0;
+            '''
+
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_insert AFTER INSERT ON sales_records "
+            f"BEGIN {add_row('NEW', '')} END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_delete AFTER DELETE ON sales_records "
+            f"WHEN NOT {DatabaseManager.ARCHIVING_SQL} BEGIN {remove_row('OLD')} END",
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_update
+                AFTER UPDATE OF day, revenue_kopecks, transactions, employee_id, branch_id ON sales_records
+                BEGIN {remove_row('OLD')} {add_row('NEW', '')} END''',
+        ]
+
+    @staticmethod
+    def sales_change_log_triggers():
+        """Триггеры, записывающие id и вид ('insert', 'update', 'delete') каждого изменения продажи
+        в sales_change_log"""
+        return [
+            '''CREATE TRIGGER IF NOT EXISTS trg_sales_log_insert AFTER INSERT ON sales_records
+               BEGIN INSERT INTO sales_change_log (sale_id, op) VALUES (NEW.id, 'insert'); END''',
+            '''CREATE TRIGGER IF NOT EXISTS trg_sales_log_update AFTER UPDATE ON sales_records
+               BEGIN
+                   INSERT INTO sales_change_log (sale_id, op)
+                   VALUES (OLD.id, CASE WHEN NEW.id = OLD.id THEN 'update' ELSE 'delete' END);
+                   INSERT INTO sales_change_log (sale_id, op) SELECT NEW.id, 'insert' WHERE NEW.id != OLD.id;
+               END''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_log_delete AFTER DELETE ON sales_records
+                WHEN NOT {DatabaseManager.ARCHIVING_SQL}
+                BEGIN INSERT INTO sales_change_log (sale_id, op) VALUES (OLD.id, 'delete'); END''',
+        ]
+
+    # Признак транзакции archive_sales: строка 'archiving' в database_info видна только ей самой, и пока она есть,
+    # удаление продаж не вычитается из итогов и не попадает в журнал - продажи остаются в архиве
+    ARCHIVING_SQL = "EXISTS (SELECT 1 FROM database_info WHERE key = 'archiving')"
+
+    @staticmethod
+    def sales_archive_triggers():
+        """Триггеры, запрещающие менять продажи года, который переносится или перенесён в архив"""
+        def archived(row):
+            return f'''EXISTS (SELECT 1 FROM sales_archives
+                               WHERE year = CAST(strftime('%Y', {row}.day * 86400, 'unixepoch') AS INTEGER))'''
+
+        message = "RAISE(ABORT, 'Продажи за этот год перенесены в архив и не изменяются')"
+        return [
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_archived_insert BEFORE INSERT ON sales_records
+                WHEN {archived('NEW')} BEGIN SELECT {message}; END''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_archived_update BEFORE UPDATE ON sales_records
+                WHEN {archived('NEW')} OR {archived('OLD')} BEGIN SELECT {message}; END''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_sales_archived_delete BEFORE DELETE ON sales_records
+                WHEN {archived('OLD')} AND NOT {DatabaseManager.ARCHIVING_SQL} BEGIN SELECT {message}; END''',
+        ]
+
+    # Справочники, изменения которых записываются в data_change_log
+    CHANGE_LOG_TABLES = ('branches', 'employees', 'sales_plans', 'users')
+
+    @classmethod
+    def data_change_log_triggers(cls):
+        """Триггеры, записывающие каждое изменение справочников в data_change_log"""
+        triggers = []
+        for table in cls.CHANGE_LOG_TABLES:
+            triggers += [
+                f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_insert AFTER INSERT ON {table}
+                    BEGIN INSERT INTO data_change_log (table_name, row_id, op) VALUES ('{table}', NEW.id, 'insert'); END''',
+                f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_update AFTER UPDATE ON {table}
+                    BEGIN INSERT INTO data_change_log (table_name, row_id, op) VALUES ('{table}', NEW.id, 'update'); END''',
+                f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_log_delete AFTER DELETE ON {table}
+                    BEGIN INSERT INTO data_change_log (table_name, row_id, op) VALUES ('{table}', OLD.id, 'delete'); END''',
+            ]
+        return triggers
+
+    def get_database_info(self, key):
+        rows = self.execute_query("SELECT value FROM database_info WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def file_identity(self):
+        """Индексный узел файла базы: у копии файла он другой ('0' - файловая система его не даёт)"""
+        return str(os.stat(self.db_name).st_ino)
+
+    def is_copied_file(self):
+        """База открыта не из того файла, в котором создана: копия другой базы, перенос или восстановление
+        из резервной копии; None при ошибке"""
+        stored = self.get_database_info('instance_file')
+        if stored is None:
+            return None
+        return stored != '0' and stored != self.file_identity()
+
+    def set_instance(self, reset):
+        """Запоминание текущего файла базы после копирования: reset - копия становится отдельной базой
+        с новым instance_id, иначе id сохраняется (та же база перенесена или восстановлена)"""
+        def update(cursor):
+            if reset:
+                cursor.execute("UPDATE database_info SET value = ? WHERE key = 'instance_id'", (uuid.uuid4().hex,))
+            cursor.execute("INSERT OR REPLACE INTO database_info (key, value) VALUES ('instance_file', ?)",
+                           (self.file_identity(),))
+            return True
+
+        return self.execute_transaction(update)
+
+    def get_sales_change_seq(self):
+        """Номер последнего изменения sales (не уменьшается и при очистке журнала)"""
+        rows = self.execute_query("SELECT seq FROM sqlite_sequence WHERE name = 'sales_change_log'")
+        return rows[0][0] if rows else 0
+
+    def get_sales_changes(self, after_seq):
+        """Изменения sales после номера after_seq: [(seq, sale_id, op)] по возрастанию seq"""
+        return self.execute_query("SELECT seq, sale_id, op FROM sales_change_log WHERE seq > ? ORDER BY seq",
+                                  (after_seq,))
+
+    def get_change_log_floor(self, log):
+        """Номер, до которого включительно журнал log ('sales' или 'data') очищен; читатель с меньшим
+        номером последнего учтённого изменения пропустил записи и должен перечитать данные целиком"""
+        return int(self.get_database_info(f'{log}_log_floor') or 0)
+
+    def trim_change_logs(self, sales_seq, data_seq):
+        """Удаление записей журналов изменений до номеров sales_seq и data_seq включительно"""
+        def trim(cursor):
+            cursor.execute("DELETE FROM sales_change_log WHERE seq <= ?", (sales_seq,))
+            cursor.execute("DELETE FROM data_change_log WHERE seq <= ?", (data_seq,))
+            for log, seq in [('sales', sales_seq), ('data', data_seq)]:
+                cursor.execute('''
+                    INSERT INTO database_info (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))
+                ''', (f'{log}_log_floor', seq))
+            return True
+
+        return self.execute_transaction(trim)
+
+    def get_change_seqs(self):
+        """Номера последних изменений (sales_change_log, data_change_log) одним запросом; None при ошибке"""
+        rows = self.execute_query(
+            "SELECT name, seq FROM sqlite_sequence WHERE name IN ('sales_change_log', 'data_change_log')")
+        if rows is None:
+            return None
+        seqs = dict(rows)
+        return seqs.get('sales_change_log', 0), seqs.get('data_change_log', 0)
+
+    def get_data_changes(self, after_seq):
+        """Изменения справочников после номера after_seq: [(seq, table_name, row_id, op)] по возрастанию seq"""
+        return self.execute_query(
+            "SELECT seq, table_name, row_id, op FROM data_change_log WHERE seq > ? ORDER BY seq", (after_seq,))
+
+    @staticmethod
+    def pending_journal_key(journal_id):
+        """Ключ database_info с номером последней записанной строки журнала очереди продаж journal_id"""
+        return f"pending_journal:{journal_id}"
+
+    def clear_pending_journal(self, journal_id):
+        """Удаление номера записанной строки журнала очереди journal_id, когда в журнале не осталось продаж"""
+        return self.execute_query("DELETE FROM database_info WHERE key = ?", (self.pending_journal_key(journal_id),))
+
+    def get_pending_journal_seq(self, journal_id):
+        """Номер последней записанной в базу строки журнала очереди продаж (0 - ещё ничего); None при ошибке"""
+        rows = self.execute_query("SELECT value FROM database_info WHERE key = ?",
+                                  (self.pending_journal_key(journal_id),))
+        if rows is None:
+            return None
+        return int(rows[0][0]) if rows else 0
+
+    def rebuild_daily_sales(self, cursor=None):
+        """Полный пересчёт daily_sales и месячных итогов по всей истории продаж, включая архивы
+        (при первичном заполнении в init_database архивов ещё нет - читается только sales_records)"""
+        def rebuild(cursor, table="all_sales_records"):
+            cursor.execute("DELETE FROM daily_sales")
+            cursor.execute("DELETE FROM branch_monthly_totals")
+            cursor.execute(f'''
+                INSERT INTO daily_sales (branch_id, employee_id, day, revenue_kopecks, transactions, sales_count)
+                SELECT COALESCE(branch_id, 0), COALESCE(employee_id, 0), day, SUM(revenue_kopecks), SUM(transactions),
+                       COUNT(*)
+                FROM {table} GROUP BY 1, 2, 3
+            ''')
+            cursor.execute('''
+                INSERT INTO branch_monthly_totals (branch_id, year, month, revenue_kopecks, transactions, sales_count)
+                SELECT branch_id, CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER),
+                       CAST(strftime('%m', day * 86400, 'unixepoch') AS INTEGER),
+                       SUM(revenue_kopecks), SUM(transactions), SUM(sales_count)
+                FROM daily_sales GROUP BY 1, 2, 3
+            ''')
+            return []
+
+        if cursor is not None:
+            return rebuild(cursor, "sales_records")
+        return self.execute_transaction(rebuild, with_archives=True)
+
+    def get_daily_totals(self, branch_id, start_date, end_date):
+        """Дневные итоги за период [(date, revenue, transactions)]; branch_id = None - все филиалы"""
+        branch_filter = "AND branch_id = ?" if branch_id else ""
+        params = (self.to_day(start_date), self.to_day(end_date))
+        params += (branch_id,) if branch_id else ()
+        return self.execute_query(f'''
+            SELECT {self.sql_date('day')}, SUM(revenue_kopecks) / 100.0, SUM(transactions) FROM daily_sales
+            WHERE day BETWEEN ? AND ? {branch_filter}
+            GROUP BY day ORDER BY day
+        ''', params)
+
+    def get_monthly_totals(self, branch_id, year):
+        """Месячные итоги за год [(month, revenue, transactions)]; branch_id = None - все филиалы"""
+        if branch_id:
+            query = '''
+                SELECT month, revenue_kopecks / 100.0, transactions FROM branch_monthly_totals
+                WHERE branch_id = ? AND year = ?
+                ORDER BY month
+            '''
+            return self.execute_query(query, (branch_id, year))
+        query = '''
+            SELECT month, SUM(revenue_kopecks) / 100.0, SUM(transactions) FROM branch_monthly_totals
+            WHERE year = ?
+            GROUP BY month ORDER BY month
+        '''
+        return self.execute_query(query, (year,))
+
+    def get_period_totals(self, branch_id, start_date, end_date):
+        """Итоги за период: (revenue, transactions, число дней с продажами, average_check)"""
+        branch_filter = "AND branch_id = ?" if branch_id else ""
+        params = (self.to_day(start_date), self.to_day(end_date))
+        params += (branch_id,) if branch_id else ()
+        rows = self.execute_query(f'''
+            SELECT revenue_kopecks / 100.0, transactions, sales_days, {self.AVERAGE_CHECK_SQL}
+            FROM (
+                SELECT COALESCE(SUM(revenue_kopecks), 0) AS revenue_kopecks,
+                       COALESCE(SUM(transactions), 0) AS transactions, COUNT(DISTINCT day) AS sales_days
+                FROM daily_sales
+                WHERE day BETWEEN ? AND ? {branch_filter}
+            )
+        ''', params)
+        return rows[0] if rows else (0, 0, 0, 0)
+
+    def get_daily_branch_summary(self):
+        """Итоги по дням и филиалам: [(date, branch_name, revenue, transactions, average_check, sales_count)]"""
+        query = f'''
+            SELECT {self.sql_date('day')}, branch_name, revenue_kopecks / 100.0, transactions,
+                   {self.AVERAGE_CHECK_SQL}, sales_count
+            FROM (
+                SELECT d.day, COALESCE(b.name, 'Не указан') AS branch_name, SUM(d.revenue_kopecks) AS revenue_kopecks,
+                       SUM(d.transactions) AS transactions, SUM(d.sales_count) AS sales_count
+                FROM daily_sales d
+                LEFT JOIN branches b ON d.branch_id = b.id
+                GROUP BY d.day, d.branch_id
+            )
+            ORDER BY day DESC, branch_name
+        '''
+        return self.execute_query(query)
+
+    def get_branch_dashboard(self, year, month, until_date):
+        """Сводка по всем филиалам за месяц одним запросом:
+        [(branch_id, name, revenue, transactions, sales_days, daily_plan, monthly_plan, average_check)]"""
+        start_day = self.to_day(datetime(year, month, 1))
+        query = f'''
+            SELECT b.id, b.name,
+                   COALESCE(d.revenue_kopecks, 0) / 100.0, COALESCE(d.transactions, 0), COALESCE(d.sales_days, 0),
+                   COALESCE(p.daily_plan, 0), COALESCE(p.monthly_plan, 0), COALESCE(d.average_check, 0)
+            FROM branches b
+            LEFT JOIN (
+                SELECT branch_id, revenue_kopecks, transactions, sales_days, {self.AVERAGE_CHECK_SQL} AS average_check
+                FROM (
+                    SELECT branch_id, SUM(revenue_kopecks) AS revenue_kopecks, SUM(transactions) AS transactions,
+                           COUNT(DISTINCT day) AS sales_days
+                    FROM daily_sales
+                    WHERE day BETWEEN ? AND ?
+                    GROUP BY branch_id
+                )
+            ) d ON d.branch_id = b.id
+            LEFT JOIN (
+                SELECT branch_id, MIN(id), daily_plan, monthly_plan
+                FROM sales_plans
+                WHERE year = ? AND month = ?
+                GROUP BY branch_id
+            ) p ON p.branch_id = b.id
+            ORDER BY b.name
+        '''
+        return self.execute_query(query, (start_day, self.to_day(until_date), year, month))
+
+    def get_branch_daily_revenue(self, start_date, end_date):
+        """Дневная выручка по филиалам за период [(branch_id, номер дня, revenue)]"""
+        return self.execute_query('''
+            SELECT branch_id, day, SUM(revenue_kopecks) / 100.0 FROM daily_sales
+            WHERE day BETWEEN ? AND ?
+            GROUP BY branch_id, day
+        ''', (self.to_day(start_date), self.to_day(end_date)))
+
+    def get_forecast_date(self):
+        """Дата последнего расчёта прогноза или None"""
+        rows = self.execute_query("SELECT MIN(computed_on) FROM sales_forecasts")
+        return rows[0][0] if rows else None
+
+    def save_sales_forecasts(self, rows):
+        """Замена всех прогнозов: rows - [(branch_id, computed_on, weekday_0, ..., weekday_6)]"""
+        def save(cursor):
+            cursor.execute("DELETE FROM sales_forecasts")
+            cursor.executemany("INSERT INTO sales_forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return len(rows)
+
+        return self.execute_transaction(save)
+
+    def get_weekday_forecast(self, branch_id):
+        """Ожидаемая выручка по дням недели [пн, ..., вс]; branch_id = None - сумма по всем филиалам"""
+        columns = ", ".join(f"SUM(weekday_{weekday})" for weekday in range(7))
+        if branch_id:
+            rows = self.execute_query(f"SELECT {columns} FROM sales_forecasts WHERE branch_id = ?", (branch_id,))
+        else:
+            rows = self.execute_query(f"SELECT {columns} FROM sales_forecasts")
+        if not rows or rows[0][0] is None:
+            return None
+        return list(rows[0])
+
+    # Показатели рейтинга сотрудников: имя - выражение по итогам сотрудника за период
+    LEADERBOARD_METRICS = {
+        'revenue': 'revenue_kopecks',
+        'transactions': 'transactions',
+        'average_check': AVERAGE_CHECK_SQL,
+    }
+
+    def get_employee_leaderboard(self, start_date, end_date, metric='revenue', branch_id=None, top_n=10):
+        """Рейтинг сотрудников за период по показателю metric, top_n лучших в каждом филиале:
+        [(branch_rank, overall_rank, employee_name, branch_name, revenue, transactions, average_check)]"""
+        order = self.LEADERBOARD_METRICS[metric]
+        branch_filter = "AND branch_id = ?" if branch_id else ""
+        params = (self.to_day(start_date), self.to_day(end_date))
+        params += (branch_id, top_n) if branch_id else (top_n,)
+        # Итоги сотрудников и ранги считаются в SQL по daily_sales, в Python приходят только первые top_n мест
+        query = f'''
+            SELECT r.branch_rank, r.overall_rank, e.name, COALESCE(b.name, 'Не указан'),
+                   r.revenue, r.transactions, r.average_check
+            FROM (
+                SELECT branch_id, employee_id, revenue_kopecks / 100.0 AS revenue, transactions,
+                       {self.AVERAGE_CHECK_SQL} AS average_check,
+                       RANK() OVER (PARTITION BY branch_id ORDER BY {order} DESC) AS branch_rank,
+                       RANK() OVER (ORDER BY {order} DESC) AS overall_rank
+                FROM (
+                    SELECT branch_id, employee_id, SUM(revenue_kopecks) AS revenue_kopecks,
+                           SUM(transactions) AS transactions
+                    FROM daily_sales
+                    WHERE day BETWEEN ? AND ? AND employee_id != 0 {branch_filter}
+                    GROUP BY branch_id, employee_id
+                )
+            ) r
+            JOIN employees e ON e.id = r.employee_id
+            LEFT JOIN branches b ON b.id = r.branch_id
+            WHERE r.branch_rank <= ?
+            ORDER BY COALESCE(b.name, 'Не указан'), r.branch_rank, e.name
+        '''
+        return self.execute_query(query, params)
+
+    def get_revenue_anomalies(self, limit=20):
+        """Последние отмеченные дни: [(date, branch_name, metric, value, expected, score)]"""
+        query = '''
+            SELECT a.date, COALESCE(b.name, 'Не указан'), a.metric, a.value, a.expected, a.score
+            FROM revenue_anomalies a
+            LEFT JOIN branches b ON a.branch_id = b.id
+            ORDER BY a.date DESC, ABS(a.score) DESC
+            LIMIT ?
+        '''
+        return self.execute_query(query, (limit,))
+
+    def get_sale_facts(self, sale_id):
+        """Ключевые поля продажи для подписчиков: (branch_id, employee_id, date, revenue, transactions)"""
+        rows = self.execute_query(f'''
+            SELECT COALESCE(branch_id, 0), COALESCE(employee_id, 0), {self.sql_date('day')}, revenue_kopecks / 100.0,
+                   transactions
+            FROM sales_records WHERE id = ?
+        ''', (sale_id,))
+        return rows[0] if rows else None
+
+    @classmethod
+    def add_sale_listener(cls, db_name, callback):
+        """Подписка на изменения продаж: callback(changes) получает всю пачку [(sale_id, old_facts, new_facts)]
+        одним вызовом, None вместо фактов - записи нет"""
+        cls._sale_listeners.setdefault(db_name, []).append(callback)
+
+    @classmethod
+    def add_write_listener(cls, db_name, callback):
+        """Подписка на любую зафиксированную запись в БД: callback() без аргументов,
+        вызывается в потоке, выполнившем запись"""
+        cls._write_listeners.setdefault(db_name, []).append(callback)
+
+    def notify_write_listeners(self):
+        for callback in list(self._write_listeners.get(self.db_name, [])):
+            try:
+                callback()
+            except Exception as e:
+                print(f"Ошибка обработки записи в БД: {e}")
+
+    def has_sale_listeners(self):
+        return bool(self._sale_listeners.get(self.db_name))
+
+    def notify_sale_listeners(self, sale_id, old_facts, new_facts):
+        self.notify_sale_changes([(sale_id, old_facts, new_facts)])
+
+    def notify_sale_changes(self, changes):
+        """Оповещение подписчиков о пачке изменений продаж [(sale_id, old_facts, new_facts)]"""
+        for callback in list(self._sale_listeners.get(self.db_name, [])):
+            try:
+                callback(changes)
+            except Exception as e:
+                print(f"Ошибка обработки изменения продаж: {e}")
 
     def delete_sale(self, sale_id):
-        return self.execute_query("DELETE FROM sales WHERE id = ?", (sale_id,))
+        old_facts = self.get_sale_facts(sale_id)
+        if old_facts is None:
+            print(f"Ошибка удаления: продажи {sale_id} нет в базе (возможно, она перенесена в архив)")
+            return None
+        result = self.execute_query("DELETE FROM sales_records WHERE id = ?", (sale_id,))
+        if result is not None and self.has_sale_listeners():
+            self.notify_sale_listeners(sale_id, old_facts, None)
+        return result
 
     def delete_employee(self, employee_id):
-        return self.execute_query("DELETE FROM employees WHERE id = ?", (employee_id,))
+        result = self.execute_query("DELETE FROM employees WHERE id = ?", (employee_id,))
+        self.invalidate_tables('employees')
+        return result
 
     def get_all_sales(self):
-        query = '''
-            SELECT s.id, s.date, s.revenue, s.transactions, s.average_check, 
+        query = f'''
+            SELECT s.id, {self.sql_date('s.day')}, s.revenue_kopecks / 100.0, s.transactions, s.average_check,
                    COALESCE(e.name, 'Не указан') as employee_name, 
                    COALESCE(b.name, 'Не указан') as branch_name, s.notes,
                    u.full_name as user_name
-            FROM sales s 
+            FROM all_sales_records s 
             LEFT JOIN employees e ON s.employee_id = e.id 
             LEFT JOIN branches b ON s.branch_id = b.id
             LEFT JOIN users u ON s.user_id = u.id
-            ORDER BY s.date DESC
+            ORDER BY s.day DESC
         '''
-        return self.execute_query(query)
+        return self.execute_query(query, with_archives=True)
+
+    # Поля sales_records в порядке столбцов SalesSnapshot; 0 и '' - сотрудник, филиал, пользователь
+    # или примечание не указаны
+    SALE_ROW_COLUMNS = '''
+        id, day, revenue_kopecks / 100.0, transactions, average_check, COALESCE(employee_id, 0), COALESCE(branch_id, 0), COALESCE(user_id, 0), COALESCE(notes, '')
+    '''
+
+    def get_sale_rows(self, sale_ids):
+        """Текущие строки продаж по списку id (запросами до 500 id); None при ошибке"""
+        rows = []
+        for start in range(0, len(sale_ids), 500):
+            chunk = sale_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            result = self.execute_query(f"SELECT {self.SALE_ROW_COLUMNS} FROM sales_records WHERE id IN ({placeholders})",
+                                        chunk)
+            if result is None:
+                return None
+            rows.extend(result)
+        return rows
+
+    def get_daily_sales_cells(self):
+        """Ячейки daily_sales [(branch_id, employee_id, day, revenue, transactions)] по возрастанию дня"""
+        return self.execute_query(
+            "SELECT branch_id, employee_id, day, revenue_kopecks / 100.0, transactions FROM daily_sales ORDER BY day")
+
+    def get_sale_partitions(self):
+        """Части истории продаж: None - основная база, затем годы перенесённых в архив продаж; None при ошибке"""
+        rows = self.execute_query("SELECT year FROM sales_archives WHERE status IN ('removing', 'done') ORDER BY year")
+        return [None] + [row[0] for row in rows] if rows is not None else None
+
+    def get_sale_records_page(self, year, after_id, limit):
+        """До limit строк продаж (в столбцах SALE_ROW_COLUMNS) с id больше after_id по возрастанию id;
+        year - год архива из get_sale_partitions или None для основной базы"""
+        if year is None:
+            return self.execute_query(
+                f"SELECT {self.SALE_ROW_COLUMNS} FROM sales_records WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit))
+        rows = self.execute_query("SELECT year, status FROM sales_archives WHERE year = ? AND status IN ('removing', 'done')",
+                                  (year,))
+        if rows is None:
+            return None
+        if not rows:
+            print(f"Ошибка чтения продаж: архива за {year} год нет")
+            return None
+        year, status = rows[0]
+        condition = self.not_in_main(status)
+        condition = f"{condition} AND a.id > ?" if condition else " WHERE a.id > ?"
+        return self.execute_query(
+            f"SELECT {self.SALE_ROW_COLUMNS} FROM archive_{year}.sales_records a{condition} ORDER BY a.id LIMIT ?",
+            (after_id, limit), with_archives=True)
+
+    def get_user_names(self):
+        return self.cached_query(['users'], "SELECT id, full_name FROM users")
+
+    def get_name_rows(self, table):
+        """Пары (id, имя) таблицы branches, employees или users; None при ошибке"""
+        if table not in self.NAME_QUERIES:
+            print(f"Ошибка чтения имён: неизвестная таблица {table}")
+            return None
+        return self.execute_query(self.NAME_QUERIES[table])
+
+    def get_name_map(self, table):
+        """Словарь id -> имя для branches, employees или users, общий для всех окон (только для чтения);
+        перестраивается после записи в таблицу"""
+        key = (self.db_name, table)
+        with self._cache_lock:
+            version = self._table_versions.get(key, 0)
+            entry = self._name_maps.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        rows = self.get_name_rows(table)
+        if rows is None:
+            return {}
+        names = dict(rows)
+        with self._cache_lock:
+            self._name_maps[key] = (version, names)
+        return names
+
+    def get_employees_with_branches(self):
+        """Сотрудники с названием филиала одним запросом: [(id, name, position, phone, branch_id, branch_name)]"""
+        return self.cached_query(['employees', 'branches'], '''
+            SELECT e.id, e.name, e.position, e.phone, e.branch_id, COALESCE(b.name, 'Не указан')
+            FROM employees e
+            LEFT JOIN branches b ON e.branch_id = b.id
+            ORDER BY e.name
+        ''')
 
     def get_all_employees(self):
-        return self.execute_query("SELECT * FROM employees ORDER BY name")
+        return self.cached_query(['employees'], "SELECT * FROM employees ORDER BY name")
+
+    def add_sale(self, date, revenue, transactions, employee_id, branch_id, notes, user_id):
+        sale_ids = self.add_sales([(date, revenue, transactions, employee_id, branch_id, notes, user_id)])
+        return sale_ids[0] if sale_ids else None
 
-    def add_sale(self, date, revenue, transactions, average_check, employee_id, branch_id, notes, user_id):
+    def add_sales(self, sales, journal=None):
+        """Добавление продаж [(date, revenue, transactions, employee_id, branch_id, notes, user_id)] одной
+        транзакцией; journal (id журнала очереди, номер строки) - номер последней записанной строки журнала,
+        сохраняется в той же транзакции. Список id добавленных продаж или None"""
         query = '''
-            INSERT INTO sales (date, revenue, transactions, average_check, employee_id, branch_id, notes, user_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO sales_records (day, revenue_kopecks, transactions, employee_id, branch_id, notes, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         '''
-        return self.execute_query(query,
-                                  (date, revenue, transactions, average_check, employee_id, branch_id, notes, user_id))
-
-    def update_sale(self, sale_id, date, revenue, transactions, average_check, employee_id, branch_id, notes, user_id):
+        rows = [(self.to_day(date), self.to_kopecks(revenue), transactions, employee_id, branch_id, notes, user_id)
+                for date, revenue, transactions, employee_id, branch_id, notes, user_id in sales]
+
+        def insert(cursor):
+            sale_ids = []
+            for row in rows:
+                cursor.execute(query, row)
+                sale_ids.append(cursor.lastrowid)
+            if journal is not None:
+                journal_id, seq = journal
+                cursor.execute("INSERT OR REPLACE INTO database_info (key, value) VALUES (?, ?)",
+                               (self.pending_journal_key(journal_id), int(seq)))
+            return sale_ids
+
+        sale_ids = self.execute_transaction(insert)
+        if sale_ids is not None and self.has_sale_listeners():
+            self.notify_sale_changes([
+                (sale_id, None, self.sale_facts(branch_id, employee_id, day, revenue_kopecks, transactions))
+                for sale_id, (day, revenue_kopecks, transactions, employee_id, branch_id, _, _) in zip(sale_ids, rows)
+            ])
+        return sale_ids
+
+    def sale_facts(self, branch_id, employee_id, day, revenue_kopecks, transactions):
+        """Факты продажи для подписчиков в том виде, в каком они сохранены в базе"""
+        return branch_id or 0, employee_id or 0, self.from_day(day), revenue_kopecks / 100.0, transactions
+
+    def update_sale(self, sale_id, date, revenue, transactions, employee_id, branch_id, notes, user_id):
         query = '''
-            UPDATE sales SET date=?, revenue=?, transactions=?, average_check=?, employee_id=?, branch_id=?, notes=?, user_id=?
+            UPDATE sales_records SET day=?, revenue_kopecks=?, transactions=?, employee_id=?, branch_id=?, notes=?,
+                                     user_id=?
             WHERE id=?
         '''
-        return self.execute_query(query,
-                                  (date, revenue, transactions, average_check, employee_id, branch_id, notes, user_id,
-                                   sale_id))
+        day, revenue_kopecks = self.to_day(date), self.to_kopecks(revenue)
+        old_facts = self.get_sale_facts(sale_id)
+        if old_facts is None:
+            print(f"Ошибка изменения: продажи {sale_id} нет в базе (возможно, она перенесена в архив)")
+            return None
+        result = self.execute_query(query,
+                                    (day, revenue_kopecks, transactions, employee_id, branch_id, notes, user_id,
+                                     sale_id))
+        if result is not None and self.has_sale_listeners():
+            self.notify_sale_listeners(sale_id, old_facts,
+                                       self.sale_facts(branch_id, employee_id, day, revenue_kopecks, transactions))
+        return result
 
     def add_employee(self, name, position, phone, branch_id=None):
         query = "INSERT INTO employees (name, position, phone, branch_id) VALUES (?, ?, ?, ?)"
-        return self.execute_query(query, (name, position, phone, branch_id))
+        result = self.execute_query(query, (name, position, phone, branch_id))
+        self.invalidate_tables('employees')
+        return result
 
     def update_employee(self, employee_id, name, position, phone, branch_id=None):
         query = "UPDATE employees SET name=?, position=?, phone=?, branch_id=? WHERE id=?"
-        return self.execute_query(query, (name, position, phone, branch_id, employee_id))
+        result = self.execute_query(query, (name, position, phone, branch_id, employee_id))
+        self.invalidate_tables('employees')
+        return result
 
     def get_all_branches(self):
-        return self.execute_query("SELECT * FROM branches ORDER BY name")
+        return self.cached_query(['branches'], "SELECT * FROM branches ORDER BY name")
 
     def add_branch(self, name, address, manager, phone):
         query = "INSERT INTO branches (name, address, manager, phone) VALUES (?, ?, ?, ?)"
-        return self.execute_query(query, (name, address, manager, phone))
+        result = self.execute_query(query, (name, address, manager, phone))
+        self.invalidate_tables('branches')
+        return result
 
     def update_branch(self, branch_id, name, address, manager, phone):
         query = "UPDATE branches SET name=?, address=?, manager=?, phone=? WHERE id=?"
-        return self.execute_query(query, (name, address, manager, phone, branch_id))
-
-    def delete_branch(self, branch_id):
-        return self.execute_query("DELETE FROM branches WHERE id = ?", (branch_id,))
+        result = self.execute_query(query, (name, address, manager, phone, branch_id))
+        self.invalidate_tables('branches')
+        return result
+
+    def count_branch_sales(self, branch_id):
+        """Число продаж филиала в sales_records; None при ошибке"""
+        rows = self.execute_query("SELECT COUNT(*) FROM sales_records WHERE branch_id = ?", (branch_id,))
+        return rows[0][0] if rows is not None else None
+
+    def count_archived_branch_sales(self, branch_id):
+        """Число продаж филиала за годы, перенесённые или переносимые в архив; None при ошибке.
+        Считается по daily_sales (итоги архивных лет в ней остаются), без подключения архивов"""
+        rows = self.execute_query('''
+            SELECT COALESCE(SUM(sales_count), 0) FROM daily_sales
+            WHERE branch_id = ?
+              AND CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER) IN (SELECT year FROM sales_archives)
+        ''', (branch_id,))
+        return rows[0][0] if rows is not None else None
+
+    @staticmethod
+    def moved_sale_changes(branch_id, reassign_to, rows):
+        """Изменения для подписчиков по перенесённым продажам [(id, employee_id, date, revenue, transactions)]"""
+        return [(sale_id, (branch_id, employee_id, date, revenue, transactions),
+                 (reassign_to or 0, employee_id, date, revenue, transactions))
+                for sale_id, employee_id, date, revenue, transactions in rows]
+
+    def reassign_branch_sales(self, branch_id, reassign_to):
+        """Передача очередной порции (до BRANCH_DELETE_BATCH) продаж филиала branch_id филиалу reassign_to
+        одной транзакцией: [(id, employee_id, date, revenue, transactions)] перенесённых продаж,
+        [] - продаж у филиала не осталось, None при ошибке"""
+        def move_batch(cursor):
+            cursor.execute(f'''
+                SELECT id, COALESCE(employee_id, 0), {self.sql_date('day')}, revenue_kopecks / 100.0, transactions
+                FROM sales_records WHERE branch_id = ? LIMIT ?
+            ''', (branch_id, self.BRANCH_DELETE_BATCH))
+            rows = cursor.fetchall()
+            cursor.executemany("UPDATE sales_records SET branch_id = ? WHERE id = ?",
+                               [(reassign_to, row[0]) for row in rows])
+            return rows
+
+        if reassign_to == branch_id:
+            print("Ошибка удаления филиала: продажи нельзя передать удаляемому филиалу")
+            return None
+        rows = self.execute_transaction(move_batch)
+        if rows and self.has_sale_listeners():
+            self.notify_sale_changes(self.moved_sale_changes(branch_id, reassign_to, rows))
+        return rows
+
+    def remove_branch(self, branch_id, reassign_to):
+        """Удаление филиала без продаж: сотрудники передаются филиалу reassign_to, планы удаляются"""
+        def delete_rest(cursor):
+            # Сотрудников и планов у филиала немного - они переносятся вместе с удалением самого филиала
+            cursor.execute("UPDATE employees SET branch_id = ? WHERE branch_id = ?", (reassign_to, branch_id))
+            cursor.execute("DELETE FROM sales_plans WHERE branch_id = ?", (branch_id,))
+            cursor.execute("DELETE FROM branches WHERE id = ?", (branch_id,))
+            return True
+
+        rows = self.execute_query("SELECT EXISTS (SELECT 1 FROM sales_records WHERE branch_id = ?)", (branch_id,))
+        if rows is None:
+            return None
+        if rows[0][0]:
+            print("Ошибка удаления филиала: у филиала остались продажи")
+            return None
+        archived = self.count_archived_branch_sales(branch_id)
+        if archived is None:
+            return None
+        if archived:
+            print(f"Ошибка удаления филиала: у филиала {archived} продаж в архиве закрытых лет")
+            return None
+        result = self.execute_transaction(delete_rest)
+        self.invalidate_tables('branches', 'employees', 'sales_plans')
+        return result
+
+    def delete_branch(self, branch_id, reassign_to=None, progress=None, cancel_event=None):
+        """Удаление филиала: продажи и сотрудники передаются филиалу reassign_to (None - филиал не указан),
+        планы удаляются. Внешние ключи в SQLite не включены, поэтому ссылки снимаются здесь же, порциями: одна
+        большая транзакция надолго закрыла бы базу для записи. progress(done, total) получает число
+        обработанных продаж; при ошибке или отмене филиал остаётся, и повторный вызов продолжит с того же места.
+        Филиал с продажами в архиве закрытых лет не удаляется: архивные продажи не изменяются, и их ссылка
+        на филиал осталась бы без филиала"""
+        if reassign_to == branch_id:
+            print("Ошибка удаления филиала: продажи нельзя передать удаляемому филиалу")
+            return None
+        archived = self.count_archived_branch_sales(branch_id)
+        if archived is None:
+            return None
+        if archived:
+            print(f"Ошибка удаления филиала: у филиала {archived} продаж в архиве закрытых лет")
+            return None
+        total = self.count_branch_sales(branch_id)
+        if total is None:
+            return None
+        done = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TaskCancelled()
+            rows = self.reassign_branch_sales(branch_id, reassign_to)
+            if rows is None:
+                return None
+            if not rows:
+                break
+            done += len(rows)
+            if progress is not None:
+                progress(done, max(total, done))
+            time.sleep(self.BRANCH_DELETE_PAUSE)
+
+        result = self.remove_branch(branch_id, reassign_to)
+        self.invalidate_tables('branches', 'employees', 'sales_plans')
+        return done if result is not None else None
+
+    def get_sales_archives(self):
+        """Архивы продаж: [(year, file, status, sales_count, archived_at)] по годам"""
+        return self.execute_query("SELECT year, file, status, sales_count, archived_at FROM sales_archives ORDER BY year")
+
+    def load_archived_years(self):
+        """Годы, продажи которых переносятся или перенесены в архив (изменять их нельзя); None при ошибке"""
+        rows = self.execute_query("SELECT year FROM sales_archives")
+        return {row[0] for row in rows} if rows is not None else None
+
+    def get_archived_years(self):
+        """load_archived_years с кешем процесса; сбрасывается при архивации, в том числе другим процессом
+        (через шину изменений)"""
+        key = (self.db_name, 'sales_archives')
+        with self._cache_lock:
+            version = self._table_versions.get(key, 0)
+            entry = self._archived_years.get(self.db_name)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        years = self.load_archived_years()
+        if years is not None:
+            years = set(years)
+            with self._cache_lock:
+                self._archived_years[self.db_name] = (version, years)
+        return years
+
+    def get_archivable_years(self):
+        """Закрытые годы, продажи которых ещё лежат в sales_records"""
+        rows = self.execute_query(f'''
+            SELECT DISTINCT CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER) FROM sales_records
+            WHERE day < ? ORDER BY 1
+        ''', (self.to_day(f"{datetime.now().year}-01-01"),))
+        return [row[0] for row in rows] if rows is not None else None
+
+    def archive_sales(self, year):
+        """Перенос продаж закрытого года year из sales_records в файл архива рядом с основной базой;
+        число перенесённых продаж или None при ошибке.
+
+        Итоги daily_sales и branch_monthly_totals не меняются - отчёты и графики по-прежнему видят весь год,
+        не открывая архив. Перенос идёт в два шага, каждый - транзакция одного файла (в режиме WAL
+        транзакция над несколькими файлами не атомарна): продажи копируются в архив, затем удаляются из
+        sales_records порциями по ARCHIVE_DELETE_BATCH (пока идёт удаление, запросы по всей истории берут
+        ещё не удалённые продажи года из основной базы, остальные - из архива). С регистрации года
+        в sales_archives продажи за него изменить нельзя, поэтому копия не устаревает; если перенос
+        прервался, повторный вызов докопирует и доудалит продажи"""
+        if year >= datetime.now().year:
+            print(f"Ошибка архивации: {year} год ещё не закрыт")
+            return None
+        file_name = f"{os.path.splitext(os.path.basename(self.db_name))[0]}-archive-{year}.db"
+        schema = f"archive_{year}"
+        period = (self.to_day(f"{year}-01-01"), self.to_day(f"{year}-12-31"))
+
+        def register(cursor):
+            cursor.execute("SELECT status FROM sales_archives WHERE year = ?", (year,))
+            row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+            # Каждый архив при чтении всей истории подключается к соединению, а их число у SQLite ограничено
+            cursor.execute("SELECT COUNT(*) FROM sales_archives")
+            if cursor.fetchone()[0] >= cursor.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+                raise sqlite3.OperationalError("достигнуто наибольшее число подключаемых архивов")
+            cursor.execute("INSERT INTO sales_archives (year, file) VALUES (?, ?)", (year, file_name))
+            # По этой записи шины изменений других процессов сбрасывают кеш архивных лет
+            cursor.execute("INSERT INTO data_change_log (table_name, row_id, op) VALUES ('sales_archives', ?, 'insert')",
+                           (year,))
+            return 'copying'
+
+        def copy(cursor):
+            cursor.execute(f"ATTACH DATABASE ? AS {schema}", (self.archive_path(file_name),))
+            self.create_sales_records(cursor, schema)
+            # Основная база только читается: её запись остальными подключениями копирование не задерживает
+            cursor.execute("BEGIN")
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {schema}.sales_records ({self.SALE_RECORD_FIELDS})
+                SELECT {self.SALE_RECORD_FIELDS} FROM main.sales_records WHERE day BETWEEN ? AND ?
+            ''', period)
+            return cursor.rowcount
+
+        def remove_batch(cursor):
+            cursor.execute("INSERT INTO database_info (key, value) VALUES ('archiving', ?)", (year,))
+            cursor.execute("DELETE FROM sales_records WHERE id IN (SELECT id FROM sales_records "
+                           "WHERE day BETWEEN ? AND ? LIMIT ?)", period + (self.ARCHIVE_DELETE_BATCH,))
+            removed = cursor.rowcount
+            cursor.execute("DELETE FROM database_info WHERE key = 'archiving'")
+            return removed
+
+        def finish(cursor):
+            cursor.execute(f"ATTACH DATABASE ? AS {schema}", (self.archive_path(file_name),))
+            cursor.execute(f"SELECT COUNT(*) FROM {schema}.sales_records")
+            cursor.execute("UPDATE sales_archives SET status = 'done', sales_count = ?, archived_at = CURRENT_TIMESTAMP "
+                           "WHERE year = ?", (cursor.fetchone()[0], year))
+            return cursor.rowcount
+
+        status = self.execute_transaction(register)
+        self.invalidate_tables('sales_archives')
+        if status is None:
+            return None
+        if status == 'done':
+            print(f"Продажи за {year} год уже перенесены в архив")
+            return 0
+        if status == 'copying':
+            if self.execute_transaction(copy) is None or self.execute_query(
+                    "UPDATE sales_archives SET status = 'removing' WHERE year = ?", (year,)) is None:
+                return None
+        removed = 0
+        while True:
+            batch = self.execute_transaction(remove_batch)
+            if batch is None:
+                return None
+            if not batch:
+                break
+            removed += batch
+            time.sleep(self.ARCHIVE_DELETE_PAUSE)
+        if self.execute_transaction(finish) is None:
+            return None
+        return removed
 
     def get_sales_plans(self, branch_id=None):
         if branch_id:
@@ -228,7 +1522,7 @@ class DatabaseManager:
                 WHERE sp.branch_id = ? 
                 ORDER BY sp.year DESC, sp.month DESC
             '''
-            return self.execute_query(query, (branch_id,))
+            return self.cached_query(['sales_plans', 'branches'], query, (branch_id,))
         else:
             query = '''
                 SELECT sp.*, b.name as branch_name 
@@ -236,21 +1530,1766 @@ class DatabaseManager:
                 LEFT JOIN branches b ON sp.branch_id = b.id 
                 ORDER BY sp.year DESC, sp.month DESC
             '''
-            return self.execute_query(query)
+            return self.cached_query(['sales_plans', 'branches'], query)
+
+    def get_sales_plan(self, branch_id, year, month):
+        """План филиала на период: (daily_plan, monthly_plan) или None"""
+        rows = self.cached_query(['sales_plans'], '''
+            SELECT daily_plan, monthly_plan FROM sales_plans
+            WHERE branch_id = ? AND year = ? AND month = ?
+            ORDER BY id LIMIT 1
+        ''', (branch_id, year, month))
+        return rows[0] if rows else None
+
+    def get_total_sales_plan(self, year, month):
+        """Сумма планов всех филиалов на период: (daily_plan, monthly_plan)"""
+        rows = self.cached_query(['sales_plans'], '''
+            SELECT COALESCE(SUM(daily_plan), 0), COALESCE(SUM(monthly_plan), 0) FROM sales_plans
+            WHERE year = ? AND month = ?
+        ''', (year, month))
+        return rows[0] if rows else (0, 0)
 
     def add_sales_plan(self, branch_id, year, month, daily_plan, monthly_plan):
         query = '''
             INSERT INTO sales_plans (branch_id, year, month, daily_plan, monthly_plan)
             VALUES (?, ?, ?, ?, ?)
         '''
-        return self.execute_query(query, (branch_id, year, month, daily_plan, monthly_plan))
+        result = self.execute_query(query, (branch_id, year, month, daily_plan, monthly_plan))
+        self.invalidate_tables('sales_plans')
+        return result
 
     def update_sales_plan(self, plan_id, daily_plan, monthly_plan):
         query = "UPDATE sales_plans SET daily_plan=?, monthly_plan=? WHERE id=?"
-        return self.execute_query(query, (daily_plan, monthly_plan, plan_id))
+        result = self.execute_query(query, (daily_plan, monthly_plan, plan_id))
+        self.invalidate_tables('sales_plans')
+        return result
 
     def delete_sales_plan(self, plan_id):
-        return self.execute_query("DELETE FROM sales_plans WHERE id = ?", (plan_id,))
+        result = self.execute_query("DELETE FROM sales_plans WHERE id = ?", (plan_id,))
+        self.invalidate_tables('sales_plans')
+        return result
+
+def json_default(value):
+    """Значения, которых нет в JSON: даты строками 'YYYY-MM-DD', числа NumPy обычными числами,
+    множества упорядоченными списками"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Значение типа {type(value).__name__} не сериализуется в JSON")
+
+
+class SalesService:
+    """Локальная служба HTTP/JSON, единолично работающая с базой продаж.
+
+    Записи выполняет один поток в порядке поступления (очередь записи),
+    чтение - пул из READERS потоков. POST /api/<метод> с телом {"params": [...]}
+    вызывает метод DatabaseManager из METHODS, POST /api/batch с телом
+    {"calls": [[метод, [...]], ...]} - несколько вызовов за один запрос.
+    Произвольные запросы SQL служба не выполняет - только перечисленные
+    методы, параметры которых сверяются с их сигнатурой и проверяются по
+    имени (даты, целые, суммы); ошибка в параметрах - ответ 400 с постоянным
+    текстом, подробности остаются в выводе службы. Пользователей служба не
+    создаёт: роль при регистрации выбирает сам пользователь, и через порт
+    любой завёл бы себе администратора. Соединения HTTP/1.1 остаются
+    открытыми между запросами (keep-alive).
+    """
+
+    HOST = "127.0.0.1"
+    PORT = 8765
+    READERS = 4
+    # Доступные методы: 'read' - пул чтения, 'write' - очередь записи
+    METHODS = {
+        'authenticate_user': 'read', 'user_exists': 'read',
+        'get_all_sales': 'read', 'get_sale_rows': 'read',
+        'add_sale': 'write', 'add_sales': 'write', 'update_sale': 'write', 'delete_sale': 'write',
+        'get_sales_plans': 'read', 'get_sales_plan': 'read', 'get_total_sales_plan': 'read',
+        'add_sales_plan': 'write', 'update_sales_plan': 'write', 'delete_sales_plan': 'write',
+        'get_daily_totals': 'read', 'get_monthly_totals': 'read', 'get_period_totals': 'read',
+        'get_daily_branch_summary': 'read', 'get_branch_dashboard': 'read', 'get_branch_daily_revenue': 'read',
+        'get_weekday_forecast': 'read', 'get_employee_leaderboard': 'read', 'get_revenue_anomalies': 'read',
+        'get_all_branches': 'read', 'add_branch': 'write', 'update_branch': 'write',
+        'get_all_employees': 'read', 'get_employees_with_branches': 'read',
+        'add_employee': 'write', 'update_employee': 'write', 'delete_employee': 'write',
+        'count_branch_sales': 'read', 'count_archived_branch_sales': 'read',
+        'reassign_branch_sales': 'write', 'remove_branch': 'write',
+        'get_sale_facts': 'read', 'get_name_rows': 'read', 'get_daily_sales_cells': 'read',
+        'get_sale_partitions': 'read', 'get_sale_records_page': 'read',
+        'get_database_info': 'read', 'get_change_seqs': 'read', 'get_sales_change_seq': 'read',
+        'get_sales_changes': 'read', 'get_data_changes': 'read', 'get_change_log_floor': 'read',
+        'get_forecast_date': 'read', 'save_sales_forecasts': 'write', 'load_archived_years': 'read',
+        'get_pending_journal_seq': 'read', 'clear_pending_journal': 'write',
+    }
+    # Проверка параметров по имени (None допускается везде - его обрабатывает сам метод)
+    DATE_PARAMS = {'date', 'start_date', 'end_date', 'until_date'}
+    INT_PARAMS = {'sale_id', 'branch_id', 'employee_id', 'user_id', 'plan_id', 'reassign_to', 'year', 'month',
+                  'transactions', 'limit', 'top_n', 'after_id', 'after_seq'}
+    NUMBER_PARAMS = {'revenue', 'daily_plan', 'monthly_plan'}
+
+    def __init__(self, db):
+        self.db = db
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sales-writer")
+        self.readers = ThreadPoolExecutor(max_workers=self.READERS, thread_name_prefix="sales-reader")
+        # Отклонения выручки отмечаются в процессе службы - клиенты записывают продажи только через неё
+        AnomalyDetector.install(db.db_name)
+
+    @classmethod
+    def is_write(cls, method):
+        return cls.METHODS[method] == 'write'
+
+    @classmethod
+    def valid_value(cls, name, value):
+        if value is None:
+            return True
+        if name in cls.DATE_PARAMS:
+            try:
+                DatabaseManager.to_day(value)
+                return isinstance(value, str)
+            except (TypeError, ValueError):
+                return False
+        if name in cls.INT_PARAMS:
+            return isinstance(value, int) and not isinstance(value, bool)
+        if name in cls.NUMBER_PARAMS:
+            return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        if name == 'sale_ids':
+            return isinstance(value, list) and all(cls.valid_value('sale_id', item) for item in value)
+        if name == 'sales':
+            fields = list(inspect.signature(DatabaseManager.add_sale).parameters)[1:]
+            return isinstance(value, list) and all(
+                isinstance(sale, list) and len(sale) == len(fields)
+                and all(cls.valid_value(field, item) for field, item in zip(fields, sale)) for sale in value)
+        return True
+
+    def check_params(self, method, function, params):
+        """Параметры, пригодные для вызова; иначе ValueError с постоянным текстом для клиента"""
+        if not isinstance(params, list):
+            raise ValueError(f"параметры {method} передаются списком")
+        try:
+            arguments = inspect.signature(function).bind(*params).arguments
+        except TypeError:
+            raise ValueError(f"неверное число параметров {method}") from None
+        for name, value in arguments.items():
+            if not self.valid_value(name, value):
+                raise ValueError(f"некорректный параметр {name} метода {method}")
+
+    async def call(self, method, params):
+        if method not in self.METHODS:
+            raise KeyError(method)
+        function = getattr(self.db, method)
+        self.check_params(method, function, params)
+        executor = self.writer if self.is_write(method) else self.readers
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, lambda: function(*params))
+        except (TypeError, ValueError) as e:
+            # Значение прошло проверку по имени, но не подошло методу - ошибка запроса, а не службы
+            print(f"Ошибка параметров {method}: {e}")
+            raise ValueError(f"некорректные параметры {method}") from None
+
+    async def dispatch(self, method, path, body):
+        """Обработка одного HTTP-запроса: (статус, ответ)"""
+        if method == 'GET' and path == '/health':
+            return "200 OK", {'status': 'ok'}
+        if method != 'POST' or not path.startswith('/api/'):
+            return "404 Not Found", {'error': f"Неизвестный адрес: {method} {path}"}
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            return "400 Bad Request", {'error': "Некорректный JSON"}
+        if not isinstance(request, dict):
+            return "400 Bad Request", {'error': "Тело запроса должно быть объектом JSON"}
+        name = path[len('/api/'):]
+        try:
+            if name == 'batch':
+                calls = request.get('calls', [])
+                if not isinstance(calls, list) or not all(isinstance(call, list) and len(call) == 2
+                                                          and isinstance(call[0], str) for call in calls):
+                    return "400 Bad Request", {'error': "Вызовы пакета передаются списком пар [метод, [параметры]]"}
+                # Вызовы пакета выполняются по порядку: запись, отправленная раньше чтения, видна ему
+                return "200 OK", {'results': [await self.call(call_name, call_params)
+                                              for call_name, call_params in calls]}
+            return "200 OK", {'result': await self.call(name, request.get('params', []))}
+        except KeyError as e:
+            return "404 Not Found", {'error': f"Неизвестный метод: {e}"}
+        except ValueError as e:
+            # Тексты ValueError из call постоянные и не содержат данных базы
+            return "400 Bad Request", {'error': str(e)}
+        except Exception as e:
+            # Подробности ошибки (пути, SQL) клиенту не передаются - только в вывод службы
+            print(f"Ошибка службы при вызове {name}: {type(e).__name__}: {e}")
+            return "500 Internal Server Error", {'error': "Внутренняя ошибка службы"}
+
+    async def handle(self, reader, writer):
+        """Соединение клиента: запросы читаются один за другим, пока клиент не закроет соединение"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload, ensure_ascii=False, default=json_default).encode('utf-8')
+                writer.write((f"HTTP/1.1 {status}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1')
+                             + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def run(self, host=HOST, port=PORT):
+        """Запуск службы до прерывания (Ctrl+C)"""
+        async def serve():
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Служба продаж запущена: http://{host}:{port}, база {self.db.db_name}")
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            print("Служба продаж остановлена")
+        finally:
+            self.writer.shutdown()
+            self.readers.shutdown()
+
+
+class ServiceClient:
+    """Клиент SalesService: одно постоянное соединение на процесс, вызовы по одному и пакетами"""
+
+    TIMEOUT = 30
+
+    def __init__(self, host=SalesService.HOST, port=SalesService.PORT):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_address(cls, address):
+        """Клиент по адресу 'host:port' или 'port'"""
+        host, _, port = address.rpartition(':')
+        return cls(host or SalesService.HOST, int(port))
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload, default=json_default).encode('utf-8') if payload is not None else None
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.TIMEOUT)
+                try:
+                    self.connection.request(method, path, body, {'Content-Type': 'application/json'})
+                    response = self.connection.getresponse()
+                    data = json.loads(response.read())
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    # Соединение могло быть закрыто службой (например, после перезапуска) - один повтор на новом
+                    self.connection.close()
+                    self.connection = None
+                    if attempt:
+                        raise
+        if response.status != 200:
+            raise RuntimeError(data.get('error', response.reason))
+        return data
+
+    def ping(self):
+        try:
+            return self.request('GET', '/health').get('status') == 'ok'
+        except (OSError, http.client.HTTPException, RuntimeError, ValueError):
+            return False
+
+    def call(self, method, *params):
+        return self.request('POST', f'/api/{method}', {'params': list(params)})['result']
+
+    def batch(self, calls):
+        """Несколько вызовов [(метод, (параметры...)), ...] одним запросом; результаты в том же порядке"""
+        return self.request('POST', '/api/batch', {'calls': [[method, list(params)] for method, params in calls]})[
+            'results']
+
+
+class ServiceDatabaseManager(DatabaseManager):
+    """DatabaseManager в режиме клиента службы: методы из SalesService.METHODS выполняет служба, остальные
+    работают поверх них. Файл базы клиент не открывает - запросы SQL в обход службы завершаются ошибкой"""
+
+    def __init__(self, db_name="sales_system.db"):
+        self.db_name = db_name
+        self.client = DatabaseManager.service
+
+    def get_connection(self, with_archives=False):
+        raise RuntimeError("в режиме клиента службы база доступна только через методы службы")
+
+    def create_user(self, full_name, email, password, role='employee'):
+        return False, ("В режиме клиента службы регистрация недоступна: "
+                       "пользователя создаёт администратор на компьютере службы")
+
+    def remote_call(self, method, *params):
+        # Подписчикам на продажи (снимок, куб) нужны старые и новые факты продажи, как при локальной записи
+        notify = self.has_sale_listeners()
+        old_facts = self.get_sale_facts(params[0]) if notify and method in ('update_sale', 'delete_sale') else None
+        try:
+            result = self.client.call(method, *params)
+        except Exception as e:
+            print(f"Ошибка обращения к службе: {e}")
+            return None
+        if notify and result is not None:
+            changes = self.remote_sale_changes(method, params, result, old_facts)
+            if changes:
+                self.notify_sale_changes(changes)
+        if SalesService.is_write(method):
+            self.notify_write_listeners()
+        return result
+
+    def remote_sale_changes(self, method, params, result, old_facts):
+        """Изменения продаж для подписчиков по параметрам и результату вызова службы, без лишних запросов"""
+        def facts(date, revenue, transactions, employee_id, branch_id, notes, user_id):
+            return self.sale_facts(branch_id, employee_id, self.to_day(date), self.to_kopecks(revenue), transactions)
+
+        if method == 'add_sale':
+            return [(result, None, facts(*params))]
+        if method == 'add_sales':
+            return [(sale_id, None, facts(*sale)) for sale_id, sale in zip(result, params[0])]
+        if method == 'update_sale':
+            return [(params[0], old_facts, facts(*params[1:]))]
+        if method == 'delete_sale':
+            return [(params[0], old_facts, None)]
+        if method == 'reassign_branch_sales':
+            return self.moved_sale_changes(params[0], params[1], result)
+        return []
+
+    @staticmethod
+    def remote_method(method):
+        def call(self, *params):
+            return self.remote_call(method, *params)
+        call.__name__ = method
+        return call
+
+
+for method_name in SalesService.METHODS:
+    setattr(ServiceDatabaseManager, method_name, ServiceDatabaseManager.remote_method(method_name))
+
+
+class TaskCancelled(Exception):
+    """Фоновая задача отменена более новым запросом"""
+
+
+class WorkerSignals(QObject):
+    finished = Signal(int, object)
+    error = Signal(int, str)
+
+
+class BackgroundTask(QRunnable):
+    """Выполнение функции в пуле потоков с возможностью отмены.
+
+    Функция получает cancel_event последним именованным аргументом и должна
+    периодически проверять его; результат отменённой задачи не публикуется.
+    """
+
+    def __init__(self, request_id, fn, *args):
+        super().__init__()
+        self.request_id = request_id
+        self.fn = fn
+        self.args = args
+        self.cancel_event = threading.Event()
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        if self.cancel_event.is_set():
+            return
+        try:
+            result = self.fn(*self.args, cancel_event=self.cancel_event)
+        except TaskCancelled:
+            return
+        except Exception as e:
+            self.signals.error.emit(self.request_id, str(e))
+            return
+        if not self.cancel_event.is_set():
+            self.signals.finished.emit(self.request_id, result)
+
+
+class DataChangeBus(QObject):
+    """Общая для процесса шина изменений данных для окон.
+
+    Сразу после записи через DatabaseManager и раз в POLL_INTERVAL_MS шина
+    сверяет номера последних записей журналов изменений (одним запросом, в
+    режиме клиента - через службу); если базу изменил этот или другой процесс,
+    из sales_change_log и data_change_log читаются записи после последнего
+    учтённого номера, и окна получают сигнал changed со списком событий
+    (table, row_id, op) - по нему обновляется только затронутое. Если нужные
+    записи журнала уже удалены (trim_change_logs), шина публикует события
+    (table, None, 'reload') по всем таблицам - окна перечитывают данные.
+    """
+
+    POLL_INTERVAL_MS = 500
+
+    changed = Signal(list)
+    poll_requested = Signal()
+
+    _instances = {}
+
+    @classmethod
+    def instance(cls, db_name="sales_system.db"):
+        """Общая шина по базе db_name (создаётся в GUI-потоке при первом обращении)"""
+        bus = cls._instances.get(db_name)
+        if bus is None:
+            bus = cls(DatabaseManager(db_name))
+            cls._instances[db_name] = bus
+        return bus
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+        self.change_seqs = db.get_change_seqs()
+        self.sales_seq, self.data_seq = self.change_seqs or (0, 0)
+        # Запись может прийти из фонового потока - проверка всегда выполняется в GUI-потоке
+        self.poll_requested.connect(self.poll, Qt.QueuedConnection)
+        DatabaseManager.add_write_listener(db.db_name, self.poll_requested.emit)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(self.POLL_INTERVAL_MS)
+
+    def poll(self):
+        """Проверка базы на изменения и публикация новых событий"""
+        change_seqs = self.db.get_change_seqs()
+        if change_seqs is None or change_seqs == self.change_seqs:
+            return
+        self.change_seqs = change_seqs
+        if (self.db.get_change_log_floor('sales') > self.sales_seq
+                or self.db.get_change_log_floor('data') > self.data_seq):
+            # Пропущенные изменения из журнала не восстановить - данные всех таблиц считаются устаревшими
+            self.sales_seq, self.data_seq = change_seqs
+            self.db.invalidate_tables(*DatabaseManager.CHANGE_LOG_TABLES)
+            self.changed.emit([('sales', None, 'reload')] +
+                              [(table, None, 'reload') for table in DatabaseManager.CHANGE_LOG_TABLES])
+            return
+        events = []
+        sales_changes = self.db.get_sales_changes(self.sales_seq) or []
+        if sales_changes:
+            self.sales_seq = sales_changes[-1][0]
+            events += [('sales', sale_id, op) for seq, sale_id, op in sales_changes]
+        data_changes = self.db.get_data_changes(self.data_seq) or []
+        if data_changes:
+            self.data_seq = data_changes[-1][0]
+            events += [(table, row_id, op) for seq, table, row_id, op in data_changes]
+            # Справочники мог изменить другой процесс - кеш запросов по ним устаревает
+            self.db.invalidate_tables(*{table for seq, table, row_id, op in data_changes})
+        if events:
+            self.changed.emit(events)
+
+
+class PendingSalesQueue(QObject):
+    """Локальная очередь записи продаж, введённых кассиром.
+
+    Продажа сразу попадает в очередь в памяти и в журнал в локальном каталоге
+    JOURNAL_DIR (строка JSON с номером seq на продажу), поэтому ввод не
+    теряется, даже если общая база занята или недоступна. В базу очередь
+    записывается одной транзакцией в фоновом потоке, не задерживая ввод: в
+    обычном режиме сразу, при быстром вводе - как только в ней FLUSH_COUNT
+    продаж или через FLUSH_INTERVAL_MS после первой; неудачная запись
+    повторяется через FLUSH_INTERVAL_MS. Журнал сбрасывается на диск (fsync)
+    один раз перед каждой такой записью, а не на каждую продажу. В той же
+    транзакции в database_info сохраняется номер последней записанной строки
+    журнала: перед записью продажи с номером не больше него отбрасываются, так
+    что после сбоя в базу попадает только то, чего в ней ещё нет. Журнал, в
+    котором не прочиталась хотя бы одна строка, не перезаписывается: он
+    переносится в соседний файл (damaged_journal), а прочитанные продажи
+    переходят в новый журнал.
+    """
+
+    JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".sales_system")
+    FLUSH_COUNT = 20
+    FLUSH_INTERVAL_MS = 2000
+
+    flushed = Signal(int)  # число записанных в базу продаж
+    flush_failed = Signal()
+
+    _instances = []
+
+    def __init__(self, db, user_id):
+        super().__init__()
+        self.db = db
+        self.journal_path = self.journal_path_for(db.db_name, user_id)
+        self.entries = []  # [(seq, продажа)] в порядке ввода
+        self.seq = 0
+        self.journal_id = None
+        self.damaged_journal = None  # куда перенесён повреждённый журнал (пользователя нужно предупредить)
+        self.available = True  # удалась ли последняя запись в базу
+        # Очередь и файл журнала общие для GUI-потока (постановка) и фоновой записи в базу (переписывает журнал)
+        self.lock = threading.Lock()
+        # В базу очередь записывает одна задача за раз - фоновая или при закрытии
+        self.write_lock = threading.Lock()
+        self.write_pool = QThreadPool()
+        self.write_pool.setMaxThreadCount(1)
+        self.write_task = None
+        self.write_request_id = 0
+        self.flush_requested = False  # flush во время фоновой записи - ещё одна запись после неё
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+        self.recover()
+        PendingSalesQueue._instances.append(self)
+
+    @classmethod
+    def journal_path_for(cls, db_name, user_id):
+        """Журнал пользователя user_id для базы db_name в локальном каталоге (база может лежать на общем диске)"""
+        db_key = uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(db_name)).hex[:12]
+        return os.path.join(cls.JOURNAL_DIR, f"pending-{db_key}-{user_id}.jsonl")
+
+    @classmethod
+    def flush_all(cls):
+        """Запись всех очередей процесса (при выходе из приложения), с ожиданием результата"""
+        for queue in cls._instances:
+            queue.write_pending()
+
+    def close(self):
+        """Запись очереди и отключение (окно закрыто); не записанное остаётся в журнале до следующего запуска"""
+        self.timer.stop()
+        self.write_request_id += 1  # результат идущей фоновой записи уже не нужен
+        self.write_pending()
+        with self.lock:
+            empty = not self.entries and self.rewrite_journal()
+        if empty:
+            # В журнале на диске не осталось продаж - номер записанной строки в базе больше не нужен
+            self.db.clear_pending_journal(self.journal_id)
+        if self in PendingSalesQueue._instances:
+            PendingSalesQueue._instances.remove(self)
+
+    def recover(self):
+        """Чтение журнала: продажи из него возвращаются в очередь и сразу записываются"""
+        records = []
+        damaged = False
+        try:
+            with open(self.journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None
+                    if isinstance(record, dict) and ('journal' in record or ('seq' in record and 'sale' in record)):
+                        records.append(record)
+                    else:
+                        damaged = True  # строка, недописанная при сбое, или испорченная
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Ошибка чтения журнала очереди продаж: {e}")
+            damaged = True
+        header = records[0] if records and 'journal' in records[0] else None
+        if records and header is None:
+            damaged = True
+        self.entries = [(record['seq'], tuple(record['sale'])) for record in records if 'sale' in record]
+        # Номера продолжаются с последнего выданного, иначе новые продажи совпали бы по номеру с записанными
+        self.seq = max([header.get('seq', 0) if header else 0] + [seq for seq, sale in self.entries])
+        # Без заголовка номер записанной строки в базе не найти: прочитанные продажи записываются заново
+        # под новым журналом
+        self.journal_id = header['journal'] if header else uuid.uuid4().hex
+        if damaged:
+            damaged_path = f"{self.journal_path}.damaged-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+            number = 1
+            while os.path.exists(damaged_path):  # прежний повреждённый журнал не заменяется
+                number += 1
+                damaged_path = f"{self.journal_path}.damaged-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{number}"
+            try:
+                os.replace(self.journal_path, damaged_path)
+            except OSError as e:
+                # Повреждённый журнал нельзя ни перенести, ни перезаписать - очередь работает без журнала
+                print(f"Ошибка переноса повреждённого журнала очереди продаж: {e}")
+                damaged_path = self.journal_path
+                self.journal_path = None
+            self.damaged_journal = damaged_path
+            print(f"Журнал очереди продаж повреждён и сохранён в {damaged_path}; "
+                  f"прочитано продаж: {len(self.entries)}")
+        if damaged or header is None:
+            self.rewrite_journal()
+        if self.entries:
+            self.flush()
+
+    def rewrite_journal(self):
+        """Журнал из заголовка и ещё не записанных в базу продаж; файл заменяется целиком. False при ошибке"""
+        if self.journal_path is None:
+            return False
+        lines = [json.dumps({'journal': self.journal_id, 'seq': self.seq})]
+        lines += [json.dumps({'seq': seq, 'sale': list(sale)}, ensure_ascii=False) for seq, sale in self.entries]
+        try:
+            os.makedirs(self.JOURNAL_DIR, exist_ok=True)
+            with open(self.journal_path + ".tmp", "w", encoding="utf-8") as journal:
+                journal.write("\n".join(lines) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+            os.replace(self.journal_path + ".tmp", self.journal_path)
+        except OSError as e:
+            print(f"Ошибка записи журнала очереди продаж: {e}")
+            return False
+        return True
+
+    def append(self, sale):
+        """Постановка продажи (date, revenue, transactions, employee_id, branch_id, notes, user_id) в очередь;
+        номер seq продажи или None, если её не удалось сохранить в журнал"""
+        if self.journal_path is None:
+            return None
+        with self.lock:
+            seq = self.seq + 1
+            try:
+                # Строка остаётся в кеше ОС и переживает сбой программы; на диск её сбросит ближайшая запись в базу
+                with open(self.journal_path, "a", encoding="utf-8") as journal:
+                    journal.write(json.dumps({'seq': seq, 'sale': list(sale)}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Ошибка записи журнала очереди продаж: {e}")
+                return None
+            self.seq = seq
+            self.entries.append((seq, tuple(sale)))
+            count = len(self.entries)
+        if count >= self.FLUSH_COUNT:
+            self.flush()
+        elif not self.timer.isActive():
+            self.timer.start(self.FLUSH_INTERVAL_MS)
+        return seq
+
+    def sales(self):
+        """Ещё не записанные продажи в порядке ввода"""
+        with self.lock:
+            return [sale for seq, sale in self.entries]
+
+    def is_written(self, seq):
+        """Продажа с номером seq уже записана в базу"""
+        with self.lock:
+            return not self.entries or self.entries[0][0] > seq
+
+    def flush(self):
+        """Запуск записи очереди в базу в фоновом потоке; результат - сигнал flushed или flush_failed"""
+        self.timer.stop()
+        if self.write_task is not None:
+            self.flush_requested = True
+            return
+        with self.lock:
+            if not self.entries:
+                return
+        self.write_request_id += 1
+        self.write_task = BackgroundTask(self.write_request_id, self.write_pending)
+        self.write_task.signals.finished.connect(self.on_written)
+        self.write_task.signals.error.connect(self.on_write_error)
+        self.write_pool.start(self.write_task)
+
+    def sync_journal(self):
+        """Сброс дописанных в журнал строк на диск - один fsync на пачку продаж"""
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as journal:
+                os.fsync(journal.fileno())
+        except OSError as e:
+            print(f"Ошибка записи журнала очереди продаж: {e}")
+
+    def write_pending(self, cancel_event=None):
+        """Запись очереди в базу одной транзакцией (в фоновом потоке или при закрытии):
+        число записанных продаж или None, если база занята или недоступна"""
+        with self.write_lock:
+            with self.lock:
+                entries = list(self.entries)
+                journal_path = self.journal_path
+            if not entries:
+                return 0
+            if journal_path is not None:
+                self.sync_journal()
+            applied = self.db.get_pending_journal_seq(self.journal_id)
+            if applied is None:
+                return None
+            # Продажи, записанные до сбоя, который помешал переписать журнал, отбрасываются
+            entries = [(seq, sale) for seq, sale in entries if seq > applied]
+            sale_ids = self.db.add_sales([sale for seq, sale in entries],
+                                         (self.journal_id, entries[-1][0])) if entries else []
+            if sale_ids is None:
+                return None
+            written = entries[-1][0] if entries else applied
+            with self.lock:
+                # Продажи, поставленные во время записи, остаются в очереди и в переписанном журнале
+                self.entries = [(seq, sale) for seq, sale in self.entries if seq > written]
+                self.rewrite_journal()
+            return len(sale_ids)
+
+    def on_written(self, request_id, count):
+        if request_id != self.write_request_id:
+            return
+        self.write_task = None
+        if count is None:
+            # База занята или недоступна: продажи остаются в очереди и журнале, запись повторится позже
+            self.available = False
+            self.flush_requested = False
+            self.timer.start(self.FLUSH_INTERVAL_MS)
+            self.flush_failed.emit()
+            return
+        self.available = True
+        if self.flush_requested:
+            self.flush_requested = False
+            self.flush()
+        self.flushed.emit(count)
+
+    def on_write_error(self, request_id, message):
+        print(f"Ошибка записи очереди продаж: {message}")
+        self.on_written(request_id, None)
+
+
+class SalesCube:
+    """Куб продаж филиал × сотрудник × день в памяти процесса.
+
+    Ячейки куба хранятся в столбцовых массивах NumPy с порядковыми номерами
+    филиала, сотрудника и дня; по осям заранее посчитаны плотные свёртки
+    филиал × день и сотрудник × день. Куб строится один раз из daily_sales
+    и дальше обновляется по уведомлениям DatabaseManager о записи продаж.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls, db_name="sales_system.db"):
+        """Общий для процесса куб по базе db_name (строится при первом обращении)"""
+        with cls._instances_lock:
+            cube = cls._instances.get(db_name)
+            if cube is None:
+                cube = cls(DatabaseManager(db_name))
+                cls._instances[db_name] = cube
+            return cube
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.RLock()
+        self.build()
+        DatabaseManager.add_sale_listener(db.db_name, self.on_sales_changed)
+
+    def build(self):
+        """Полное построение куба одним проходом по daily_sales"""
+        rows = self.db.get_daily_sales_cells() or []
+        with self.lock:
+            self.branch_ids = sorted({row[0] for row in rows})
+            self.employee_ids = sorted({row[1] for row in rows})
+            self.branch_ordinals = {key: ordinal for ordinal, key in enumerate(self.branch_ids)}
+            self.employee_ordinals = {key: ordinal for ordinal, key in enumerate(self.employee_ids)}
+
+            count = len(rows)
+            self.cell_branch = np.fromiter((self.branch_ordinals[row[0]] for row in rows), dtype=np.int32, count=count)
+            self.cell_employee = np.fromiter((self.employee_ordinals[row[1]] for row in rows), dtype=np.int32,
+                                             count=count)
+            self.cell_day = np.fromiter((row[2] for row in rows), dtype=np.int32, count=count) + \
+                DatabaseManager.EPOCH_ORDINAL
+            self.cell_revenue = np.fromiter((row[3] for row in rows), dtype=float, count=count)
+            self.cell_transactions = np.fromiter((row[4] for row in rows), dtype=float, count=count)
+            self.cell_count = count
+            self.cell_index = {(branch, employee, day): cell for cell, (branch, employee, day) in
+                               enumerate(zip(self.cell_branch.tolist(), self.cell_employee.tolist(),
+                                             self.cell_day.tolist()))}
+
+            self.first_day = int(self.cell_day[0]) if count else datetime.now().toordinal()
+            self.day_count = int(self.cell_day[-1]) - self.first_day + 1 if count else 0
+            columns = self.cell_day - self.first_day
+            self.branch_day_revenue = np.zeros((len(self.branch_ids), self.day_count))
+            self.branch_day_transactions = np.zeros((len(self.branch_ids), self.day_count))
+            self.employee_day_revenue = np.zeros((len(self.employee_ids), self.day_count))
+            self.employee_day_transactions = np.zeros((len(self.employee_ids), self.day_count))
+            np.add.at(self.branch_day_revenue, (self.cell_branch, columns), self.cell_revenue)
+            np.add.at(self.branch_day_transactions, (self.cell_branch, columns), self.cell_transactions)
+            np.add.at(self.employee_day_revenue, (self.cell_employee, columns), self.cell_revenue)
+            np.add.at(self.employee_day_transactions, (self.cell_employee, columns), self.cell_transactions)
+
+    def on_sales_changed(self, changes):
+        """Инкрементальное обновление пачкой: вычитаем старые версии продаж и добавляем новые"""
+        with self.lock:
+            for sale_id, old_facts, new_facts in changes:
+                if old_facts:
+                    branch_id, employee_id, day, revenue, transactions = old_facts
+                    self.add(branch_id, employee_id, day, -revenue, -transactions)
+                if new_facts:
+                    self.add(*new_facts)
+
+    def add(self, branch_id, employee_id, day, revenue, transactions):
+        """Добавление значений в ячейку куба и во все свёртки"""
+        branch = self.get_ordinal(branch_id or 0, self.branch_ids, self.branch_ordinals)
+        employee = self.get_ordinal(employee_id or 0, self.employee_ids, self.employee_ordinals)
+        day_ordinal = self.to_day_ordinal(day)
+        self.ensure_capacity(day_ordinal)
+        column = day_ordinal - self.first_day
+
+        self.branch_day_revenue[branch, column] += revenue
+        self.branch_day_transactions[branch, column] += transactions
+        self.employee_day_revenue[employee, column] += revenue
+        self.employee_day_transactions[employee, column] += transactions
+
+        key = (branch, employee, day_ordinal)
+        cell = self.cell_index.get(key)
+        if cell is None:
+            cell = self.cell_count
+            if cell == len(self.cell_revenue):
+                capacity = max(1024, cell * 2)
+                self.cell_branch = np.resize(self.cell_branch, capacity)
+                self.cell_employee = np.resize(self.cell_employee, capacity)
+                self.cell_day = np.resize(self.cell_day, capacity)
+                self.cell_revenue = np.resize(self.cell_revenue, capacity)
+                self.cell_transactions = np.resize(self.cell_transactions, capacity)
+            self.cell_branch[cell], self.cell_employee[cell], self.cell_day[cell] = branch, employee, day_ordinal
+            self.cell_revenue[cell] = 0
+            self.cell_transactions[cell] = 0
+            self.cell_index[key] = cell
+            self.cell_count += 1
+        self.cell_revenue[cell] += revenue
+        self.cell_transactions[cell] += transactions
+
+    def get_ordinal(self, key, ids, ordinals):
+        ordinal = ordinals.get(key)
+        if ordinal is None:
+            ordinal = len(ids)
+            ids.append(key)
+            ordinals[key] = ordinal
+            # новый филиал или сотрудник - новая строка в соответствующих свёртках
+            if ids is self.branch_ids:
+                self.branch_day_revenue = self.add_row(self.branch_day_revenue)
+                self.branch_day_transactions = self.add_row(self.branch_day_transactions)
+            else:
+                self.employee_day_revenue = self.add_row(self.employee_day_revenue)
+                self.employee_day_transactions = self.add_row(self.employee_day_transactions)
+        return ordinal
+
+    @staticmethod
+    def add_row(matrix):
+        return np.vstack([matrix, np.zeros((1, matrix.shape[1]))])
+
+    @staticmethod
+    def to_day_ordinal(day):
+        if isinstance(day, str):
+            day = datetime.fromisoformat(day)
+        return day.toordinal()
+
+    def ensure_capacity(self, day_ordinal):
+        """Расширение оси дней влево или вправо с запасом"""
+        left = max(0, self.first_day - day_ordinal)
+        right = max(0, day_ordinal - (self.first_day + self.day_count - 1))
+        if not left and not right:
+            return
+        if left:
+            left = max(left, 31)
+        if right:
+            right = max(right, 31)
+        pad = ((0, 0), (left, right))
+        self.branch_day_revenue = np.pad(self.branch_day_revenue, pad)
+        self.branch_day_transactions = np.pad(self.branch_day_transactions, pad)
+        self.employee_day_revenue = np.pad(self.employee_day_revenue, pad)
+        self.employee_day_transactions = np.pad(self.employee_day_transactions, pad)
+        self.first_day -= left
+        self.day_count += left + right
+
+    def day_slice(self, start=None, end=None):
+        """Срез столбцов оси дней для периода [start, end]"""
+        first = 0 if start is None else max(0, self.to_day_ordinal(start) - self.first_day)
+        last = self.day_count if end is None else min(self.day_count, self.to_day_ordinal(end) - self.first_day + 1)
+        return slice(first, max(first, last))
+
+    def row_indexes(self, ids, ordinals):
+        return [ordinals[key] for key in ids if key in ordinals]
+
+    def totals(self, branch_ids=None, employee_ids=None, start=None, end=None):
+        """Итог среза: (revenue, transactions); None в фильтре - без ограничения по оси"""
+        with self.lock:
+            if branch_ids is not None and employee_ids is not None:
+                mask = self.cell_mask(branch_ids, employee_ids, start, end)
+                return float(self.cell_revenue[:self.cell_count][mask].sum()), \
+                    int(round(self.cell_transactions[:self.cell_count][mask].sum()))
+            days = self.day_slice(start, end)
+            if employee_ids is not None:
+                rows = self.row_indexes(employee_ids, self.employee_ordinals)
+                revenue, transactions = self.employee_day_revenue, self.employee_day_transactions
+            else:
+                rows = self.row_indexes(branch_ids, self.branch_ordinals) if branch_ids is not None else slice(None)
+                revenue, transactions = self.branch_day_revenue, self.branch_day_transactions
+            return float(revenue[rows, days].sum()), int(round(transactions[rows, days].sum()))
+
+    def breakdown(self, axis, branch_ids=None, employee_ids=None, start=None, end=None):
+        """Разрез по оси 'branch', 'employee' или 'day': [(ключ, revenue, transactions)] без нулевых строк"""
+        with self.lock:
+            days = self.day_slice(start, end)
+            if axis == 'branch' and employee_ids is None:
+                revenue, transactions = self.reduce_rows(self.branch_day_revenue, self.branch_day_transactions,
+                                                         branch_ids, self.branch_ordinals, days, axis=1)
+                keys = self.branch_ids
+            elif axis == 'employee' and branch_ids is None:
+                revenue, transactions = self.reduce_rows(self.employee_day_revenue, self.employee_day_transactions,
+                                                         employee_ids, self.employee_ordinals, days, axis=1)
+                keys = self.employee_ids
+            elif axis == 'day' and (branch_ids is None or employee_ids is None):
+                if employee_ids is not None:
+                    revenue, transactions = self.reduce_rows(self.employee_day_revenue, self.employee_day_transactions,
+                                                             employee_ids, self.employee_ordinals, days, axis=0)
+                else:
+                    revenue, transactions = self.reduce_rows(self.branch_day_revenue, self.branch_day_transactions,
+                                                             branch_ids, self.branch_ordinals, days, axis=0)
+                keys = [datetime.fromordinal(self.first_day + column).strftime('%Y-%m-%d')
+                        for column in range(days.start, days.stop)]
+            else:
+                # Фильтр по обеим осям - считаем по ячейкам куба
+                mask = self.cell_mask(branch_ids, employee_ids, start, end)
+                if axis == 'branch':
+                    groups, keys = self.cell_branch[:self.cell_count][mask], self.branch_ids
+                elif axis == 'employee':
+                    groups, keys = self.cell_employee[:self.cell_count][mask], self.employee_ids
+                else:
+                    groups = self.cell_day[:self.cell_count][mask] - self.first_day - days.start
+                    keys = [datetime.fromordinal(self.first_day + column).strftime('%Y-%m-%d')
+                            for column in range(days.start, days.stop)]
+                revenue = np.bincount(groups, self.cell_revenue[:self.cell_count][mask], minlength=len(keys))
+                transactions = np.bincount(groups, self.cell_transactions[:self.cell_count][mask],
+                                           minlength=len(keys))
+            present = np.flatnonzero((transactions != 0) | (np.abs(revenue) > 1e-9))
+            return [(keys[i], value, int(round(count)))
+                    for i, value, count in zip(present.tolist(), revenue[present].tolist(),
+                                               transactions[present].tolist())]
+
+    def reduce_rows(self, revenue, transactions, ids, ordinals, days, axis):
+        if ids is None:
+            return revenue[:, days].sum(axis=axis), transactions[:, days].sum(axis=axis)
+        rows = self.row_indexes(ids, ordinals)
+        if axis == 1:
+            # строки вне фильтра обнуляются, чтобы индексы результата совпадали с порядковыми номерами
+            selected = np.zeros(revenue.shape[0], dtype=bool)
+            selected[rows] = True
+            return (revenue[:, days].sum(axis=1) * selected,
+                    transactions[:, days].sum(axis=1) * selected)
+        return revenue[rows, days].sum(axis=0), transactions[rows, days].sum(axis=0)
+
+    def cell_mask(self, branch_ids, employee_ids, start, end):
+        count = self.cell_count
+        mask = np.ones(count, dtype=bool)
+        if branch_ids is not None:
+            mask &= np.isin(self.cell_branch[:count], self.row_indexes(branch_ids, self.branch_ordinals))
+        if employee_ids is not None:
+            mask &= np.isin(self.cell_employee[:count], self.row_indexes(employee_ids, self.employee_ordinals))
+        days = self.day_slice(start, end)
+        mask &= (self.cell_day[:count] >= self.first_day + days.start) & \
+                (self.cell_day[:count] < self.first_day + days.stop)
+        return mask
+
+
+class SalesForecaster:
+    """Пакетный прогноз дневной выручки сразу для всех филиалов.
+
+    История за HISTORY_DAYS дней собирается в матрицу филиалы × дни, по ней
+    одним векторным проходом считаются коэффициенты дней недели и сглаженный
+    экспоненциально уровень выручки. Результат - ожидаемая выручка каждого
+    филиала в каждый день недели - сохраняется в sales_forecasts.
+    """
+
+    HISTORY_DAYS = 56  # восемь полных недель: каждый день недели встречается одинаково часто
+    SMOOTHING = 0.3
+
+    _lock = threading.Lock()
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def fit(revenue, first_weekday, alpha=SMOOTHING):
+        """Прогноз по матрице revenue (филиалы × дни): ожидаемая выручка филиалы × 7 дней недели"""
+        days = revenue.shape[1]
+        weekdays = (first_weekday + np.arange(days)) % 7
+        weekday_matrix = (weekdays[:, None] == np.arange(7)).astype(float)
+
+        # Коэффициент дня недели - отношение средней выручки в этот день к средней за все дни
+        weekday_means = revenue @ weekday_matrix / np.maximum(weekday_matrix.sum(axis=0), 1)
+        overall_mean = revenue.mean(axis=1, keepdims=True)
+        factors = np.divide(weekday_means, overall_mean, out=np.ones_like(weekday_means),
+                            where=overall_mean > 0)
+
+        # Уровень без сезонности: экспоненциальное сглаживание с весами (1 - alpha)^k от последнего дня;
+        # дни недели, в которые филиал не работает, в уровень не входят
+        day_factors = factors[:, weekdays]
+        working = day_factors > 0
+        deseasonalized = np.divide(revenue, day_factors, out=np.zeros_like(revenue), where=working)
+        weights = (1 - alpha) ** np.arange(days - 1, -1, -1) * working
+        weight_sums = weights.sum(axis=1)
+        level = np.divide((deseasonalized * weights).sum(axis=1), weight_sums,
+                          out=np.zeros(len(revenue)), where=weight_sums > 0)
+        return level[:, None] * factors
+
+    def load_history(self, today):
+        """Матрица выручки филиалы × дни за HISTORY_DAYS дней до today: (branch_ids, first_day, matrix)"""
+        first_day = today - timedelta(days=self.HISTORY_DAYS)
+        rows = self.db.get_branch_daily_revenue(first_day.isoformat(), (today - timedelta(days=1)).isoformat())
+        if rows is None:
+            return None
+        branches = self.db.get_all_branches() or []
+        branch_ids = sorted({branch[0] for branch in branches} | {row[0] for row in rows})
+        branch_index = {branch_id: index for index, branch_id in enumerate(branch_ids)}
+        first_day_number = DatabaseManager.to_day(first_day)
+
+        matrix = np.zeros((len(branch_ids), self.HISTORY_DAYS))
+        if rows:
+            branch_column, day_column, revenue_column = zip(*rows)
+            np.add.at(matrix, ([branch_index[branch_id] for branch_id in branch_column],
+                               np.array(day_column) - first_day_number), revenue_column)
+        return branch_ids, first_day, matrix
+
+    def run(self, today=None):
+        """Пересчёт прогноза по всем филиалам; число филиалов или None при ошибке"""
+        today = today or datetime.now().date()
+        history = self.load_history(today)
+        if history is None:
+            return None
+        branch_ids, first_day, matrix = history
+        forecast = self.fit(matrix, first_day.weekday())
+        computed_on = today.isoformat()
+        rows = [(branch_id, computed_on, *values)
+                for branch_id, values in zip(branch_ids, forecast.tolist())]
+        return self.db.save_sales_forecasts(rows)
+
+    def ensure_fresh(self, today=None):
+        """Пересчёт, если прогноз ещё не считался сегодня (первое обращение за день)"""
+        today = today or datetime.now().date()
+        with self._lock:
+            if self.db.get_forecast_date() != today.isoformat():
+                self.run(today)
+
+
+class AnomalyDetector:
+    """Потоковый поиск аномальных дней по выручке и среднему чеку филиала.
+
+    Для каждого филиала в anomaly_state хранятся экспоненциально взвешенные
+    среднее и дисперсия дневной выручки и среднего чека, а также итоги текущего
+    открытого дня. Каждая продажа обновляет состояние за O(1); день входит в
+    норму, когда приходит продажа за более поздний день. Найденные отклонения
+    записываются в revenue_anomalies.
+    """
+
+    ALPHA = 0.1
+    THRESHOLD = 3.5  # отклонение от нормы в стандартных отклонениях
+    WARMUP_DAYS = 14  # до этого числа закрытых дней норма считается ненадёжной
+    MIN_SPREAD = 0.05  # нижняя граница разброса в долях нормы, чтобы ровная история не давала ложных отметок
+
+    _installed = set()
+    _lock = threading.Lock()
+
+    def __init__(self, db):
+        self.db = db
+
+    @classmethod
+    def install(cls, db_name="sales_system.db"):
+        """Подключение детектора к записи продаж (один раз на процесс); пустое состояние заполняется по истории.
+        Клиенту службы детектор не нужен - он работает в процессе службы"""
+        if DatabaseManager.service is not None:
+            return
+        with cls._lock:
+            if db_name in cls._installed:
+                return
+            cls._installed.add(db_name)
+            detector = cls(DatabaseManager(db_name))
+            rows = detector.db.execute_query(
+                "SELECT EXISTS (SELECT 1 FROM anomaly_state), EXISTS (SELECT 1 FROM daily_sales)")
+            if rows and rows[0][1] and not rows[0][0]:
+                detector.rebuild()
+            DatabaseManager.add_sale_listener(db_name, detector.on_sales_changed)
+
+    @staticmethod
+    def new_state():
+        return {'open_date': None, 'day_revenue': 0.0, 'day_transactions': 0, 'days_seen': 0,
+                'revenue_mean': 0.0, 'revenue_var': 0.0, 'check_mean': 0.0, 'check_var': 0.0}
+
+    @classmethod
+    def spread(cls, mean, var):
+        return max(math.sqrt(var), abs(mean) * cls.MIN_SPREAD, 1e-9)
+
+    @classmethod
+    def check_day(cls, state, revenue, transactions, closed):
+        """Отклонения дня от нормы [(metric, value, expected, score)];
+        у незакрытого дня падение выручки не проверяется - продажи ещё вносятся"""
+        if state['days_seen'] < cls.WARMUP_DAYS or (transactions <= 0 and revenue <= 0):
+            return []
+        flags = []
+        revenue_score = (revenue - state['revenue_mean']) / cls.spread(state['revenue_mean'], state['revenue_var'])
+        if revenue_score > cls.THRESHOLD or (closed and revenue_score < -cls.THRESHOLD):
+            flags.append(('revenue', revenue, state['revenue_mean'], revenue_score))
+        if transactions > 0 and state['check_mean'] > 0:
+            check = revenue / transactions
+            check_score = (check - state['check_mean']) / cls.spread(state['check_mean'], state['check_var'])
+            if abs(check_score) > cls.THRESHOLD:
+                flags.append(('average_check', check, state['check_mean'], check_score))
+        return flags
+
+    @classmethod
+    def update_baseline(cls, state, revenue, transactions):
+        """Учёт закрытого дня в норме; после разогрева выбросы ограничиваются порогом, чтобы не сдвигать норму"""
+        if transactions <= 0 and revenue <= 0:
+            return
+        warm = state['days_seen'] >= cls.WARMUP_DAYS
+        values = [('revenue', revenue, state['days_seen'] > 0)]
+        if transactions > 0:
+            values.append(('check', revenue / transactions, state['check_mean'] > 0))
+        for prefix, value, initialized in values:
+            mean, var = state[f'{prefix}_mean'], state[f'{prefix}_var']
+            if not initialized:
+                state[f'{prefix}_mean'], state[f'{prefix}_var'] = value, 0.0
+                continue
+            if warm:
+                limit = cls.THRESHOLD * cls.spread(mean, var)
+                value = min(max(value, mean - limit), mean + limit)
+            diff = value - mean
+            increment = cls.ALPHA * diff
+            state[f'{prefix}_mean'] = mean + increment
+            state[f'{prefix}_var'] = (1 - cls.ALPHA) * (var + diff * increment)
+        state['days_seen'] += 1
+
+    @classmethod
+    def advance(cls, state, day, revenue, transactions):
+        """Учёт выручки за день не раньше открытого; {date: flags} для дней, чьи отметки изменились"""
+        results = {}
+        if state['open_date'] is not None and day > state['open_date']:
+            # Продажа за следующий день закрывает открытый день
+            results[state['open_date']] = cls.check_day(state, state['day_revenue'], state['day_transactions'],
+                                                        closed=True)
+            cls.update_baseline(state, state['day_revenue'], state['day_transactions'])
+            state['open_date'] = None
+        if state['open_date'] is None:
+            state['open_date'], state['day_revenue'], state['day_transactions'] = day, 0.0, 0
+        state['day_revenue'] += revenue
+        state['day_transactions'] += transactions
+        results[day] = cls.check_day(state, state['day_revenue'], state['day_transactions'], closed=False)
+        return results
+
+    def on_sales_changed(self, changes):
+        """Учёт пачки изменений продаж одной транзакцией; состояние читается уже под блокировкой записи,
+        чтобы другой процесс не обновил его между чтением и записью"""
+        def apply(cursor):
+            cursor.execute("BEGIN IMMEDIATE")
+            for sale_id, old_facts, new_facts in changes:
+                for facts, sign in [(old_facts, -1), (new_facts, 1)]:
+                    if facts:
+                        branch_id, employee_id, day, revenue, transactions = facts
+                        self.process(cursor, branch_id, day, sign * revenue, sign * transactions)
+
+        if any(old_facts or new_facts for sale_id, old_facts, new_facts in changes):
+            self.db.execute_transaction(apply)
+
+    def process(self, cursor, branch_id, day, revenue, transactions):
+        cursor.execute("SELECT * FROM anomaly_state WHERE branch_id = ?", (branch_id,))
+        row = cursor.fetchone()
+        state = self.new_state()
+        if row:
+            state.update(zip([column[0] for column in cursor.description][1:], row[1:]))
+
+        if state['open_date'] is not None and day < state['open_date']:
+            # Исправление уже закрытого дня: норма не пересчитывается, день проверяется заново
+            cursor.execute(
+                "SELECT SUM(revenue_kopecks) / 100.0, SUM(transactions) FROM daily_sales WHERE branch_id = ? AND day = ?",
+                (branch_id, DatabaseManager.to_day(day)))
+            day_revenue, day_transactions = cursor.fetchone()
+            results = {day: self.check_day(state, day_revenue, day_transactions, closed=True)
+                       if day_revenue is not None else []}
+        else:
+            results = self.advance(state, day, revenue, transactions)
+
+        self.save_states(cursor, {branch_id: state})
+        for flag_date, flags in results.items():
+            cursor.execute("DELETE FROM revenue_anomalies WHERE branch_id = ? AND date = ?", (branch_id, flag_date))
+            self.save_flags(cursor, [(branch_id, flag_date, *flag) for flag in flags])
+        return []
+
+    @staticmethod
+    def save_states(cursor, states):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO anomaly_state (branch_id, open_date, day_revenue, day_transactions, days_seen,
+                                                  revenue_mean, revenue_var, check_mean, check_var)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(branch_id, state['open_date'], state['day_revenue'], state['day_transactions'], state['days_seen'],
+               state['revenue_mean'], state['revenue_var'], state['check_mean'], state['check_var'])
+              for branch_id, state in states.items()])
+
+    @staticmethod
+    def save_flags(cursor, rows):
+        cursor.executemany('''
+            INSERT INTO revenue_anomalies (branch_id, date, metric, value, expected, score)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+    def rebuild(self):
+        """Пересчёт состояния и отметок по всей истории одним потоковым проходом по daily_sales"""
+        def rebuild(cursor):
+            cursor.execute("BEGIN IMMEDIATE")
+            states, day_flags = {}, {}
+            rows = cursor.execute(f'''
+                SELECT branch_id, {DatabaseManager.sql_date('day')}, SUM(revenue_kopecks) / 100.0, SUM(transactions)
+                FROM daily_sales
+                GROUP BY branch_id, day ORDER BY branch_id, day
+            ''')
+            for branch_id, day, revenue, transactions in rows:
+                state = states.setdefault(branch_id, self.new_state())
+                for flag_date, flags in self.advance(state, day, revenue, transactions).items():
+                    if flags:
+                        day_flags[(branch_id, flag_date)] = flags
+                    else:
+                        day_flags.pop((branch_id, flag_date), None)
+
+            cursor.execute("DELETE FROM anomaly_state")
+            cursor.execute("DELETE FROM revenue_anomalies")
+            self.save_states(cursor, states)
+            self.save_flags(cursor, [(branch_id, flag_date, *flag)
+                                     for (branch_id, flag_date), flags in day_flags.items() for flag in flags])
+            return len(day_flags)
+
+        return self.db.execute_transaction(rebuild)
+
+
+class BranchReplicator:
+    """Перенос изменений базы филиала в центральную базу по журналам изменений.
+
+    Центральная база хранит для каждого источника (instance_id базы филиала)
+    номера последних перенесённых записей sales_change_log и data_change_log
+    и соответствие id строк источника своим id. Синхронизация читает журналы
+    после этих номеров и переносит текущее состояние затронутых строк (строки,
+    которых в источнике уже нет, удаляются), поэтому повторный перенос ничего
+    не меняет, а его стоимость зависит от числа изменений, а не от размера
+    базы. Первая синхронизация источника и синхронизация после очистки его
+    журнала переносят все строки. Базу, открытую из другого файла, чем тот,
+    в котором она создана (копия файла несёт тот же instance_id, и две базы
+    смешались бы в одну), синхронизация не переносит, пока для неё не
+    выполнено set_instance (--instance). Пользователи сопоставляются по email и
+    из центральной базы не удаляются - они общие для филиалов; пароли не
+    переносятся. Журналы источника по умолчанию не очищаются: их читает и
+    шина изменений работающего приложения филиала. Продажи обеих
+    баз читаются вместе с архивами: перенесённые в архив продажи не считаются
+    удалёнными.
+    """
+
+    CHUNK_SIZE = 500
+    # Таблицы в порядке зависимостей: (таблица, столбцы, {столбец: таблица, на строку которой он ссылается})
+    TABLES = [
+        ('users', ['full_name', 'email', 'role', 'created_at'], {}),
+        ('branches', ['name', 'address', 'manager', 'phone', 'created_at'], {}),
+        ('employees', ['name', 'position', 'phone', 'branch_id'], {'branch_id': 'branches'}),
+        ('sales_plans', ['branch_id', 'year', 'month', 'daily_plan', 'monthly_plan', 'created_at'],
+         {'branch_id': 'branches'}),
+        ('sales_records', ['day', 'revenue_kopecks', 'transactions', 'employee_id', 'branch_id', 'notes', 'user_id'],
+         {'employee_id': 'employees', 'branch_id': 'branches', 'user_id': 'users'}),
+    ]
+
+    # Таблицы, которые читаются через представление всей истории с архивами
+    READ_TABLES = {'sales_records': 'all_sales_records'}
+
+    def __init__(self, source, central):
+        self.source = source
+        self.central = central
+
+    def sync(self, trim=False):
+        """Перенос изменений источника в центральную базу: число добавленных, изменённых и удалённых строк
+        или None при ошибке. При trim перенесённые записи журналов источника удаляются - только когда
+        приложение филиала не запущено: его шина изменений после очистки перечитывает данные целиком"""
+        for db in (self.source, self.central):
+            copied = db.is_copied_file()
+            if copied is None:
+                return None
+            if copied:
+                print(f"Ошибка синхронизации: база {db.db_name} открыта не из того файла, в котором создана. "
+                      f"Если это копия другой базы, задайте ей новый id: --instance {db.db_name} new; "
+                      f"если та же база перенесена или восстановлена: --instance {db.db_name} keep")
+                return None
+        source_id = self.source.get_database_info('instance_id')
+        if source_id is None or source_id == self.central.get_database_info('instance_id'):
+            print("Ошибка синхронизации: база филиала недоступна или совпадает с центральной")
+            return None
+        rows = self.central.execute_query("SELECT sales_seq, data_seq FROM replication_sources WHERE source = ?",
+                                          (source_id,))
+        if rows is None:
+            return None
+        watermark = rows[0] if rows else None
+        changes = self.source.execute_transaction(lambda cursor: self.read_changes(cursor, watermark),
+                                                  with_archives=True)
+        if changes is None:
+            return None
+        result = self.central.execute_transaction(lambda cursor: self.apply_changes(cursor, source_id, changes),
+                                                  with_archives=True)
+        if result is None:
+            return None
+        applied, conflicts = result
+        if conflicts:
+            print(f"Изменения продаж закрытых лет не перенесены (см. replication_conflicts): {conflicts}")
+        self.central.invalidate_tables(*(table for table, _, _ in self.TABLES))
+        if trim:
+            self.source.trim_change_logs(changes['sales_seq'], changes['data_seq'])
+        return applied
+
+    @staticmethod
+    def chunks(values, size):
+        values = list(values)
+        for start in range(0, len(values), size):
+            yield values[start:start + size]
+
+    def read_changes(self, cursor, watermark):
+        """Чтение изменений источника после watermark (sales_seq, data_seq) одним согласованным снимком базы:
+        {'full', 'sales_seq', 'data_seq', 'tables': {таблица: (изменённые id или None - все, {id: строка})}}"""
+        cursor.execute("BEGIN")  # все чтения видят базу в одном состоянии
+        cursor.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('sales_change_log', 'data_change_log')")
+        sequences = dict(cursor.fetchall())
+        sales_seq, data_seq = sequences.get('sales_change_log', 0), sequences.get('data_change_log', 0)
+        cursor.execute("SELECT key, value FROM database_info WHERE key IN ('sales_log_floor', 'data_log_floor')")
+        floors = {key: int(value) for key, value in cursor.fetchall()}
+        full = (watermark is None or watermark[0] < floors.get('sales_log_floor', 0)
+                or watermark[1] < floors.get('data_log_floor', 0))
+
+        changed = {table: None if full else set() for table, _, _ in self.TABLES}
+        if not full:
+            cursor.execute("SELECT DISTINCT sale_id FROM sales_change_log WHERE seq > ? AND seq <= ?",
+                           (watermark[0], sales_seq))
+            changed['sales_records'].update(row[0] for row in cursor.fetchall())
+            cursor.execute("SELECT DISTINCT table_name, row_id FROM data_change_log WHERE seq > ? AND seq <= ?",
+                           (watermark[1], data_seq))
+            for table, row_id in cursor.fetchall():
+                if table in changed:
+                    changed[table].add(row_id)
+
+        # Строки читаются от зависимых таблиц к основным: вместе с изменёнными строками переносятся строки,
+        # на которые они ссылаются, чтобы ссылки в центральной базе было на что переводить
+        tables = {}
+        wanted = {table: set() for table in changed}
+        for table, columns, references in reversed(self.TABLES):
+            select = f"SELECT id, {', '.join(columns)} FROM {self.READ_TABLES.get(table, table)}"
+            if changed[table] is None:
+                rows = cursor.execute(select).fetchall()
+            else:
+                rows = []
+                for chunk in self.chunks(changed[table] | wanted[table], self.CHUNK_SIZE):
+                    cursor.execute(f"{select} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                    rows += cursor.fetchall()
+            tables[table] = (changed[table], {row[0]: row[1:] for row in rows})
+            for column, target in references.items():
+                index = columns.index(column)
+                wanted[target].update(row[index + 1] for row in rows if row[index + 1])
+        return {'full': full, 'sales_seq': sales_seq, 'data_seq': data_seq, 'tables': tables}
+
+    def apply_changes(self, cursor, source_id, changes):
+        """Применение изменений к центральной базе: (число перенесённых строк, число пропущенных конфликтов)"""
+        mapping = {table: {} for table, _, _ in self.TABLES}
+        # Продажи года, перенесённого в архив центральной базы, не меняются (триггеры архива): такие изменения
+        # источника записываются в replication_conflicts и пропускаются, чтобы одна строка не останавливала перенос
+        cursor.execute("SELECT year FROM sales_archives")
+        closed_years = {row[0] for row in cursor.fetchall()}
+        conflicts = 0
+
+        def sale_years(day, central_id):
+            """Закрытые годы, которых касается изменение продажи: новый и текущий в центральной базе"""
+            years = {datetime.fromordinal(day + DatabaseManager.EPOCH_ORDINAL).year} if day is not None else set()
+            if central_id is not None:
+                cursor.execute("SELECT day FROM all_sales_records WHERE id = ?", (central_id,))
+                row = cursor.fetchone()
+                if row:
+                    years.add(datetime.fromordinal(row[0] + DatabaseManager.EPOCH_ORDINAL).year)
+            return years & closed_years
+
+        def conflict(table, row_id, op, years):
+            nonlocal conflicts
+            cursor.execute("INSERT OR REPLACE INTO replication_conflicts (source, table_name, source_id, op, year) "
+                           "VALUES (?, ?, ?, ?, ?)", (source_id, table, row_id, op, min(years)))
+            conflicts += 1
+
+        def central_ids(table, ids):
+            """id центральной базы для id источника (только уже перенесённые строки)"""
+            missing = [row_id for row_id in ids if row_id not in mapping[table]]
+            for chunk in self.chunks(missing, self.CHUNK_SIZE):
+                cursor.execute(f'''
+                    SELECT source_id, central_id FROM replication_map
+                    WHERE source = ? AND table_name = ? AND source_id IN ({', '.join('?' * len(chunk))})
+                ''', [source_id, table] + chunk)
+                mapping[table].update(cursor.fetchall())
+            return mapping[table]
+
+        def remember(table, row_id, central_id):
+            cursor.execute("INSERT OR REPLACE INTO replication_map (source, table_name, source_id, central_id) "
+                           "VALUES (?, ?, ?, ?)", (source_id, table, row_id, central_id))
+            mapping[table][row_id] = central_id
+
+        applied = 0
+        for table, columns, references in self.TABLES:
+            changed, rows = changes['tables'][table]
+            if changed is None:
+                cursor.execute("SELECT source_id, central_id FROM replication_map WHERE source = ? AND table_name = ?",
+                               (source_id, table))
+                mapping[table].update(cursor.fetchall())
+            known = central_ids(table, list(rows) + list(changed or []))
+            for column, target in references.items():
+                index = columns.index(column)
+                central_ids(target, {row[index] for row in rows.values() if row[index]})
+            assignments = ', '.join(f"{column} = ?" for column in columns)
+            unchanged = ' AND '.join(f"{column} IS ?" for column in columns)
+            for row_id, row in rows.items():
+                values = list(row)
+                for column, target in references.items():
+                    index = columns.index(column)
+                    if values[index]:
+                        values[index] = mapping[target].get(values[index])
+                central_id = known.get(row_id)
+                if central_id is None and table == 'users':
+                    cursor.execute("SELECT id FROM users WHERE email = ?", (values[columns.index('email')],))
+                    match = cursor.fetchone()
+                    if match:
+                        central_id = match[0]
+                        remember(table, row_id, central_id)
+                if table == 'sales_records' and closed_years:
+                    years = sale_years(values[columns.index('day')], central_id)
+                    if years:
+                        # Совпадающая с источником продажа закрытого года конфликтом не считается
+                        if central_id is None:
+                            conflict(table, row_id, 'insert', years)
+                            continue
+                        cursor.execute(f"SELECT 1 FROM all_sales_records WHERE id = ? AND {unchanged}",
+                                       [central_id] + values)
+                        if not cursor.fetchone():
+                            conflict(table, row_id, 'update', years)
+                        continue
+                if central_id is not None:
+                    # Строка, уже совпадающая с источником, не переписывается - повторный перенос ничего не меняет
+                    cursor.execute(f"UPDATE {table} SET {assignments} WHERE id = ? AND NOT ({unchanged})",
+                                   values + [central_id] + values)
+                    if cursor.rowcount:
+                        applied += 1
+                        continue
+                    cursor.execute(f"SELECT 1 FROM {table} WHERE id = ?", (central_id,))
+                    if cursor.fetchone():
+                        continue
+                insert_columns = columns
+                if table == 'users':
+                    # Пароль не переносится: новому пользователю центральной базы ставится случайный,
+                    # войти по нему нельзя, пока пароль не задан заново
+                    insert_columns, values = columns + ['password'], values + [uuid.uuid4().hex]
+                cursor.execute(f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+                               f"VALUES ({', '.join('?' * len(insert_columns))})", values)
+                remember(table, row_id, cursor.lastrowid)
+                applied += 1
+            if table == 'users':
+                continue
+            removed = (set(known) if changed is None else changed & set(known)) - set(rows)
+            for row_id in removed:
+                if table == 'sales_records' and closed_years:
+                    years = sale_years(None, known[row_id])
+                    if years:
+                        conflict(table, row_id, 'delete', years)
+                        continue
+                cursor.execute(f"DELETE FROM {table} WHERE id = ?", (known[row_id],))
+                cursor.execute("DELETE FROM replication_map WHERE source = ? AND table_name = ? AND source_id = ?",
+                               (source_id, table, row_id))
+                applied += 1
+        cursor.execute('''
+            INSERT OR REPLACE INTO replication_sources (source, sales_seq, data_seq, synced_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (source_id, changes['sales_seq'], changes['data_seq']))
+        return applied, conflicts
+
+
+class SalesSnapshot:
+    """Общий для процесса столбцовый снимок таблицы sales.
+
+    Числа лежат в массивах NumPy, упорядоченных по (date, id), даты - номерами
+    дней от 1970-01-01 (4 байта вместо строки в 10 символов); сотрудник,
+    филиал и пользователь хранятся идентификаторами, имена к которым берутся из
+    небольших словарей, примечания - кодами словаря уникальных строк. Снимок
+    строится одним запросом и дальше обновляется построчно по уведомлениям
+    DatabaseManager о записи продаж.
+
+    Снимок сохраняется рядом с базой (<база>.snapshot/) вместе с номером
+    последнего учтённого изменения из sales_change_log. При следующем запуске
+    файлы отображаются в память без чтения истории, а из базы догружаются
+    только продажи, изменённые после этого номера.
+    """
+
+    COLUMNS = [
+        ('ids', np.int32), ('dates', np.int32), ('revenue', np.float64), ('transactions', np.int32),
+        ('average_check', np.float64), ('employee_ids', np.int32), ('branch_ids', np.int32),
+        ('user_ids', np.int32), ('notes', np.int32),
+    ]
+    CHUNK_SIZE = 50000
+    NOT_SPECIFIED = "Не указан"
+    SNAPSHOT_FORMAT = 1  # меняется при изменении набора или типов столбцов, старый снимок тогда перестраивается
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls, db_name="sales_system.db"):
+        """Общий для процесса снимок по базе db_name (строится при первом обращении)"""
+        with cls._instances_lock:
+            snapshot = cls._instances.get(db_name)
+            if snapshot is None:
+                snapshot = cls(DatabaseManager(db_name))
+                cls._instances[db_name] = snapshot
+            return snapshot
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.RLock()
+        self.version = 0  # растёт с каждым изменением, по нему представления понимают, что данные устарели
+        self.employee_names, self.branch_names, self.user_names = {}, {}, {}
+        # Сохранённый снимок отображается в память сразу, из базы догружаются только более новые изменения
+        if self.load():
+            self.catch_up()
+        else:
+            self.build()
+            self.save()
+        self.reload_names()
+        DatabaseManager.add_sale_listener(db.db_name, self.on_sales_changed)
+
+    @classmethod
+    def save_all(cls):
+        """Сохранение всех снимков процесса на диск (при выходе из приложения)"""
+        with cls._instances_lock:
+            snapshots = list(cls._instances.values())
+        for snapshot in snapshots:
+            snapshot.save()
+
+    def build(self):
+        """Полное построение снимка; строки основной базы и каждого архива читаются страницами по CHUNK_SIZE
+        (в режиме клиента - через службу) и упорядочиваются по (date, id) уже в памяти"""
+        with self.lock:
+            while True:
+                # Номер изменения берётся до чтения: всё, что запишется во время чтения, применится при догрузке
+                self.change_seq = self.db.get_sales_change_seq()
+                self.note_values, self.note_codes = [''], {'': 0}
+                partitions = self.db.get_sale_partitions()
+                chunks = self.read_partitions(partitions) if partitions is not None else None
+                # Архив, завершённый во время чтения, мог забрать продажи из уже прочитанной основной базы
+                if chunks is None or self.db.get_sale_partitions() == partitions:
+                    break
+            chunks = chunks or []
+            columns = {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks
+                       else np.zeros(0, dtype=dtype) for name, dtype in self.COLUMNS}
+            order = np.lexsort((columns['ids'], columns['dates']))
+            self.columns = {name: values[order] for name, values in columns.items()}
+            self.version += 1
+
+    def read_partitions(self, partitions):
+        """Закодированные страницы продаж частей истории partitions; None при ошибке"""
+        chunks = []
+        for year in partitions:
+            after_id = 0
+            while True:
+                rows = self.db.get_sale_records_page(year, after_id, self.CHUNK_SIZE)
+                if rows is None:
+                    return None
+                if not rows:
+                    break
+                chunks.append(self.encode(rows))
+                after_id = rows[-1][0]
+        return chunks
+
+    def snapshot_dir(self):
+        return f"{self.db.db_name}.snapshot"
+
+    def load(self):
+        """Отображение сохранённого снимка в память; False, если его нет или он не подходит к базе"""
+        directory = self.snapshot_dir()
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            # Снимок другой базы с тем же именем файла или номер изменения больше текущего (база восстановлена из копии)
+            if (meta['format'] != self.SNAPSHOT_FORMAT
+                    or meta['instance_id'] != self.db.get_database_info('instance_id')
+                    or meta['change_seq'] > self.db.get_sales_change_seq()
+                    or meta['change_seq'] < self.db.get_change_log_floor('sales')):
+                return False
+            columns = {}
+            for name, dtype in self.COLUMNS:
+                values = np.load(os.path.join(directory, f"{name}.{meta['generation']}.npy"), mmap_mode='r')
+                if values.dtype != np.dtype(dtype) or len(values) != meta['rows']:
+                    return False
+                columns[name] = values
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self.lock:
+            self.columns = columns
+            self.note_values = meta['notes']
+            self.note_codes = {note: code for code, note in enumerate(self.note_values)}
+            self.change_seq = meta['change_seq']
+            self.generation = meta['generation']
+            self.saved_version = self.version = self.version + 1
+        return True
+
+    def save(self):
+        """Запись снимка в .npy-файлы нового поколения; meta.json заменяется последним, поэтому
+        прерванная запись оставляет на диске предыдущий целый снимок"""
+        directory = self.snapshot_dir()
+        self.catch_up()
+        with self.lock:
+            if getattr(self, 'saved_version', None) == self.version:
+                return True
+            generation = getattr(self, 'generation', 0) + 1
+            try:
+                os.makedirs(directory, exist_ok=True)
+                for name, values in self.columns.items():
+                    np.save(os.path.join(directory, f"{name}.{generation}.npy"), values)
+                meta = {'format': self.SNAPSHOT_FORMAT, 'generation': generation, 'rows': len(self),
+                        'instance_id': self.db.get_database_info('instance_id'), 'change_seq': self.change_seq,
+                        'notes': self.note_values}
+                meta_path = os.path.join(directory, "meta.json")
+                with open(meta_path + ".tmp", "w", encoding="utf-8") as meta_file:
+                    json.dump(meta, meta_file, ensure_ascii=False)
+                os.replace(meta_path + ".tmp", meta_path)
+            except OSError as e:
+                print(f"Ошибка сохранения снимка продаж: {e}")
+                return False
+            self.generation = generation
+            self.saved_version = self.version
+
+        # Файлы прежних поколений удаляются; отображённые в память (Windows) остаются до следующего сохранения
+        suffix = f".{generation}.npy"
+        for file_name in os.listdir(directory):
+            if file_name.endswith(".npy") and not file_name.endswith(suffix):
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except OSError:
+                    pass
+        return True
+
+    def catch_up(self):
+        """Применение изменений sales, записанных в журнал после change_seq (в том числе другими процессами)"""
+        if self.change_seq < self.db.get_change_log_floor('sales'):
+            # Нужные записи журнала уже удалены - снимок строится заново
+            self.build()
+            return len(self)
+        changes = self.db.get_sales_changes(self.change_seq)
+        if not changes:
+            return 0
+        with self.lock:
+            self.apply_changes(sorted({change[1] for change in changes}))
+            self.change_seq = max(self.change_seq, changes[-1][0])
+        return len(changes)
+
+    def reload_names(self):
+        """Перечитывание словарей имён сотрудников, филиалов и пользователей"""
+        employee_names = self.db.get_name_map('employees')
+        branch_names = self.db.get_name_map('branches')
+        user_names = self.db.get_name_map('users')
+        with self.lock:
+            self.employee_names, self.branch_names, self.user_names = employee_names, branch_names, user_names
+
+    def encode(self, rows):
+        values = list(zip(*rows))
+        count = len(rows)
+        encoded = {name: np.array(values[index], dtype=dtype) for index, (name, dtype) in enumerate(self.COLUMNS[:-1])}
+        encoded['notes'] = np.fromiter((self.note_code(note) for note in values[-1]), dtype=np.int32, count=count)
+        return encoded
+
+    @staticmethod
+    def date_strings(days):
+        """Номера дней в строки 'YYYY-MM-DD'"""
+        return np.datetime_as_string(days.astype('datetime64[D]')).tolist()
+
+    def note_code(self, note):
+        code = self.note_codes.get(note)
+        if code is None:
+            code = len(self.note_values)
+            self.note_values.append(note)
+            self.note_codes[note] = code
+        return code
+
+    def on_sales_changed(self, changes):
+        # Пачка изменений (перенос продаж филиала, пакетный ввод) применяется одной перестройкой массивов
+        self.apply_changes([change[0] for change in changes])
+
+    def apply_changes(self, sale_ids):
+        """Замена строк продаж sale_ids их текущими версиями из базы (удалённые просто исчезают);
+        если в снимке уже те же строки, версия не меняется"""
+        rows = self.db.get_sale_rows(sale_ids)
+        if rows is None:
+            return
+        with self.lock:
+            keep = ~np.isin(self.columns['ids'], sale_ids)
+            encoded = self.encode(sorted(rows, key=lambda row: (row[1], row[0]))) if rows else None
+            current = np.flatnonzero(~keep)
+            if len(current) == len(rows) and (not rows or all(
+                    np.array_equal(values[current], encoded[name]) for name, values in self.columns.items())):
+                return
+            if not keep.all():
+                self.columns = {name: values[keep] for name, values in self.columns.items()}
+            if rows:
+                dates, ids = self.columns['dates'], self.columns['ids']
+                # Места вставки ищутся двоичным поиском сначала по дате, затем по id внутри даты
+                first = np.searchsorted(dates, encoded['dates'], 'left')
+                last = np.searchsorted(dates, encoded['dates'], 'right')
+                positions = [start + np.searchsorted(ids[start:stop], sale_id)
+                             for start, stop, sale_id in zip(first.tolist(), last.tolist(),
+                                                             encoded['ids'].tolist())]
+                self.columns = {name: np.insert(values, positions, encoded[name])
+                                for name, values in self.columns.items()}
+            self.version += 1
+
+    def __len__(self):
+        return len(self.columns['ids'])
+
+    def order(self):
+        """Позиции всех продаж в порядке показа: новые даты сверху"""
+        return np.arange(len(self) - 1, -1, -1)
+
+    def find(self, sale_id):
+        with self.lock:
+            return np.flatnonzero(self.columns['ids'] == sale_id)
+
+    def sale_ids(self, positions):
+        with self.lock:
+            return self.columns['ids'][positions].tolist()
+
+    def label_mask(self, ids, names, text):
+        """Совпадение text с именами по идентификаторам; строка сравнивается один раз на уникальный id"""
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        matches = np.array([text in names.get(key, self.NOT_SPECIFIED).lower() for key in unique_ids.tolist()],
+                           dtype=bool)
+        return matches[inverse] if len(matches) else np.zeros(len(ids), dtype=bool)
+
+    def search(self, text):
+        """Позиции продаж (в порядке показа), у которых text встречается в дате, именах, примечаниях или суммах"""
+        text = text.lower()
+        with self.lock:
+            columns = self.columns
+            unique_dates, inverse = np.unique(columns['dates'], return_inverse=True)
+            mask = np.array([text in day for day in self.date_strings(unique_dates)],
+                            dtype=bool)[inverse] if len(unique_dates) else np.zeros(len(self), dtype=bool)
+            mask |= self.label_mask(columns['employee_ids'], self.employee_names, text)
+            mask |= self.label_mask(columns['branch_ids'], self.branch_names, text)
+            note_matches = np.array([bool(note) and text in note.lower() for note in self.note_values], dtype=bool)
+            mask |= note_matches[columns['notes']]
+            # Суммы форматируются в строки только для запросов, похожих на число
+            if text.replace('.', '').isdigit():
+                for name, template in [('revenue', '%.2f'), ('transactions', '%d'), ('average_check', '%.2f')]:
+                    unique_values, inverse = np.unique(columns[name], return_inverse=True)
+                    if len(unique_values):
+                        mask |= (np.char.find(np.char.mod(template, unique_values), text) >= 0)[inverse]
+            return np.flatnonzero(mask)[::-1]
+
+    def records(self, positions):
+        """Строки для показа и экспорта в порядке positions:
+        (id, date, revenue, transactions, average_check, employee_name, branch_name, notes, user_name)"""
+        with self.lock:
+            selected = {name: values[positions] for name, values in self.columns.items()}
+            employee_names, branch_names, user_names = self.employee_names, self.branch_names, self.user_names
+            note_values = self.note_values
+        return zip(selected['ids'].tolist(),
+                   self.date_strings(selected['dates']),
+                   selected['revenue'].tolist(),
+                   selected['transactions'].tolist(),
+                   selected['average_check'].tolist(),
+                   [employee_names.get(key, self.NOT_SPECIFIED) for key in selected['employee_ids'].tolist()],
+                   [branch_names.get(key, self.NOT_SPECIFIED) for key in selected['branch_ids'].tolist()],
+                   [note_values[code] for code in selected['notes'].tolist()],
+                   [user_names.get(key, self.NOT_SPECIFIED) for key in selected['user_ids'].tolist()])
+
 
 class AnimatedGradientWidget(QWidget):
     def __init__(self):
@@ -415,9 +3454,14 @@ class GradientWidget(QWidget):
 
 
 class BranchManagementDialog(QDialog):
+    delete_progress = Signal(int, int)  # из фонового потока удаления: обработано продаж, всего
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.db = DatabaseManager()
+        self.delete_pool = QThreadPool()
+        self.delete_task = None
+        self.delete_request_id = 0
         self.setWindowTitle("Управление филиалами")
         self.resize(1200, 800)
         self.setModal(True)
@@ -454,6 +3498,9 @@ class BranchManagementDialog(QDialog):
         form_layout.addRow("Менеджер:", self.branch_manager_input)
         form_layout.addRow("Телефон:", self.branch_phone_input)
 
+        self.reassign_combo = QComboBox()
+        form_layout.addRow("Продажи удаляемого филиала передать:", self.reassign_combo)
+
         button_layout = QHBoxLayout()
         self.add_branch_btn = QPushButton("Добавить")
         self.update_branch_btn = QPushButton("Заменить")
@@ -468,6 +3515,12 @@ class BranchManagementDialog(QDialog):
         form_group.setLayout(form_layout)
         layout.addWidget(form_group)
 
+        self.delete_progress_bar = QProgressBar()
+        self.delete_progress_bar.setFormat("Удаление филиала: %v из %m продаж")
+        self.delete_progress_bar.hide()
+        layout.addWidget(self.delete_progress_bar)
+        self.delete_progress.connect(self.on_delete_progress)
+
         self.add_branch_btn.clicked.connect(self.add_branch)
         self.update_branch_btn.clicked.connect(self.update_branch)
         self.delete_branch_btn.clicked.connect(self.delete_branch)
@@ -487,6 +3540,10 @@ class BranchManagementDialog(QDialog):
                 self.branches_table.setItem(row, 2, QTableWidgetItem(str(branch[2]) if branch[2] else ""))
                 self.branches_table.setItem(row, 3, QTableWidgetItem(str(branch[3]) if branch[3] else ""))
                 self.branches_table.setItem(row, 4, QTableWidgetItem(str(branch[4]) if branch[4] else ""))
+            self.reassign_combo.clear()
+            self.reassign_combo.addItem("Никому (филиал не указан)", None)
+            for branch in branches:
+                self.reassign_combo.addItem(branch[1], branch[0])
 
     def add_branch(self):
         name = self.branch_name_input.text().strip()
@@ -536,14 +3593,65 @@ class BranchManagementDialog(QDialog):
             return
 
         branch_id = branches[selected_row][0]
+        reassign_to = self.reassign_combo.currentData()
+        if reassign_to == branch_id:
+            QMessageBox.warning(self, "Ошибка", "Продажи нельзя передать удаляемому филиалу")
+            return
+        archived = self.db.count_archived_branch_sales(branch_id)
+        if archived:
+            QMessageBox.warning(self, "Ошибка",
+                                f"У филиала {archived} продаж за закрытые годы в архиве.\n"
+                                "Архивные продажи не изменяются, поэтому такой филиал удалить нельзя")
+            return
         reply = QMessageBox.question(self, "Подтверждение", "Вы уверены, что хотите удалить этот филиал?",
                                      QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
-            result = self.db.delete_branch(branch_id)
-            if result is not None:
-                self.load_branches()
-                self.clear_branch_form()
-                QMessageBox.information(self, "Успех", "Филиал удален")
+            # У филиала могут быть сотни тысяч продаж: они передаются в фоне порциями, не закрывая базу
+            # для записи остальным пользователям, а диалог показывает ход удаления
+            self.delete_request_id += 1
+            self.delete_task = BackgroundTask(self.delete_request_id, self.db.delete_branch, branch_id, reassign_to,
+                                              self.delete_progress.emit)
+            self.delete_task.signals.finished.connect(self.on_branch_deleted)
+            self.delete_task.signals.error.connect(self.on_branch_delete_failed)
+            self.set_deleting(True)
+            self.delete_pool.start(self.delete_task)
+
+    def set_deleting(self, deleting):
+        for button in (self.add_branch_btn, self.update_branch_btn, self.delete_branch_btn):
+            button.setEnabled(not deleting)
+        self.delete_progress_bar.setRange(0, 0)  # до первой порции число продаж неизвестно
+        self.delete_progress_bar.setVisible(deleting)
+
+    def on_delete_progress(self, done, total):
+        self.delete_progress_bar.setRange(0, total)
+        self.delete_progress_bar.setValue(done)
+
+    def on_branch_deleted(self, request_id, result):
+        if request_id != self.delete_request_id:
+            return
+        self.delete_task = None
+        self.set_deleting(False)
+        if result is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось удалить филиал, повторите удаление")
+            return
+        self.load_branches()
+        self.clear_branch_form()
+        QMessageBox.information(self, "Успех", f"Филиал удален, передано продаж: {result}")
+
+    def on_branch_delete_failed(self, request_id, message):
+        if request_id != self.delete_request_id:
+            return
+        self.delete_task = None
+        self.set_deleting(False)
+        QMessageBox.warning(self, "Ошибка", f"Ошибка удаления филиала: {message}")
+
+    def done(self, result):
+        # При закрытии диалога удаление останавливается после текущей порции; филиал остаётся,
+        # повторное удаление продолжит с того же места
+        if self.delete_task is not None:
+            self.delete_task.cancel()
+        self.delete_pool.waitForDone()
+        super().done(result)
 
     def load_branch_data(self):
         selected_row = self.branches_table.currentRow()
@@ -568,6 +3676,7 @@ class EmployeeManagementDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.db = DatabaseManager()
+        self.employees = []  # строки таблицы: (id, name, position, phone, branch_id, branch_name)
         self.setWindowTitle("Управление сотрудниками магазина")
         self.resize(1200, 800)
         self.setModal(True)
@@ -641,32 +3750,23 @@ class EmployeeManagementDialog(QDialog):
 
     def load_employees(self):
         try:
-            employees = self.db.get_all_employees()
+            employees = self.db.get_employees_with_branches()
             if employees is not None:
+                self.employees = employees
                 self.employee_table.setRowCount(len(employees))
                 for row, employee in enumerate(employees):
                     self.employee_table.setItem(row, 0, QTableWidgetItem(str(row + 1)))
                     self.employee_table.setItem(row, 1, QTableWidgetItem(str(employee[1]) if employee[1] else ""))
                     self.employee_table.setItem(row, 2, QTableWidgetItem(str(employee[2]) if employee[2] else ""))
                     self.employee_table.setItem(row, 3, QTableWidgetItem(str(employee[3]) if employee[3] else ""))
-                    branch_id = employee[4] if len(employee) > 4 else None
-                    branch_name = "Не указан"
-                    if branch_id:
-                        branches = self.db.get_all_branches()
-                        for branch in branches:
-                            if branch[0] == branch_id:
-                                branch_name = branch[1]
-                                break
-                    self.employee_table.setItem(row, 4, QTableWidgetItem(branch_name))
+                    self.employee_table.setItem(row, 4, QTableWidgetItem(employee[5]))
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка загрузки сотрудников: {str(e)}")
 
     def get_selected_employee_id(self):
         selected = self.employee_table.currentRow()
-        if selected >= 0:
-            employees = self.db.get_all_employees()
-            if employees and selected < len(employees):
-                return employees[selected][0]
+        if 0 <= selected < len(self.employees):
+            return self.employees[selected][0]
         return None
 
     def add_employee(self):
@@ -726,23 +3826,19 @@ class EmployeeManagementDialog(QDialog):
                 QMessageBox.warning(self, "Ошибка", f"Ошибка удаления: {str(e)}")
 
     def load_employee_data(self):
-        employee_id = self.get_selected_employee_id()
-        if employee_id:
-            employees = self.db.get_all_employees()
-            if employees:
-                for emp in employees:
-                    if emp[0] == employee_id:
-                        self.name_input.setText(emp[1] if emp[1] else "")
-                        self.position_input.setCurrentText(emp[2] if emp[2] else "Кассир")
-                        self.phone_input.setText(emp[3] if emp[3] else "")
-                        branch_id = emp[4] if len(emp) > 4 else None
-                        if branch_id:
-                            branch_index = self.employee_branch_combo.findData(branch_id)
-                            if branch_index >= 0:
-                                self.employee_branch_combo.setCurrentIndex(branch_index)
-                        else:
-                            self.employee_branch_combo.setCurrentIndex(0)
-                        break
+        selected = self.employee_table.currentRow()
+        if 0 <= selected < len(self.employees):
+            emp = self.employees[selected]
+            self.name_input.setText(emp[1] if emp[1] else "")
+            self.position_input.setCurrentText(emp[2] if emp[2] else "Кассир")
+            self.phone_input.setText(emp[3] if emp[3] else "")
+            branch_id = emp[4]
+            if branch_id:
+                branch_index = self.employee_branch_combo.findData(branch_id)
+                if branch_index >= 0:
+                    self.employee_branch_combo.setCurrentIndex(branch_index)
+            else:
+                self.employee_branch_combo.setCurrentIndex(0)
 
     def clear_form(self):
         self.name_input.clear()
@@ -1072,6 +4168,30 @@ class NavigationMenu(QWidget):
         self.progress_chart_btn.clicked.connect(self.show_progress_chart)
         menu_layout.addWidget(self.progress_chart_btn)
 
+        self.dashboard_btn = QPushButton("Сравнение филиалов")
+        self.dashboard_btn.setStyleSheet("""
+            QPushButton { background: white; color: #495057; border: 1px solid #dee2e6; padding: 8px 12px; border-radius: 3px; text-align: left; }
+            QPushButton:hover { background: #e9ecef; }
+        """)
+        self.dashboard_btn.clicked.connect(self.show_branch_dashboard)
+        menu_layout.addWidget(self.dashboard_btn)
+
+        self.slice_btn = QPushButton("Срезы продаж")
+        self.slice_btn.setStyleSheet("""
+            QPushButton { background: white; color: #495057; border: 1px solid #dee2e6; padding: 8px 12px; border-radius: 3px; text-align: left; }
+            QPushButton:hover { background: #e9ecef; }
+        """)
+        self.slice_btn.clicked.connect(self.show_sales_slice)
+        menu_layout.addWidget(self.slice_btn)
+
+        self.leaderboard_btn = QPushButton("Рейтинг сотрудников")
+        self.leaderboard_btn.setStyleSheet("""
+            QPushButton { background: white; color: #495057; border: 1px solid #dee2e6; padding: 8px 12px; border-radius: 3px; text-align: left; }
+            QPushButton:hover { background: #e9ecef; }
+        """)
+        self.leaderboard_btn.clicked.connect(self.show_employee_leaderboard)
+        menu_layout.addWidget(self.leaderboard_btn)
+
         self.exit_btn = QPushButton("Выход")
         self.exit_btn.setStyleSheet("""
             QPushButton { background: #dc3545; color: white; border: none; padding: 8px 12px; border-radius: 3px; text-align: left; }
@@ -1110,6 +4230,21 @@ class NavigationMenu(QWidget):
         if self.parent:
             self.parent.open_progress_chart()
 
+    def show_branch_dashboard(self):
+        self.menu_dialog.close()
+        if self.parent:
+            self.parent.open_branch_dashboard()
+
+    def show_sales_slice(self):
+        self.menu_dialog.close()
+        if self.parent:
+            self.parent.open_sales_slice()
+
+    def show_employee_leaderboard(self):
+        self.menu_dialog.close()
+        if self.parent:
+            self.parent.open_employee_leaderboard()
+
     def go_previous(self):
         reply = QMessageBox.question(self, "Подтверждение выхода", "Вы точно хотите выйти из аккаунта?",
                                      QMessageBox.Yes | QMessageBox.No)
@@ -1138,7 +4273,10 @@ class SalesAnalysisWindow(QMainWindow):
         self.user_data = user_data
         self.user_role = user_data.get('role', 'employee')
         self.is_closing_via_exit = False
-        self.current_sales_data = []  # Для хранения текущих данных
+        self.snapshot = SalesSnapshot.instance(self.db.db_name)  # общий снимок продаж для таблицы, поиска и экспорта
+        self.displayed_sale_ids = []  # id продаж в строках таблицы
+        self.anomaly_days = set()  # (дата, филиал) с отклонениями выручки
+        self.shown_version = None  # версия снимка, показанная в таблице
 
         role_text = "Администратор" if self.user_role == 'admin' else "Сотрудник"
         self.setWindowTitle(f"Система анализа и учета продаж - {user_data['full_name']} ({role_text})")
@@ -1148,8 +4286,39 @@ class SalesAnalysisWindow(QMainWindow):
 
         central_widget = GradientWidget()
         self.setCentralWidget(central_widget)
+        AnomalyDetector.install(self.db.db_name)
+        # Очередь записи продаж со своим локальным журналом у каждого пользователя; продажи из журнала,
+        # не попавшие в базу при прошлом запуске, записываются сразу
+        self.pending_queue = None
+        self.confirm_seq = None  # продажа обычного ввода, об итоге записи которой сообщается
+        if self.user_role == 'employee':
+            self.pending_queue = PendingSalesQueue(self.db, user_data['id'])
+            self.pending_queue.flushed.connect(self.on_pending_flushed)
+            self.pending_queue.flush_failed.connect(self.on_pending_flush_failed)
+            if self.pending_queue.damaged_journal is not None:
+                QMessageBox.warning(self, "Журнал продаж повреждён",
+                                    f"Журнал несохранённых продаж прочитан не полностью и сохранён в файле\n"
+                                    f"{self.pending_queue.damaged_journal}\n"
+                                    f"Прочитанные продажи ({len(self.pending_queue.entries)}) записываются в базу; "
+                                    f"проверьте по этому файлу, не потерялись ли и не повторились ли продажи")
         self.init_ui()
         self.load_sales_data()
+        DataChangeBus.instance(self.db.db_name).changed.connect(self.on_data_changed)
+
+    def on_data_changed(self, events):
+        """Изменения из шины: продажи догружаются в снимок из журнала, справочники перечитываются,
+        таблица перерисовывается, только если показанные данные устарели"""
+        tables = {table for table, row_id, op in events}
+        names_changed = bool(tables & {'employees', 'branches', 'users'})
+        if 'sales' in tables:
+            self.snapshot.catch_up()
+        if names_changed:
+            self.snapshot.reload_names()
+            self.load_employees_combo()
+            self.load_branches_combo()
+        if names_changed or self.snapshot.version != self.shown_version:
+            self.load_anomalies()
+            self.filter_sales_data()
 
     def init_ui(self):
         self.navigation_menu = NavigationMenu(self, self.user_role)
@@ -1249,27 +4418,38 @@ class SalesAnalysisWindow(QMainWindow):
                 )
                 return
 
-            if not self.current_sales_data:
+            if not len(self.snapshot):
                 QMessageBox.warning(self, "Ошибка", "Нет данных для экспорта")
                 return
 
             # создаем DataFrame из данных
             df_data = []
-            for sale in self.current_sales_data:
+            for sale in self.snapshot.records(self.snapshot.order()):
                 df_data.append({
                     'ID': sale[0],
                     'Дата': sale[1],
-                    'Выручка (руб)': f"{float(sale[2]):,.2f}",
-                    'Количество транзакций': int(sale[3]),
-                    'Средний чек (руб)': f"{float(sale[4]) if sale[4] else 0:.2f}",
+                    'Выручка (руб)': f"{sale[2]:,.2f}",
+                    'Количество транзакций': sale[3],
+                    'Средний чек (руб)': f"{sale[4]:.2f}",
                     'Сотрудник': sale[5] if sale[5] else "Не указан",
                     'Филиал': sale[6] if sale[6] else "Не указан",
                     'Примечания': sale[7] if sale[7] else "",
-                    'Пользователь': sale[8] if len(sale) > 8 else "Не указан"
+                    'Пользователь': sale[8]
                 })
 
             df = pd.DataFrame(df_data)
 
+            # сводка по дням и филиалам берется из готовых дневных итогов
+            summary = self.db.get_daily_branch_summary() or []
+            summary_df = pd.DataFrame([{
+                'Дата': row[0],
+                'Филиал': row[1],
+                'Выручка (руб)': f"{float(row[2]):,.2f}",
+                'Количество транзакций': int(row[3]),
+                'Средний чек (руб)': f"{row[4]:.2f}",
+                'Записей': int(row[5])
+            } for row in summary])
+
             # создаем имя файла с текущей датой
             current_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
             filename = f"отчет_продаж_{current_date}.xlsx"
@@ -1278,6 +4458,7 @@ class SalesAnalysisWindow(QMainWindow):
             try:
                 with pd.ExcelWriter(filename, engine='openpyxl') as writer:
                     df.to_excel(writer, sheet_name='Отчет продаж', index=False)
+                    summary_df.to_excel(writer, sheet_name='Итоги по дням', index=False)
 
                     # Получаем workbook и worksheet для форматирования
                     workbook = writer.book
@@ -1299,11 +4480,16 @@ class SalesAnalysisWindow(QMainWindow):
                     for col, width in column_widths.items():
                         worksheet.column_dimensions[col].width = width
 
+                    summary_sheet = writer.sheets['Итоги по дням']
+                    for col, width in {'A': 12, 'B': 20, 'C': 15, 'D': 10, 'E': 15, 'F': 10}.items():
+                        summary_sheet.column_dimensions[col].width = width
+
                     # делаем заголовки жирными
-                    for cell in worksheet[1]:
-                        cell.font = openpyxl.styles.Font(bold=True)
-                        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center',
-                                                                   wrap_text=True)
+                    for sheet in (worksheet, summary_sheet):
+                        for cell in sheet[1]:
+                            cell.font = openpyxl.styles.Font(bold=True)
+                            cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center',
+                                                                       wrap_text=True)
 
             except Exception as e:
                 # если произошла ошибка при форматировании, просто сохраняем без форматирования
@@ -1415,69 +4601,96 @@ class SalesAnalysisWindow(QMainWindow):
 
     def filter_sales_data(self):
         """Фильтрация данных в таблице по поисковому запросу"""
-        search_text = self.search_input.text().strip().lower()
+        search_text = self.search_input.text().strip().lower() if hasattr(self, 'search_input') else ""
 
         if not search_text:
             # Если поиск пустой, показываем все данные
-            self.display_sales_data(self.current_sales_data)
+            self.display_sales_data(self.snapshot.order())
             return
 
-        filtered_data = []
-        for sale in self.current_sales_data:
-            # Проверяем все текстовые поля на совпадение
-            if (search_text in sale[1].lower() or  # Дата
-                    search_text in sale[5].lower() or  # Сотрудник
-                    search_text in sale[6].lower() or  # Филиал
-                    (sale[7] and search_text in sale[7].lower()) or  # Примечания
-                    search_text in f"{float(sale[2]):.2f}" or  # Выручка
-                    search_text in str(int(sale[3])) or  # Количество транзакций
-                    search_text in f"{float(sale[4] if sale[4] else 0):.2f}"):  # Средний чек
-                filtered_data.append(sale)
-
-        self.display_sales_data(filtered_data)
+        # Поиск по дате, сотруднику, филиалу, примечаниям и суммам выполняется по столбцам снимка
+        self.display_sales_data(self.snapshot.search(search_text))
 
     def clear_search(self):
         """Очистка поиска и отображение всех данных"""
         self.search_input.clear()
-        self.display_sales_data(self.current_sales_data)
+        self.display_sales_data(self.snapshot.order())
 
     def load_sales_data(self):
         """Загрузка данных о продажах из базы данных"""
         try:
-            sales = self.db.get_all_sales()
-            if sales is not None:
-                self.current_sales_data = sales  # Сохраняем полные данные
-                self.display_sales_data(sales)
+            self.load_anomalies()
+            # Сами продажи в снимке уже актуальны, перечитываются только имена сотрудников и филиалов
+            self.snapshot.reload_names()
+            self.filter_sales_data()
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка загрузки данных: {str(e)}")
 
-    def display_sales_data(self, sales_data):
-        """Отображение данных в таблице"""
+    def load_anomalies(self):
+        """Дни с отклонениями выручки или среднего чека: список в панели администратора и подсветка в таблице"""
+        anomalies = self.db.get_revenue_anomalies() or []
+        self.anomaly_days = {(day, branch_name) for day, branch_name, *_ in anomalies}
+        if not hasattr(self, 'anomalies_label'):
+            return
+        lines = []
+        for day, branch_name, metric, value, expected, score in anomalies[:8]:
+            metric_name = "выручка" if metric == 'revenue' else "средний чек"
+            direction = "выше" if score > 0 else "ниже"
+            lines.append(f"{day}, {branch_name}: {metric_name} {value:,.0f} ₽ {direction} нормы ~{expected:,.0f} ₽")
+        self.anomalies_label.setText("\n".join(lines) if lines else "Отклонений не обнаружено")
+
+    def display_sales_data(self, positions):
+        """Отображение в таблице продаж снимка с позициями positions"""
         try:
-            self.sales_table.setRowCount(len(sales_data))
-            for row, sale in enumerate(sales_data):
+            self.shown_version = self.snapshot.version
+            self.displayed_sale_ids = self.snapshot.sale_ids(positions)
+            self.sales_table.setRowCount(len(positions))
+            for row, sale in enumerate(self.snapshot.records(positions)):
                 self.sales_table.setItem(row, 0, QTableWidgetItem(str(row + 1)))
                 self.sales_table.setItem(row, 1, QTableWidgetItem(sale[1]))  # Дата
-                self.sales_table.setItem(row, 2, QTableWidgetItem(f"{float(sale[2]):.2f} ₽"))  # Выручка
-                self.sales_table.setItem(row, 3, QTableWidgetItem(str(int(sale[3]))))  # Транзакции
+                self.sales_table.setItem(row, 2, QTableWidgetItem(f"{sale[2]:.2f} ₽"))  # Выручка
+                self.sales_table.setItem(row, 3, QTableWidgetItem(str(sale[3])))  # Транзакции
                 self.sales_table.setItem(row, 4, QTableWidgetItem(sale[5] if sale[5] else "Не указан"))  # Сотрудник
                 self.sales_table.setItem(row, 5, QTableWidgetItem(sale[6] if sale[6] else "Не указан"))  # Филиал
 
                 # Средний чек
-                avg_check = sale[4] if sale[4] else 0
-                self.sales_table.setItem(row, 6, QTableWidgetItem(f"{float(avg_check):.2f} ₽"))
+                self.sales_table.setItem(row, 6, QTableWidgetItem(f"{sale[4]:.2f} ₽"))
 
                 # Примечания
                 self.sales_table.setItem(row, 7, QTableWidgetItem(sale[7] if sale[7] else ""))
 
-                # Делаем все ячейки нередактируемыми
+                # Делаем все ячейки нередактируемыми, продажи дней с отклонениями подсвечиваем
+                flagged = (sale[1], sale[6] if sale[6] else "Не указан") in self.anomaly_days
                 for col in range(self.sales_table.columnCount()):
                     item = self.sales_table.item(row, col)
                     if item:
                         item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+                        if flagged:
+                            item.setBackground(QColor("#f8d7da"))
+            if self.pending_queue is not None:
+                for sale in self.pending_queue.sales():
+                    self.insert_pending_row(sale)
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка отображения данных: {str(e)}")
 
+    def insert_pending_row(self, sale):
+        """Строка ещё не записанной в базу продажи быстрого ввода вверху таблицы (серым курсивом)"""
+        date, revenue, transactions, employee_id, branch_id, notes, user_id = sale
+        average_check = revenue / transactions if transactions > 0 else 0
+        values = ["…", date, f"{revenue:.2f} ₽", str(transactions),
+                  self.snapshot.employee_names.get(employee_id, "Не указан"),
+                  self.snapshot.branch_names.get(branch_id, "Не указан"), f"{average_check:.2f} ₽", notes or ""]
+        self.sales_table.insertRow(0)
+        self.displayed_sale_ids.insert(0, None)
+        for col, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            item.setForeground(QColor("#868e96"))
+            font = item.font()
+            font.setItalic(True)
+            item.setFont(font)
+            self.sales_table.setItem(0, col, item)
+
     def create_input_panel(self):
         panel = QWidget()
         panel.setStyleSheet(
@@ -1552,6 +4765,15 @@ class SalesAnalysisWindow(QMainWindow):
         """)
         self.clear_button.clicked.connect(self.clear_form)
 
+        # Быстрый ввод: без окна подтверждения, запись в базу пачками через очередь
+        self.rapid_entry_check = QCheckBox("Быстрый ввод")
+        self.rapid_entry_check.toggled.connect(self.on_rapid_entry_toggled)
+        self.pending_label = QLabel()
+        self.pending_label.setStyleSheet("color: #6c757d; border: none; padding: 0;")
+        self.update_pending_label()
+
+        button_layout.addWidget(self.rapid_entry_check)
+        button_layout.addWidget(self.pending_label)
         button_layout.addWidget(self.add_button)
         button_layout.addWidget(self.update_button)
         button_layout.addWidget(self.delete_button)
@@ -1589,7 +4811,7 @@ class SalesAnalysisWindow(QMainWindow):
 
         stats_group = QGroupBox("Статистика")
         stats_layout = QVBoxLayout()
-        sales_count = len(self.db.get_all_sales() or [])
+        sales_count = len(self.snapshot)
         employees_count = len(self.db.get_all_employees() or [])
         branches_count = len(self.db.get_all_branches() or [])
         stats_layout.addWidget(QLabel(f"Всего продаж: {sales_count}"))
@@ -1597,6 +4819,15 @@ class SalesAnalysisWindow(QMainWindow):
         stats_layout.addWidget(QLabel(f"Филиалов: {branches_count}"))
         stats_group.setLayout(stats_layout)
         layout.addWidget(stats_group)
+
+        anomalies_group = QGroupBox("Отклонения выручки")
+        anomalies_layout = QVBoxLayout()
+        self.anomalies_label = QLabel()
+        self.anomalies_label.setStyleSheet("color: #495057; font-size: 12px;")
+        self.anomalies_label.setWordWrap(True)
+        anomalies_layout.addWidget(self.anomalies_label)
+        anomalies_group.setLayout(anomalies_layout)
+        layout.addWidget(anomalies_group)
         layout.addStretch()
         panel.setLayout(layout)
         return panel
@@ -1606,6 +4837,7 @@ class SalesAnalysisWindow(QMainWindow):
             employees = self.db.get_all_employees()
             if not hasattr(self, 'employee_combo') or self.employee_combo is None:
                 return
+            selected_id = self.employee_combo.currentData()  # выбор сохраняется при перезагрузке списка
             self.employee_combo.clear()
             self.employee_combo.addItem("Не указан", 0)
             if employees:
@@ -1613,6 +4845,7 @@ class SalesAnalysisWindow(QMainWindow):
                     employee_id = employee[0]
                     employee_name = employee[1]
                     self.employee_combo.addItem(employee_name, employee_id)
+            self.employee_combo.setCurrentIndex(max(self.employee_combo.findData(selected_id), 0))
         except Exception as e:
             print(f"Ошибка загрузки сотрудников: {e}")
 
@@ -1621,6 +4854,7 @@ class SalesAnalysisWindow(QMainWindow):
             branches = self.db.get_all_branches()
             if not hasattr(self, 'branch_combo') or self.branch_combo is None:
                 return
+            selected_id = self.branch_combo.currentData()
             self.branch_combo.clear()
             self.branch_combo.addItem("Не указан", 0)
             if branches:
@@ -1628,6 +4862,7 @@ class SalesAnalysisWindow(QMainWindow):
                     branch_id = branch[0]
                     branch_name = branch[1]
                     self.branch_combo.addItem(branch_name, branch_id)
+            self.branch_combo.setCurrentIndex(max(self.branch_combo.findData(selected_id), 0))
         except Exception as e:
             print(f"Ошибка загрузки филиалов: {e}")
 
@@ -1647,11 +4882,32 @@ class SalesAnalysisWindow(QMainWindow):
         if revenue <= 0:
             QMessageBox.warning(self, "Ошибка", "Введите корректную выручку")
             return
+        if self.date_input.date().year() in (self.db.get_archived_years() or ()):
+            # Такую продажу база отклонит, а в очереди записи она задержала бы все следующие
+            QMessageBox.warning(self, "Ошибка", "Продажи за этот год перенесены в архив, добавить продажу нельзя")
+            return
+
+        # Продажа сначала сохраняется в локальном журнале очереди; в обычном режиме очередь тут же
+        # записывается в базу, при быстром вводе - пачкой. Если база недоступна, продажа ждёт в очереди
+        sale = (date, revenue, transactions, employee_id, branch_id, notes, user_id)
+        seq = self.pending_queue.append(sale)
+        if seq is not None:
+            # Ожидающая продажа показывается вверху таблицы, пока очередь не запишется (сигнал flushed)
+            self.insert_pending_row(sale)
+            if self.rapid_entry_check.isChecked():
+                self.update_pending_label()
+                self.clear_for_next_entry()
+                return
+            # Запись идёт в фоне; об итоге сообщают on_pending_flushed и on_pending_flush_failed
+            self.confirm_seq = seq
+            self.pending_queue.flush()
+            self.update_pending_label()
+            self.clear_form()
+            return
+        # Журнал недоступен - продажа записывается в базу напрямую
 
-        average_check = revenue / transactions if transactions > 0 else 0
         try:
-            result = self.db.add_sale(date, revenue, transactions, average_check, employee_id, branch_id, notes,
-                                      user_id)
+            result = self.db.add_sale(date, revenue, transactions, employee_id, branch_id, notes, user_id)
             if result is not None:
                 self.load_sales_data()
                 self.clear_form()
@@ -1659,6 +4915,44 @@ class SalesAnalysisWindow(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка добавления: {str(e)}")
 
+    def clear_for_next_entry(self):
+        """Подготовка формы к следующему чеку: дата, сотрудник и филиал остаются прежними"""
+        self.revenue_input.setValue(0)
+        self.transactions_input.setValue(0)
+        self.notes_input.clear()
+        self.revenue_input.setFocus()
+        self.revenue_input.selectAll()
+
+    def on_rapid_entry_toggled(self, checked):
+        if not checked:
+            self.pending_queue.flush()
+
+    def on_pending_flushed(self, count):
+        self.update_pending_label()
+        self.load_anomalies()
+        self.filter_sales_data()
+        if self.confirm_seq is not None and self.pending_queue.is_written(self.confirm_seq):
+            self.confirm_seq = None
+            QMessageBox.information(self, "Успех", "Запись добавлена")
+
+    def on_pending_flush_failed(self):
+        self.update_pending_label()
+        if self.confirm_seq is not None:
+            self.confirm_seq = None
+            QMessageBox.warning(self, "База недоступна", "Запись сохранена на этом компьютере и будет "
+                                                         "добавлена в базу автоматически")
+
+    def update_pending_label(self):
+        queue = self.pending_queue
+        count = len(queue.entries) if queue is not None else 0
+        if not count:
+            self.pending_label.setText("")
+        elif queue.available:
+            self.pending_label.setText(f"Ожидают записи: {count}")
+        else:
+            self.pending_label.setText(f"Ожидают записи: {count} (база недоступна, повтор через "
+                                       f"{queue.FLUSH_INTERVAL_MS // 1000} с)")
+
     def update_sale_record(self):
         if self.user_role != 'employee':
             QMessageBox.warning(self, "Ошибка", "Только сотрудники могут редактировать записи о продажах")
@@ -1675,15 +4969,17 @@ class SalesAnalysisWindow(QMainWindow):
         employee_id = self.employee_combo.currentData()
         branch_id = self.branch_combo.currentData()
         notes = self.notes_input.text()
-        average_check = revenue / transactions if transactions > 0 else 0
         user_id = self.user_data['id']  # Получаем ID текущего пользователя
 
         try:
-            result = self.db.update_sale(sale_id, date, revenue, transactions, average_check, employee_id, branch_id,
-                                         notes, user_id)
+            result = self.db.update_sale(sale_id, date, revenue, transactions, employee_id, branch_id, notes,
+                                         user_id)
             if result is not None:
                 self.load_sales_data()
                 QMessageBox.information(self, "Успех", "Запись обновлена")
+            else:
+                QMessageBox.warning(self, "Ошибка", "Не удалось обновить запись (продажи за годы, перенесённые "
+                                                    "в архив, не изменяются)")
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка обновления: {str(e)}")
 
@@ -1706,15 +5002,16 @@ class SalesAnalysisWindow(QMainWindow):
                     self.load_sales_data()
                     self.clear_form()
                     QMessageBox.information(self, "Успех", "Запись удалена")
+                else:
+                    QMessageBox.warning(self, "Ошибка", "Не удалось удалить запись (продажи за годы, перенесённые "
+                                                        "в архив, не изменяются)")
             except Exception as e:
                 QMessageBox.warning(self, "Ошибка", f"Ошибка удаления: {str(e)}")
 
     def get_selected_sale_id(self):
         selected = self.sales_table.currentRow()
-        if selected >= 0:
-            sales = self.db.get_all_sales()
-            if sales and selected < len(sales):
-                return sales[selected][0]
+        if 0 <= selected < len(self.displayed_sale_ids):
+            return self.displayed_sale_ids[selected]
         return None
 
     def load_selected_row(self):
@@ -1723,14 +5020,14 @@ class SalesAnalysisWindow(QMainWindow):
 
         sale_id = self.get_selected_sale_id()
         if sale_id:
-            sales = self.db.get_all_sales()
+            sales = self.snapshot.records(self.snapshot.find(sale_id))
             if sales:
                 for sale in sales:
                     if sale[0] == sale_id:
                         date = QDate.fromString(sale[1], "yyyy-MM-dd")
                         self.date_input.setDate(date)
-                        self.revenue_input.setValue(float(sale[2]))
-                        self.transactions_input.setValue(int(sale[3]))
+                        self.revenue_input.setValue(sale[2])
+                        self.transactions_input.setValue(sale[3])
                         employee_name = sale[5] if sale[5] else ""
                         if self.employee_combo is not None:
                             index = self.employee_combo.findText(employee_name)
@@ -1771,6 +5068,18 @@ class SalesAnalysisWindow(QMainWindow):
         dialog = SalesPlansDialog(self)
         dialog.exec()
 
+    def open_branch_dashboard(self):
+        dialog = BranchDashboardDialog(self)
+        dialog.exec()
+
+    def open_sales_slice(self):
+        dialog = SalesSliceDialog(self)
+        dialog.exec()
+
+    def open_employee_leaderboard(self):
+        dialog = EmployeeLeaderboardDialog(self)
+        dialog.exec()
+
     def open_progress_chart(self):
         # Закрываем основное окно перед открытием графика
         self.hide()
@@ -1778,6 +5087,7 @@ class SalesAnalysisWindow(QMainWindow):
         self.progress_window.show()
 
     def exit_to_login(self):
+        self.close_pending_queue()
         self.is_closing_via_exit = True
         self.close()
         self.login_window = LoginWindow()
@@ -1788,6 +5098,7 @@ class SalesAnalysisWindow(QMainWindow):
             reply = QMessageBox.question(self, "Подтверждение выхода", "Вы уверены, что хотите выйти из системы?",
                                          QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.Yes:
+                self.close_pending_queue()
                 self.is_closing_via_exit = True
                 event.accept()
                 login_window = LoginWindow()
@@ -1797,18 +5108,44 @@ class SalesAnalysisWindow(QMainWindow):
         else:
             event.accept()
 
+    def close_pending_queue(self):
+        if self.pending_queue is not None:
+            self.pending_queue.close()
+
 
 class ProgressChartWindow(QMainWindow):
+    MONTH_NAMES = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь",
+                   "Ноябрь", "Декабрь"]
+    QUARTER_NAMES = ["I квартал", "II квартал", "III квартал", "IV квартал"]
+
     def __init__(self, user_data, parent_window=None):
         super().__init__()
         self.user_data = user_data
         self.db = DatabaseManager()
         self.parent_window = parent_window
         self.selected_branch_id = None  # Добавляем переменную для хранения выбранного филиала
+        now = datetime.now()
+        self.selected_period = ('month', now.year, now.month)  # (тип периода, год, номер месяца/квартала)
+        # Подготовка данных графика идёт в отдельном потоке, одновременно выполняется не более одного запроса
+        self.chart_pool = QThreadPool()
+        self.chart_pool.setMaxThreadCount(1)
+        self.chart_task = None
+        self.chart_request_id = 0
         self.setWindowTitle("График прогресса выполнения плана")
         self.resize(1250, 750)
         self.init_ui()
         self.load_data()
+        DataChangeBus.instance(self.db.db_name).changed.connect(self.on_data_changed)
+
+    def on_data_changed(self, events):
+        """Изменения из шины: список филиалов и график обновляются, если затронуты их данные"""
+        if not self.isVisible():
+            return
+        tables = {table for table, row_id, op in events}
+        if 'branches' in tables:
+            self.load_branches_combo()
+        if tables & {'sales', 'sales_plans', 'branches'}:
+            self.load_data()
 
     def init_ui(self):
         central_widget = QWidget()
@@ -1832,8 +5169,30 @@ class ProgressChartWindow(QMainWindow):
         self.load_branches_combo()
         self.branch_combo.currentIndexChanged.connect(self.on_branch_changed)
 
+        # Выбор периода: месяц, квартал или год
+        period_label = QLabel("Период:")
+        period_label.setStyleSheet("font-weight: bold; color: #495057;")
+        self.period_type_combo = QComboBox()
+        self.period_type_combo.addItem("Месяц", "month")
+        self.period_type_combo.addItem("Квартал", "quarter")
+        self.period_type_combo.addItem("Год", "year")
+        self.period_year_input = QSpinBox()
+        self.period_year_input.setRange(2020, 2100)
+        self.period_year_input.setValue(self.selected_period[1])
+        self.period_index_combo = QComboBox()
+        self.period_index_combo.setMinimumWidth(150)
+        self.fill_period_index_combo()
+        self.period_type_combo.currentIndexChanged.connect(self.on_period_type_changed)
+        self.period_year_input.valueChanged.connect(self.on_period_changed)
+        self.period_index_combo.currentIndexChanged.connect(self.on_period_changed)
+
         branch_layout.addWidget(branch_label)
         branch_layout.addWidget(self.branch_combo)
+        branch_layout.addSpacing(20)
+        branch_layout.addWidget(period_label)
+        branch_layout.addWidget(self.period_type_combo)
+        branch_layout.addWidget(self.period_index_combo)
+        branch_layout.addWidget(self.period_year_input)
         branch_layout.addStretch()
         layout.addLayout(branch_layout)
 
@@ -1860,6 +5219,7 @@ class ProgressChartWindow(QMainWindow):
         self.figure = Figure(figsize=(14, 10), dpi=100)
         self.canvas = FigureCanvas(self.figure)
         layout.addWidget(self.canvas)
+        self.init_chart()
 
         stats_group = QGroupBox("Статистика выполнения плана")
         stats_layout = QHBoxLayout()
@@ -1895,6 +5255,8 @@ class ProgressChartWindow(QMainWindow):
         """Загрузка списка филиалов в комбобокс"""
         try:
             branches = self.db.get_all_branches()
+            # При перезагрузке выбор сохраняется, а график не перестраивается на каждый добавленный пункт
+            self.branch_combo.blockSignals(True)
             self.branch_combo.clear()
             self.branch_combo.addItem("Все филиалы", 0)  # Добавляем опцию "Все филиалы"
             if branches:
@@ -1902,6 +5264,9 @@ class ProgressChartWindow(QMainWindow):
                     branch_id = branch[0]
                     branch_name = branch[1]
                     self.branch_combo.addItem(branch_name, branch_id)
+            self.branch_combo.setCurrentIndex(max(self.branch_combo.findData(self.selected_branch_id or 0), 0))
+            self.selected_branch_id = self.branch_combo.currentData()
+            self.branch_combo.blockSignals(False)
         except Exception as e:
             print(f"Ошибка загрузки филиалов: {e}")
 
@@ -1910,6 +5275,46 @@ class ProgressChartWindow(QMainWindow):
         self.selected_branch_id = self.branch_combo.currentData()
         self.load_data()
 
+    def fill_period_index_combo(self):
+        """Заполнение списка месяцев/кварталов под выбранный тип периода"""
+        kind = self.period_type_combo.currentData()
+        now = datetime.now()
+        self.period_index_combo.blockSignals(True)
+        self.period_index_combo.clear()
+        if kind == 'month':
+            self.period_index_combo.addItems(self.MONTH_NAMES)
+            self.period_index_combo.setCurrentIndex(now.month - 1)
+        elif kind == 'quarter':
+            self.period_index_combo.addItems(self.QUARTER_NAMES)
+            self.period_index_combo.setCurrentIndex((now.month - 1) // 3)
+        self.period_index_combo.setVisible(kind != 'year')
+        self.period_index_combo.blockSignals(False)
+
+    def on_period_type_changed(self):
+        self.fill_period_index_combo()
+        self.on_period_changed()
+
+    def on_period_changed(self):
+        """Обработчик изменения выбранного периода"""
+        kind = self.period_type_combo.currentData()
+        index = self.period_index_combo.currentIndex() + 1 if kind != 'year' else 1
+        self.selected_period = (kind, self.period_year_input.value(), index)
+        self.load_data()
+
+    @staticmethod
+    def get_period_bounds(period):
+        """Первый и последний день периода (kind, year, index)"""
+        kind, year, index = period
+        if kind == 'month':
+            first_month, last_month = index, index
+        elif kind == 'quarter':
+            first_month, last_month = index * 3 - 2, index * 3
+        else:
+            first_month, last_month = 1, 12
+        start = datetime(year, first_month, 1).date()
+        next_month = datetime(year + 1, 1, 1) if last_month == 12 else datetime(year, last_month + 1, 1)
+        return start, (next_month - timedelta(days=1)).date()
+
     def go_back_to_main(self):
         """Возврат в главное окно - закрываем текущее и показываем родительское"""
         self.close()
@@ -1918,241 +5323,687 @@ class ProgressChartWindow(QMainWindow):
 
     def closeEvent(self, event):
         """При закрытии окна графиков показываем родительское окно"""
+        if self.chart_task is not None:
+            self.chart_task.cancel()
         if self.parent_window:
             self.parent_window.show()
         event.accept()
 
     def load_data(self):
-        try:
-            # Получаем данные о продажах с фильтрацией по филиалу
-            if self.selected_branch_id and self.selected_branch_id != 0:
-                # Если выбран конкретный филиал, фильтруем данные
-                all_sales = self.db.get_all_sales()
-                if all_sales:
-                    filtered_sales = []
-                    for sale in all_sales:
-                        # sale[6] содержит название филиала, нам нужно найти ID филиала
-                        branch_name = sale[6]
-                        branches = self.db.get_all_branches()
-                        for branch in branches:
-                            if branch[1] == branch_name:
-                                if branch[0] == self.selected_branch_id:
-                                    filtered_sales.append(sale)
-                                break
-                    sales_data = filtered_sales
-                else:
-                    sales_data = []
-            else:
-                # Если выбран "Все филиалы" или филиал не выбран, используем все данные
-                sales_data = self.db.get_all_sales()
+        """Запуск подготовки данных графика в фоновом потоке, предыдущий запрос отменяется"""
+        if self.chart_task is not None:
+            self.chart_task.cancel()
+        self.chart_request_id += 1
+        self.chart_task = BackgroundTask(self.chart_request_id, self.prepare_chart_data, self.selected_branch_id,
+                                         self.selected_period, self.branch_combo.currentText())
+        self.chart_task.signals.finished.connect(self.on_chart_data_ready)
+        self.chart_task.signals.error.connect(self.on_chart_data_failed)
+        self.chart_pool.start(self.chart_task)
+
+    def prepare_chart_data(self, branch_id, period, branch_name, cancel_event):
+        """Запрос кеша итогов, построение рядов и расчёт статистики (вне GUI-потока, виджеты не трогает)"""
+        kind, year, index = period
+        start, end = self.get_period_bounds(period)
+        today = datetime.now().date()
+
+        # Точки графика: дни для месяца и квартала, месяцы для года
+        if kind == 'year':
+            rows = self.db.get_monthly_totals(branch_id, year)
+            if rows is None:
+                raise RuntimeError("не удалось получить месячные итоги")
+            bucket_starts = [datetime(year, month, 1).date() for month in range(1, 13)]
+            revenue_by_position = {month: revenue for month, revenue, _ in rows}
+        else:
+            rows = self.db.get_daily_totals(branch_id, start.isoformat(), end.isoformat())
+            if rows is None:
+                raise RuntimeError("не удалось получить дневные итоги")
+            bucket_starts = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+            revenue_by_position = {(datetime.strptime(date, '%Y-%m-%d').date() - start).days + 1: revenue
+                                   for date, revenue, _ in rows}
+        if cancel_event.is_set():
+            raise TaskCancelled()
+
+        month_plans = {}
+        for bucket_start in bucket_starts:
+            key = (bucket_start.year, bucket_start.month)
+            if key not in month_plans:
+                month_plans[key] = self.get_month_plan(branch_id, *key)
+        total_plan = sum(monthly for daily, monthly in month_plans.values())
+
+        if not rows and total_plan == 0:
+            return None
+        if total_plan == 0:
+            return {'message': 'Нет данных для построения графика', 'stats': None}
+        if start > today:
+            return {'message': 'Нет данных за выбранный период', 'stats': None}
+
+        positions = list(range(1, len(bucket_starts) + 1))
+        if kind == 'year':
+            plan_values = [month_plans[(year, month)][1] for month in positions]
+            plan_label = 'Месячный план'
+        else:
+            plan_values = [month_plans[(day.year, day.month)][0] for day in bucket_starts]
+            plan_label = f'Ежедневный план: {plan_values[0]:,.0f} ₽' if kind == 'month' else 'Ежедневный план'
+
+        actual_positions = [position for position, bucket_start in zip(positions, bucket_starts)
+                            if bucket_start <= today]
+        actual_values = [revenue_by_position.get(position, 0) for position in actual_positions]
+
+        today_point = None
+        if start <= today <= end:
+            today_position = today.month if kind == 'year' else (today - start).days + 1
+            today_point = (today_position, revenue_by_position.get(today_position, 0))
+
+        if kind == 'year':
+            ticks = positions
+            tick_labels = [name[:3] for name in self.MONTH_NAMES]
+            x_label = 'Месяц'
+            title = f'Помесячное выполнение плана продаж - {year}'
+        elif kind == 'quarter':
+            ticks = [position for position, day in zip(positions, bucket_starts) if day.day == 1]
+            tick_labels = [f'1 {self.MONTH_NAMES[day.month - 1][:3].lower()}' for day in bucket_starts if day.day == 1]
+            x_label = 'День квартала'
+            title = f'Ежедневное выполнение плана продаж - {self.QUARTER_NAMES[index - 1]} {year}'
+        else:
+            ticks = [1, 5, 10, 15, 20, 25, positions[-1]]
+            tick_labels = [str(tick) for tick in ticks]
+            x_label = 'День месяца'
+            title = f'Ежедневное выполнение плана продаж - {self.MONTH_NAMES[index - 1]} {year}'
+        # Обновляем заголовок с учетом выбранного филиала
+        if branch_name != "Все филиалы":
+            title += f' - {branch_name}'
 
-            # Получаем планы продаж с фильтрацией по филиалу
-            if self.selected_branch_id and self.selected_branch_id != 0:
-                plans_data = self.db.get_sales_plans(self.selected_branch_id)
-            else:
-                plans_data = self.db.get_sales_plans()
+        max_revenue = max(actual_values + plan_values) * 1.2
+        y_max = max(max_revenue, sum(plan_values) / len(plan_values) * 1.5)
 
-            if not sales_data:
-                self.show_empty_chart()
-                return
+        return {
+            'positions': positions,
+            'plan_values': plan_values,
+            'plan_label': plan_label,
+            'actual_positions': actual_positions,
+            'actual_values': actual_values,
+            'today_point': today_point,
+            'ticks': ticks,
+            'tick_labels': tick_labels,
+            'x_label': x_label,
+            'title': title,
+            'y_max': y_max,
+            'stats': self.compute_statistics(branch_id, start, end, total_plan)
+        }
 
-            df = self.create_sales_dataframe(sales_data)
-            current_plan = self.get_current_plan(plans_data)
-            self.plot_daily_progress(df, current_plan)
-            self.update_statistics(df, current_plan)
+    def on_chart_data_ready(self, request_id, result):
+        """Отрисовка в GUI-потоке; результаты устаревших запросов отбрасываются"""
+        if request_id != self.chart_request_id:
+            return
+        if result is None:
+            self.show_empty_chart()
+            return
+        try:
+            self.plot_progress(result)
+            self.update_statistics(result['stats'])
         except Exception as e:
             print(f"Ошибка загрузки данных: {e}")
             self.show_empty_chart()
 
-    def create_sales_dataframe(self, sales_data):
-        data = []
-        for sale in sales_data:
-            data.append({
-                'date': datetime.strptime(sale[1], '%Y-%m-%d'),
-                'revenue': float(sale[2]),
-                'transactions': int(sale[3]),
-                'average_check': float(sale[4]) if sale[4] else 0
-            })
-        df = pd.DataFrame(data)
-        df = df.sort_values('date')
-        daily_sales = df.groupby('date').agg({
-            'revenue': 'sum',
-            'transactions': 'sum',
-            'average_check': 'mean'
-        }).reset_index()
-        return daily_sales
-
-    def get_current_plan(self, plans_data):
-        current_date = datetime.now()
-        current_year = current_date.year
-        current_month = current_date.month
-        monthly_plan = 0
-        daily_plan = 0
-
-        if plans_data:
-            # Если выбран конкретный филиал, берем план для этого филиала
-            if self.selected_branch_id and self.selected_branch_id != 0:
-                for plan in plans_data:
-                    if plan[2] == current_year and plan[3] == current_month:
-                        monthly_plan = float(plan[5])
-                        daily_plan = float(plan[4])
-                        break
+    def on_chart_data_failed(self, request_id, message):
+        if request_id != self.chart_request_id:
+            return
+        print(f"Ошибка загрузки данных: {message}")
+        self.show_empty_chart()
+
+    def forecast_remaining(self, branch_id, today, days_remaining, avg_daily_revenue):
+        """Ожидаемая выручка за оставшиеся дни периода по дневному прогнозу SalesForecaster"""
+        SalesForecaster(self.db).ensure_fresh()
+        weekday_forecast = self.db.get_weekday_forecast(branch_id)
+        if weekday_forecast is None:
+            return avg_daily_revenue * days_remaining
+        return sum(weekday_forecast[(today + timedelta(days=offset)).weekday()]
+                   for offset in range(1, days_remaining + 1))
+
+    def get_month_plan(self, branch_id, year, month):
+        """План на месяц: (daily_plan, monthly_plan)"""
+        # Если выбран конкретный филиал, берем план для этого филиала
+        if branch_id and branch_id != 0:
+            plan = self.db.get_sales_plan(branch_id, year, month)
+            if not plan:
+                return 0.0, 0.0
+        else:
+            # Если выбраны "Все филиалы", планы всех филиалов суммируются в SQL
+            plan = self.db.get_total_sales_plan(year, month)
+        return float(plan[0]), float(plan[1])
+
+    def init_chart(self):
+        """Однократное создание осей и постоянных элементов графика"""
+        self.ax = self.figure.add_subplot(111)
+        ax = self.ax
+        ax.set_xlim(0.5, 30.5)
+        ax.set_ylim(0, 1)
+        ax.grid(True, alpha=0.3, axis='both')
+        ax.set_xlabel('День месяца', fontsize=12, fontweight='bold')
+        ax.set_ylabel('Выручка, руб.', fontsize=10, fontweight='bold')
+        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x:,.0f} ₽'))
+        ax.set_xticks([1, 5, 10, 15, 20, 25, 30])
+        ax.set_xticklabels(['1', '5', '10', '15', '20', '25', '30'])
+        self.chart_axis_key = None
+
+        # Динамические элементы (animated) не попадают в кешированный фон и дорисовываются поверх него
+        self.plan_line, = ax.plot([], [], label='Ежедневный план', color='#A23B72', linewidth=2, linestyle='--',
+                                  animated=True)
+        self.revenue_line, = ax.plot([], [], label='Фактическая выручка', color='#2E86AB', linewidth=3, marker='o',
+                                     markersize=6, animated=True)
+        self.today_marker, = ax.plot([], [], 'ro', markersize=10, label='Сегодня', animated=True)
+        self.revenue_labels = []
+        for _ in range(31):
+            label = ax.annotate('', (0, 0), textcoords="offset points", xytext=(0, 10), ha='center', fontsize=8,
+                                bbox=dict(boxstyle="round,pad=0.3", facecolor="white", alpha=0.8), animated=True)
+            label.set_visible(False)
+            self.revenue_labels.append(label)
+        self.chart_legend = ax.legend(handles=[self.plan_line, self.revenue_line, self.today_marker],
+                                      loc='upper right', fontsize=10)
+        self.chart_legend.set_animated(True)
+        self.chart_message = ax.text(0.5, 0.5, '', ha='center', va='center', transform=ax.transAxes, fontsize=14,
+                                     animated=True)
+        # Заголовок-заглушка резервирует место под заголовок при tight_layout
+        self.chart_title = ax.set_title('Заголовок', fontsize=12, fontweight='bold', pad=7)
+        self.chart_title.set_animated(True)
+        self.figure.tight_layout()
+        self.chart_title.set_text('')
+
+        self.chart_background = None
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+
+    def get_animated_artists(self):
+        return [self.plan_line, self.revenue_line, self.today_marker, *self.revenue_labels, self.chart_legend,
+                self.chart_message, self.chart_title]
+
+    def on_canvas_draw(self, event):
+        """После полной перерисовки кешируем статический фон и дорисовываем динамические элементы"""
+        self.chart_background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_animated_artists()
+
+    def draw_animated_artists(self):
+        for artist in self.get_animated_artists():
+            if artist.get_visible():
+                self.figure.draw_artist(artist)
+
+    def refresh_chart(self, y_max=None):
+        """Полная перерисовка только при смене масштаба, в остальных случаях - blitting"""
+        if y_max is not None:
+            y_max = self.round_axis_limit(y_max)
+            if self.ax.get_ylim()[1] != y_max:
+                self.ax.set_ylim(0, y_max)
+                self.chart_background = None
+
+        if self.chart_background is None:
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self.chart_background)
+        self.draw_animated_artists()
+        self.canvas.blit(self.figure.bbox)
+
+    @staticmethod
+    def round_axis_limit(value):
+        """Округление верхней границы оси вверх до 1, 2 или 5 × 10^n, чтобы масштаб менялся реже"""
+        if value <= 0:
+            return 1
+        magnitude = 10 ** math.floor(math.log10(value))
+        for step in (1, 2, 5, 10):
+            if value <= step * magnitude:
+                return step * magnitude
+        return 10 * magnitude
+
+    def set_series_visible(self, visible):
+        self.plan_line.set_visible(visible)
+        self.revenue_line.set_visible(visible)
+        self.today_marker.set_visible(visible)
+        self.chart_legend.set_visible(visible)
+        self.chart_title.set_visible(visible)
+        if not visible:
+            for label in self.revenue_labels:
+                label.set_visible(False)
+
+    def show_chart_message(self, message):
+        self.set_series_visible(False)
+        self.chart_message.set_text(message)
+        self.chart_message.set_visible(True)
+        self.refresh_chart()
+
+    def plot_progress(self, data):
+        if 'message' in data:
+            self.show_chart_message(data['message'])
+            return
+
+        ax = self.ax
+        positions = data['positions']
+        # Смена оси X (тип периода или число дней) требует полной перерисовки фона
+        axis_key = (len(positions), tuple(data['ticks']), tuple(data['tick_labels']), data['x_label'])
+        if axis_key != self.chart_axis_key:
+            self.chart_axis_key = axis_key
+            ax.set_xlim(0.5, len(positions) + 0.5)
+            ax.set_xticks(data['ticks'])
+            ax.set_xticklabels(data['tick_labels'])
+            ax.set_xlabel(data['x_label'], fontsize=12, fontweight='bold')
+            self.chart_background = None
+
+        self.plan_line.set_data(positions, data['plan_values'])
+        self.chart_legend.get_texts()[0].set_text(data['plan_label'])
+
+        actual_positions, actual_values = data['actual_positions'], data['actual_values']
+        self.revenue_line.set_data(actual_positions, actual_values)
+
+        # Подписи значений выводятся, только пока точек не больше, чем дней в месяце
+        show_labels = len(positions) <= len(self.revenue_labels)
+        for i, label in enumerate(self.revenue_labels):
+            if show_labels and i < len(actual_values) and actual_values[i] > 0:
+                label.xy = (actual_positions[i], actual_values[i])
+                label.set_text(f'{actual_values[i]:,.0f} ₽')
+                label.set_visible(True)
             else:
-                # Если выбраны "Все филиалы", суммируем планы всех филиалов
-                for plan in plans_data:
-                    if plan[2] == current_year and plan[3] == current_month:
-                        monthly_plan += float(plan[5])
-                        daily_plan += float(plan[4])
+                label.set_visible(False)
+
+        if data['today_point']:
+            self.today_marker.set_data([data['today_point'][0]], [data['today_point'][1]])
+        else:
+            self.today_marker.set_data([], [])
+
+        self.chart_title.set_text(data['title'])
+        self.chart_message.set_visible(False)
+        self.set_series_visible(True)
+        self.refresh_chart(data['y_max'])
+
+    def compute_statistics(self, branch_id, start, end, total_plan):
+        """Расчёт показателей выполнения плана за период; None, если показывать нечего"""
+        today = datetime.now().date()
+        stats_end = min(end, today)
+        revenue, transactions, sales_days, avg_check = self.db.get_period_totals(branch_id, start.isoformat(),
+                                                                                 stats_end.isoformat())
+        if not sales_days:
+            return None
+
+        plan_completion = (revenue / total_plan) * 100
+        avg_daily_revenue = revenue / sales_days
+
+        days_remaining = (end - today).days if start <= today < end else 0
+        if days_remaining > 0:
+            forecast_revenue = revenue + self.forecast_remaining(branch_id, today, days_remaining,
+                                                                 avg_daily_revenue)
+            forecast_percent = (forecast_revenue / total_plan) * 100
+        else:
+            forecast_revenue = revenue
+            forecast_percent = plan_completion
 
         return {
-            'monthly_plan': monthly_plan,
-            'daily_plan': daily_plan,
-            'days_in_month': current_date.day,
-            'total_days_in_month': (current_date.replace(month=current_month % 12 + 1, day=1) - timedelta(days=1)).day
+            'plan_completion': f"{plan_completion:.1f}%",
+            'forecast_percent': f"{forecast_percent:.1f}%",
+            'forecast_value': f"{forecast_revenue:,.0f} ₽",
+            'avg_revenue': f"{avg_daily_revenue:,.0f} ₽",
+            'avg_check': f"{avg_check:.0f} ₽",
+            'total_transactions': f"{int(transactions):,}"
         }
 
-    def plot_daily_progress(self, df, current_plan):
+    def update_statistics(self, stats):
+        for key, widget in self.stats_widgets.items():
+            widget.setText(stats[key] if stats else "0")
+
+    def show_empty_chart(self):
+        for widget in self.stats_widgets.values():
+            widget.setText("0")
+        self.show_chart_message('Нет данных для отображения\nДобавьте данные о продажах и планах')
+
+
+class BranchDashboardDialog(QDialog):
+    MAX_LABELED_BRANCHES = 40  # при большем числе филиалов подписи на графике не читаются
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.db = DatabaseManager()
+        self.setWindowTitle("Сравнение филиалов")
+        self.resize(1250, 750)
+        self.setModal(True)
+        self.init_ui()
+        self.load_data()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        period_layout = QHBoxLayout()
+        period_label = QLabel("Период:")
+        period_label.setStyleSheet("font-weight: bold; color: #495057;")
+        now = datetime.now()
+        self.month_combo = QComboBox()
+        self.month_combo.addItems(ProgressChartWindow.MONTH_NAMES)
+        self.month_combo.setCurrentIndex(now.month - 1)
+        self.year_input = QSpinBox()
+        self.year_input.setRange(2020, 2100)
+        self.year_input.setValue(now.year)
+        self.month_combo.currentIndexChanged.connect(self.load_data)
+        self.year_input.valueChanged.connect(self.load_data)
+        period_layout.addWidget(period_label)
+        period_layout.addWidget(self.month_combo)
+        period_layout.addWidget(self.year_input)
+        period_layout.addStretch()
+        layout.addLayout(period_layout)
+
+        self.figure = Figure(figsize=(12, 4), dpi=100)
+        self.figure.subplots_adjust(left=0.15, right=0.97, top=0.9, bottom=0.1)
+        self.canvas = FigureCanvas(self.figure)
+        layout.addWidget(self.canvas, 3)
+
+        self.dashboard_table = QTableWidget()
+        self.dashboard_table.setColumnCount(7)
+        self.dashboard_table.setHorizontalHeaderLabels([
+            "Филиал", "Выручка", "Месячный план", "Выполнение", "Прогноз", "Прогноз выполнения", "Средний чек"
+        ])
+        self.dashboard_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.dashboard_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.dashboard_table, 2)
+
+        self.setLayout(layout)
+
+    def load_data(self):
+        year = self.year_input.value()
+        month = self.month_combo.currentIndex() + 1
+        start, end = ProgressChartWindow.get_period_bounds(('month', year, month))
+        today = datetime.now().date()
+        rows = self.db.get_branch_dashboard(year, month, min(end, today).isoformat()) or []
+
+        days_remaining = (end - today).days if start <= today < end else 0
+        items = []
+        for branch_id, name, revenue, transactions, sales_days, daily_plan, monthly_plan, avg_check in rows:
+            forecast = revenue + revenue / sales_days * days_remaining if sales_days else revenue
+            items.append({
+                'name': name,
+                'revenue': revenue,
+                'monthly_plan': monthly_plan,
+                'completion': revenue / monthly_plan * 100 if monthly_plan else 0,
+                'forecast': forecast,
+                'forecast_percent': forecast / monthly_plan * 100 if monthly_plan else 0,
+                'avg_check': avg_check
+            })
+
+        self.display_table(items)
+        self.plot_dashboard(items, f"{ProgressChartWindow.MONTH_NAMES[month - 1]} {year}")
+
+    def display_table(self, items):
+        self.dashboard_table.setRowCount(len(items))
+        for row, item in enumerate(items):
+            values = [
+                item['name'],
+                f"{item['revenue']:,.2f} ₽",
+                f"{item['monthly_plan']:,.2f} ₽",
+                f"{item['completion']:.1f}%",
+                f"{item['forecast']:,.0f} ₽",
+                f"{item['forecast_percent']:.1f}%",
+                f"{item['avg_check']:.2f} ₽"
+            ]
+            for col, value in enumerate(values):
+                self.dashboard_table.setItem(row, col, QTableWidgetItem(value))
+
+    def plot_dashboard(self, items, period_name):
         self.figure.clear()
         ax = self.figure.add_subplot(111)
 
-        # Получаем название выбранного филиала для заголовка
-        branch_name = self.branch_combo.currentText()
-
-        if df.empty or current_plan['monthly_plan'] == 0:
-            ax.text(0.5, 0.5, 'Нет данных для построения графика', ha='center', va='center', transform=ax.transAxes,
+        if not items:
+            ax.text(0.5, 0.5, 'Нет филиалов для сравнения', ha='center', va='center', transform=ax.transAxes,
                     fontsize=14)
-            ax.set_xlabel('Дата')
-            ax.set_ylabel('Выручка, руб.')
+            ax.set_axis_off()
             self.canvas.draw()
             return
 
-        current_date = datetime.now().date()
-        current_month = current_date.month
-        current_year = current_date.year
-
-        start_date = datetime(current_year, current_month, 1)
-        end_date = datetime(current_year, current_month, 30)
-        date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-        full_dates_df = pd.DataFrame({'date': date_range})
-        df_full = pd.merge(full_dates_df, df, on='date', how='left')
-        df_full['revenue'] = df_full['revenue'].fillna(0)
-        df_full['transactions'] = df_full['transactions'].fillna(0)
-        df_full['average_check'] = df_full['average_check'].fillna(0)
-
-        df_past = df_full[df_full['date'].dt.date <= current_date].copy()
-        if df_past.empty:
-            ax.text(0.5, 0.5, 'Нет данных за текущий период', ha='center', va='center', transform=ax.transAxes,
-                    fontsize=14)
-            ax.set_xlabel('Дата')
-            ax.set_ylabel('Выручка, руб.')
-            self.canvas.draw()
-            return
+        # Столбцы рисуются как две коллекции линий (по одному объекту на ряд, а не на филиал),
+        # поэтому время отрисовки почти не зависит от числа филиалов
+        positions = list(range(len(items)))
+        bar_width = max(1.0, min(14.0, 220 / len(items)))
+        ax.hlines(positions, 0, [item['forecast_percent'] for item in items], colors='#A23B72', alpha=0.3,
+                  linewidth=bar_width, label='Прогноз выполнения')
+        ax.hlines(positions, 0, [item['completion'] for item in items], colors='#2E86AB',
+                  linewidth=bar_width / 2, label='Выполнение плана')
+        ax.axvline(100, color='#495057', linewidth=1, linestyle='--')
+        ax.set_ylim(len(items) - 0.5, -0.5)
+        ax.set_xlim(left=0)
+        if len(items) <= self.MAX_LABELED_BRANCHES:
+            ax.set_yticks(positions)
+            ax.set_yticklabels([item['name'] for item in items], fontsize=8)
+        else:
+            ax.set_yticks([])
+            ax.set_ylabel(f'Филиалы ({len(items)}), подробности в таблице', fontsize=9)
+        ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x:.0f}%'))
+        ax.grid(True, alpha=0.3, axis='x')
+        ax.set_title(f'Выполнение плана по филиалам - {period_name}', fontsize=12, fontweight='bold')
+        ax.legend(loc='lower right', fontsize=9)
+        self.canvas.draw()
 
-        days = list(range(1, 31))
-        max_revenue = max(df_past['revenue'].max(), current_plan['daily_plan']) * 1.2
-        y_max = max(max_revenue, current_plan['monthly_plan'] / 30 * 1.5)
-        ax.set_xlim(0.5, 30.5)
-        ax.set_ylim(0, y_max)
-        ax.set_xticks(days)
-        ax.grid(True, alpha=0.3, axis='both')
 
-        # Отображаем ежедневный план (уже просуммированный для всех филиалов)
-        daily_plan_line = [current_plan['daily_plan']] * len(days)
-        ax.plot(days, daily_plan_line, label=f'Ежедневный план: {current_plan["daily_plan"]:,.0f} ₽',
-                color='#A23B72', linewidth=2, linestyle='--')
-
-        daily_revenues = []
-        for day in days:
-            date_to_find = datetime(current_year, current_month, day).date()
-            day_data = df_past[df_past['date'].dt.date == date_to_find]
-            if not day_data.empty:
-                daily_revenues.append(day_data['revenue'].iloc[0])
-            else:
-                daily_revenues.append(0)
+class SalesSliceDialog(QDialog):
+    """Срезы выручки по филиалам, сотрудникам и дням на основе куба продаж"""
+
+    DIMENSIONS = [("Филиал", 'branch'), ("Сотрудник", 'employee'), ("День", 'day')]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.db = DatabaseManager()
+        self.cube = SalesCube.instance(self.db.db_name)
+        self.setWindowTitle("Срезы продаж")
+        self.resize(900, 650)
+        self.setModal(True)
+        self.init_ui()
+        self.load_filters()
+        self.update_slice()
 
-        days_passed = min(current_plan['days_in_month'], 30)
-        days_to_show = list(range(1, days_passed + 1))
-        revenues_to_show = daily_revenues[:days_passed]
-        ax.plot(days_to_show, revenues_to_show, label='Фактическая выручка',
-                color='#2E86AB', linewidth=3, marker='o', markersize=6)
+    def init_ui(self):
+        layout = QVBoxLayout()
 
-        for i, (day, revenue) in enumerate(zip(days_to_show, revenues_to_show)):
-            if revenue > 0:
-                ax.annotate(f'{revenue:,.0f} ₽', (day, revenue), textcoords="offset points", xytext=(0, 10),
-                            ha='center', fontsize=8, bbox=dict(boxstyle="round,pad=0.3", facecolor="white", alpha=0.8))
+        filters_layout = QHBoxLayout()
+        self.branch_combo = QComboBox()
+        self.employee_combo = QComboBox()
+        self.date_from = QDateEdit()
+        self.date_from.setCalendarPopup(True)
+        self.date_from.setDate(QDate.currentDate().addDays(1 - QDate.currentDate().day()))
+        self.date_to = QDateEdit()
+        self.date_to.setCalendarPopup(True)
+        self.date_to.setDate(QDate.currentDate())
+        self.dimension_combo = QComboBox()
+        for title, axis in self.DIMENSIONS:
+            self.dimension_combo.addItem(title, axis)
+
+        for title, widget in [("Филиал:", self.branch_combo), ("Сотрудник:", self.employee_combo),
+                              ("С:", self.date_from), ("По:", self.date_to), ("Разрез:", self.dimension_combo)]:
+            label = QLabel(title)
+            label.setStyleSheet("font-weight: bold; color: #495057;")
+            filters_layout.addWidget(label)
+            filters_layout.addWidget(widget)
+        filters_layout.addStretch()
+        layout.addLayout(filters_layout)
+
+        summary_layout = QHBoxLayout()
+        self.revenue_label = QLabel()
+        self.transactions_label = QLabel()
+        self.avg_check_label = QLabel()
+        self.query_time_label = QLabel()
+        self.query_time_label.setStyleSheet("color: #6c757d;")
+        for label in [self.revenue_label, self.transactions_label, self.avg_check_label]:
+            label.setStyleSheet("font-weight: bold; color: #2c3e50; font-size: 13px;")
+            summary_layout.addWidget(label)
+        summary_layout.addStretch()
+        summary_layout.addWidget(self.query_time_label)
+        layout.addLayout(summary_layout)
+
+        self.slice_table = QTableWidget()
+        self.slice_table.setColumnCount(4)
+        self.slice_table.setHorizontalHeaderLabels(["", "Выручка", "Транзакции", "Средний чек"])
+        self.slice_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.slice_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.slice_table)
 
-        if current_date.day <= 30:
-            today_revenue = daily_revenues[current_date.day - 1] if current_date.day <= len(daily_revenues) else 0
-            ax.plot(current_date.day, today_revenue, 'ro', markersize=10, label='Сегодня')
+        self.setLayout(layout)
 
-        ax.set_xlabel('День месяца', fontsize=12, fontweight='bold')
-        ax.set_ylabel('Выручка за день, руб.', fontsize=10, fontweight='bold')
-        month_names = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь",
-                       "Ноябрь", "Декабрь"]
-        month_name = month_names[current_month - 1]
+        self.branch_combo.currentIndexChanged.connect(self.update_slice)
+        self.employee_combo.currentIndexChanged.connect(self.update_slice)
+        self.date_from.dateChanged.connect(self.update_slice)
+        self.date_to.dateChanged.connect(self.update_slice)
+        self.dimension_combo.currentIndexChanged.connect(self.update_slice)
+
+    def load_filters(self):
+        self.branch_names = {0: "Не указан"}
+        self.employee_names = {0: "Не указан"}
+        self.branch_combo.blockSignals(True)
+        self.employee_combo.blockSignals(True)
+        self.branch_combo.addItem("Все филиалы", None)
+        for branch in self.db.get_all_branches() or []:
+            self.branch_names[branch[0]] = branch[1]
+            self.branch_combo.addItem(branch[1], branch[0])
+        self.employee_combo.addItem("Все сотрудники", None)
+        for employee in self.db.get_all_employees() or []:
+            self.employee_names[employee[0]] = employee[1]
+            self.employee_combo.addItem(employee[1], employee[0])
+        self.branch_combo.blockSignals(False)
+        self.employee_combo.blockSignals(False)
+
+    def update_slice(self):
+        branch_id = self.branch_combo.currentData()
+        employee_id = self.employee_combo.currentData()
+        branch_ids = None if branch_id is None else [branch_id]
+        employee_ids = None if employee_id is None else [employee_id]
+        start = self.date_from.date().toString("yyyy-MM-dd")
+        end = self.date_to.date().toString("yyyy-MM-dd")
+        axis = self.dimension_combo.currentData()
+
+        started = time.perf_counter()
+        revenue, transactions = self.cube.totals(branch_ids, employee_ids, start, end)
+        rows = self.cube.breakdown(axis, branch_ids, employee_ids, start, end)
+        elapsed = (time.perf_counter() - started) * 1_000_000
+
+        self.revenue_label.setText(f"Выручка: {revenue:,.2f} ₽")
+        self.transactions_label.setText(f"Транзакции: {transactions:,}")
+        avg_check = revenue / transactions if transactions else 0
+        self.avg_check_label.setText(f"Средний чек: {avg_check:.2f} ₽")
+        self.query_time_label.setText(f"Запрос к кубу: {elapsed:.0f} мкс")
+
+        names = {'branch': self.branch_names, 'employee': self.employee_names}.get(axis)
+        self.slice_table.setHorizontalHeaderItem(0, QTableWidgetItem(self.dimension_combo.currentText()))
+        self.slice_table.setRowCount(len(rows))
+        for row, (key, row_revenue, row_transactions) in enumerate(rows):
+            values = [
+                names.get(key, f"#{key}") if names is not None else key,
+                f"{row_revenue:,.2f} ₽",
+                f"{row_transactions:,}",
+                f"{row_revenue / row_transactions if row_transactions else 0:.2f} ₽"
+            ]
+            for col, value in enumerate(values):
+                self.slice_table.setItem(row, col, QTableWidgetItem(value))
 
-        # Обновляем заголовок с учетом выбранного филиала
-        title = f'Ежедневное выполнение плана продаж - {month_name} {current_year}'
-        if branch_name != "Все филиалы":
-            title += f' - {branch_name}'
 
-        ax.set_title(title, fontsize=12, fontweight='bold', pad=7)
-        ax.legend(loc='upper right', fontsize=10)
-        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x:,.0f} ₽'))
-        ax.set_xticks([1, 5, 10, 15, 20, 25, 30])
-        ax.set_xticklabels(['1', '5', '10', '15', '20', '25', '30'])
-        self.figure.tight_layout()
-        self.canvas.draw()
+class EmployeeLeaderboardDialog(QDialog):
+    """Рейтинг сотрудников по выручке, транзакциям и среднему чеку за период"""
 
-    def update_statistics(self, df, current_plan):
-        if df.empty or current_plan['monthly_plan'] == 0:
-            for widget in self.stats_widgets.values():
-                widget.setText("0")
-            return
+    METRICS = [("Выручка", 'revenue'), ("Транзакции", 'transactions'), ("Средний чек", 'average_check')]
 
-        current_date = datetime.now().date()
-        current_month = current_date.month
-        current_year = current_date.year
-        df_current_month = df[
-            (df['date'].dt.month == current_month) &
-            (df['date'].dt.year == current_year) &
-            (df['date'].dt.date <= current_date)
-            ]
-        if df_current_month.empty:
-            for widget in self.stats_widgets.values():
-                widget.setText("0")
-            return
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.db = DatabaseManager()
+        self.setWindowTitle("Рейтинг сотрудников")
+        self.resize(1000, 650)
+        self.setModal(True)
+        self.init_ui()
+        self.load_data()
 
-        current_revenue = df_current_month['revenue'].sum()
-        plan_completion = (current_revenue / current_plan['monthly_plan']) * 100
+    def init_ui(self):
+        layout = QVBoxLayout()
 
-        days_passed = min(current_plan['days_in_month'], 30)
-        days_remaining = 30 - days_passed
-        if days_passed > 0 and days_remaining > 0:
-            avg_daily_revenue = df_current_month['revenue'].mean()
-            forecast_revenue = current_revenue + (avg_daily_revenue * days_remaining)
-            forecast_percent = (forecast_revenue / current_plan['monthly_plan']) * 100
-        else:
-            forecast_revenue = current_revenue
-            forecast_percent = plan_completion
+        filters_layout = QHBoxLayout()
+        now = datetime.now()
+        self.period_type_combo = QComboBox()
+        self.period_type_combo.addItem("Месяц", "month")
+        self.period_type_combo.addItem("Квартал", "quarter")
+        self.period_type_combo.addItem("Год", "year")
+        self.period_year_input = QSpinBox()
+        self.period_year_input.setRange(2020, 2100)
+        self.period_year_input.setValue(now.year)
+        self.period_index_combo = QComboBox()
+        self.fill_period_index_combo()
 
-        self.stats_widgets['plan_completion'].setText(f"{plan_completion:.1f}%")
-        self.stats_widgets['forecast_percent'].setText(f"{forecast_percent:.1f}%")
-        self.stats_widgets['forecast_value'].setText(f"{forecast_revenue:,.0f} ₽")
-        self.stats_widgets['avg_revenue'].setText(f"{df_current_month['revenue'].mean():,.0f} ₽")
-        self.stats_widgets['avg_check'].setText(f"{df_current_month['average_check'].mean():.0f} ₽")
-        self.stats_widgets['total_transactions'].setText(f"{df_current_month['transactions'].sum():,}")
+        self.branch_combo = QComboBox()
+        self.branch_combo.addItem("Все филиалы", None)
+        for branch in self.db.get_all_branches() or []:
+            self.branch_combo.addItem(branch[1], branch[0])
+
+        self.metric_combo = QComboBox()
+        for title, metric in self.METRICS:
+            self.metric_combo.addItem(title, metric)
+
+        self.top_input = QSpinBox()
+        self.top_input.setRange(1, 100)
+        self.top_input.setValue(10)
+
+        for title, widget in [("Период:", self.period_type_combo), (None, self.period_index_combo),
+                              (None, self.period_year_input), ("Филиал:", self.branch_combo),
+                              ("Показатель:", self.metric_combo), ("Топ:", self.top_input)]:
+            if title:
+                label = QLabel(title)
+                label.setStyleSheet("font-weight: bold; color: #495057;")
+                filters_layout.addWidget(label)
+            filters_layout.addWidget(widget)
+        filters_layout.addStretch()
+        layout.addLayout(filters_layout)
+
+        self.leaderboard_table = QTableWidget()
+        self.leaderboard_table.setColumnCount(7)
+        self.leaderboard_table.setHorizontalHeaderLabels([
+            "Место в филиале", "Общее место", "Сотрудник", "Филиал", "Выручка", "Транзакции", "Средний чек"
+        ])
+        self.leaderboard_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.leaderboard_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.leaderboard_table)
 
-    def show_empty_chart(self):
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-        ax.text(0.5, 0.5, 'Нет данных для отображения\nДобавьте данные о продажах и планах',
-                ha='center', va='center', transform=ax.transAxes, fontsize=14)
-        ax.set_xlabel('День месяца')
-        ax.set_ylabel('Выручка за день, руб.')
-        for widget in self.stats_widgets.values():
-            widget.setText("0")
-        self.canvas.draw()
+        self.setLayout(layout)
+
+        self.period_type_combo.currentIndexChanged.connect(self.on_period_type_changed)
+        self.period_index_combo.currentIndexChanged.connect(self.load_data)
+        self.period_year_input.valueChanged.connect(self.load_data)
+        self.branch_combo.currentIndexChanged.connect(self.load_data)
+        self.metric_combo.currentIndexChanged.connect(self.load_data)
+        self.top_input.valueChanged.connect(self.load_data)
+
+    def fill_period_index_combo(self):
+        kind = self.period_type_combo.currentData()
+        now = datetime.now()
+        self.period_index_combo.blockSignals(True)
+        self.period_index_combo.clear()
+        if kind == 'month':
+            self.period_index_combo.addItems(ProgressChartWindow.MONTH_NAMES)
+            self.period_index_combo.setCurrentIndex(now.month - 1)
+        elif kind == 'quarter':
+            self.period_index_combo.addItems(ProgressChartWindow.QUARTER_NAMES)
+            self.period_index_combo.setCurrentIndex((now.month - 1) // 3)
+        self.period_index_combo.setVisible(kind != 'year')
+        self.period_index_combo.blockSignals(False)
+
+    def on_period_type_changed(self):
+        self.fill_period_index_combo()
+        self.load_data()
+
+    def load_data(self):
+        kind = self.period_type_combo.currentData()
+        index = self.period_index_combo.currentIndex() + 1 if kind != 'year' else 1
+        start, end = ProgressChartWindow.get_period_bounds((kind, self.period_year_input.value(), index))
+        rows = self.db.get_employee_leaderboard(start.isoformat(), end.isoformat(), self.metric_combo.currentData(),
+                                                self.branch_combo.currentData(), self.top_input.value()) or []
+
+        self.leaderboard_table.setRowCount(len(rows))
+        for row, (branch_rank, overall_rank, employee_name, branch_name, revenue, transactions,
+                  average_check) in enumerate(rows):
+            values = [
+                str(branch_rank),
+                str(overall_rank),
+                employee_name,
+                branch_name,
+                f"{revenue:,.2f} ₽",
+                f"{int(transactions):,}",
+                f"{average_check:.2f} ₽"
+            ]
+            for col, value in enumerate(values):
+                self.leaderboard_table.setItem(row, col, QTableWidgetItem(value))
 
 
 class LoginWindow(QMainWindow):
@@ -2407,9 +6258,79 @@ class LoginWindow(QMainWindow):
             QApplication.quit()
 
 
+def run_cli_command(argv):
+    """Служебные команды без запуска интерфейса; False, если команда не указана"""
+    if len(argv) < 2:
+        return False
+    command = argv[1]
+    if command == "--rebuild-daily-sales":
+        result = DatabaseManager().rebuild_daily_sales()
+        print("Дневные итоги пересчитаны" if result is not None else "Не удалось пересчитать дневные итоги")
+        return True
+    if command == "--rebuild-anomalies":
+        result = AnomalyDetector(DatabaseManager()).rebuild()
+        print(f"Отмечено дней с отклонениями: {result}" if result is not None else "Не удалось пересчитать отклонения")
+        return True
+    if command == "--forecast":
+        result = SalesForecaster(DatabaseManager()).run()
+        print(f"Прогноз рассчитан для филиалов: {result}" if result is not None else "Не удалось рассчитать прогноз")
+        return True
+    if command == "--sync":
+        # Перенос изменений базы филиала (по умолчанию sales_system.db) в центральную базу;
+        # --trim очищает перенесённое из журналов филиала (когда приложение филиала не запущено)
+        trim = "--trim" in argv
+        args = [arg for arg in argv[2:] if arg != "--trim"]
+        if not args:
+            print("Использование: --sync центральная_база [база_филиала] [--trim]")
+            return True
+        source = DatabaseManager(args[1] if len(args) > 1 else "sales_system.db")
+        result = BranchReplicator(source, DatabaseManager(args[0])).sync(trim)
+        print(f"Перенесено строк: {result}" if result is not None else "Не удалось синхронизировать базы")
+        return True
+    if command == "--instance":
+        # База, открытая из другого файла (копия, перенос): new - копии задаётся свой instance_id,
+        # keep - id сохраняется для той же базы
+        if len(argv) < 4 or argv[3] not in ("new", "keep"):
+            print("Использование: --instance база new|keep")
+            return True
+        result = DatabaseManager(argv[2]).set_instance(argv[3] == "new")
+        print("Файл базы запомнен" if result is not None else "Не удалось обновить сведения о базе")
+        return True
+    if command == "--archive":
+        # Перенос продаж закрытых лет (или только указанного года) в архивы рядом с базой
+        db = DatabaseManager()
+        years = [int(argv[2])] if len(argv) > 2 else db.get_archivable_years()
+        if years is None:
+            print("Не удалось определить годы для архивации")
+            return True
+        if not years:
+            print("Продаж за закрытые годы в базе нет")
+        for year in years:
+            result = db.archive_sales(year)
+            print(f"{year}: перенесено в архив продаж: {result}" if result is not None
+                  else f"{year}: не удалось перенести продажи в архив")
+        return True
+    if command == "--serve":
+        # Локальная служба для клиентов, запущенных с --connect [host:]port
+        port = int(argv[2]) if len(argv) > 2 else SalesService.PORT
+        SalesService(DatabaseManager()).run(port=port)
+        return True
+    return False
+
+
 if __name__ == "__main__":
+    if run_cli_command(sys.argv):
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "--connect":
+        client = ServiceClient.from_address(sys.argv[2])
+        if client.ping():
+            DatabaseManager.service = client
+        else:
+            print(f"Служба продаж {sys.argv[2]} недоступна, работа с базой напрямую")
     app = QApplication(sys.argv)
     app.setFont(QFont("Courier New", 10))
+    app.aboutToQuit.connect(PendingSalesQueue.flush_all)
+    app.aboutToQuit.connect(SalesSnapshot.save_all)
     welcome_window = WelcomeWindow()
     welcome_window.show()
     sys.exit(app.exec())
\ No newline at end of file
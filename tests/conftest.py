@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# Приложение - один модуль .idea/main.py; окна Qt в тестах не показываются
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".idea"))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Новая база в каталоге теста с двумя филиалами"""
+    manager = main.DatabaseManager(str(tmp_path / "sales.db"))
+    manager.add_branch("Центральный", "", "", "")
+    manager.add_branch("Северный", "", "", "")
+    return manager
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+def table_rows(db, table):
+    return sorted(db.execute_query(f"SELECT * FROM {table}"))
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import main
+from conftest import table_rows
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def history(db):
+    """Продажи за 2024 (закрытый год) и 2025: по 5 у каждого из двух филиалов"""
+    db.ARCHIVE_DELETE_BATCH, db.ARCHIVE_DELETE_PAUSE = 4, 0
+    db.add_sales([(f'{year}-05-{day:02d}', day, 1, None, branch, '', 1)
+                  for year in (2024, 2025) for branch in (1, 2) for day in range(1, 6)])
+    return db
+
+
+def all_sales(db):
+    return sorted(db.execute_query("SELECT id, day, revenue_kopecks, branch_id FROM all_sales_records",
+                                   with_archives=True))
+
+
+def test_archive_moves_closed_year_and_keeps_totals(history):
+    db = history
+    before, daily = all_sales(db), table_rows(db, "daily_sales")
+
+    assert db.archive_sales(2024) == 10
+
+    assert os.path.exists(db.archive_path(f"{os.path.splitext(os.path.basename(db.db_name))[0]}-archive-2024.db"))
+    assert db.execute_query("SELECT COUNT(*) FROM sales_records") == [(10,)]
+    assert all_sales(db) == before
+    assert table_rows(db, "daily_sales") == daily
+    assert db.get_sales_archives()[0][2:4] == ('done', 10)
+    assert db.get_archived_years() == {2024}
+    assert db.execute_query("SELECT COUNT(*) FROM sales") == [(10,)]
+    assert db.execute_query("SELECT COUNT(*) FROM all_sales", with_archives=True) == [(20,)]
+    # Архивный год не меняется
+    assert db.add_sale('2024-06-01', 1, 1, None, 1, '', 1) is None
+    assert db.archive_sales(2024) == 0
+    assert db.archive_sales(main.datetime.now().year) is None
+
+
+def test_interrupted_archive_resumes_without_losing_sales(history, monkeypatch):
+    db = history
+    before = all_sales(db)
+
+    def interrupt(seconds):
+        raise Interrupted()
+
+    monkeypatch.setattr(main.time, "sleep", interrupt)
+    with pytest.raises(Interrupted):
+        db.archive_sales(2024)
+    # Пока продажи удаляются порциями, вся история видна ровно один раз
+    assert db.get_sales_archives()[0][2] == 'removing'
+    assert db.execute_query("SELECT COUNT(*) FROM sales_records") == [(16,)]
+    assert all_sales(db) == before
+
+    monkeypatch.undo()
+    assert db.archive_sales(2024) == 6
+    assert all_sales(db) == before
+
+
+def test_branch_with_archived_sales_is_not_deleted(history):
+    db = history
+    db.archive_sales(2024)
+
+    assert db.count_archived_branch_sales(1) == 5
+    assert db.delete_branch(1, 2) is None
+    assert db.remove_branch(1, 2) is None
+    assert len(db.get_all_branches()) == 2
+    # Текущие продажи филиала остались на месте: удаление отказано до переноса
+    assert db.count_branch_sales(1) == 5
+
+    db.add_branch("Новый", "", "", "")
+    db.add_sale('2025-07-01', 1, 1, None, 3, '', 1)
+    assert db.count_archived_branch_sales(3) == 0
+    assert db.delete_branch(3, 2) == 1
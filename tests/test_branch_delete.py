@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+import main
+from conftest import table_rows
+
+
+@pytest.fixture
+def branch_sales(db):
+    """У филиала 1 - сотрудник, план и 10 продаж; порции удаления по 3 продажи"""
+    db.BRANCH_DELETE_BATCH, db.BRANCH_DELETE_PAUSE = 3, 0
+    db.add_employee("Иванов", "Кассир", "", 1)
+    db.add_sales_plan(1, 2025, 1, 1000, 30000)
+    db.add_sales([(f'2025-01-{day:02d}', day, 1, None, 1, '', 1) for day in range(1, 11)])
+    db.add_sale('2025-01-01', 100, 1, None, 2, '', 1)
+    return db
+
+
+def test_delete_branch_moves_sales_in_batches(branch_sales):
+    db = branch_sales
+    progress, changes = [], []
+    main.DatabaseManager.add_sale_listener(db.db_name, changes.extend)
+
+    assert db.delete_branch(1, 2, lambda done, total: progress.append((done, total))) == 10
+
+    assert progress == [(3, 10), (6, 10), (9, 10), (10, 10)]
+    assert [row[0] for row in db.get_all_branches()] == [2]
+    assert db.execute_query("SELECT branch_id, COUNT(*) FROM sales_records GROUP BY branch_id") == [(2, 11)]
+    assert db.execute_query("SELECT branch_id FROM employees") == [(2,)]
+    assert db.execute_query("SELECT COUNT(*) FROM sales_plans") == [(0,)]
+    # Подписчики получили перенос каждой продажи; итоги совпадают с пересчётом
+    assert len(changes) == 10 and all(old[0] == 1 and new[0] == 2 for sale_id, old, new in changes)
+    daily = table_rows(db, "daily_sales")
+    db.rebuild_daily_sales()
+    assert table_rows(db, "daily_sales") == daily
+
+
+def test_cancelled_delete_resumes(branch_sales):
+    db = branch_sales
+    cancel_event = threading.Event()
+
+    with pytest.raises(main.TaskCancelled):
+        db.delete_branch(1, None, lambda done, total: cancel_event.set(), cancel_event)
+
+    assert db.count_branch_sales(1) == 7 and len(db.get_all_branches()) == 2
+    assert db.delete_branch(1, None) == 7
+    assert db.execute_query("SELECT COUNT(*) FROM sales_records WHERE branch_id IS NULL") == [(10,)]
+
+
+def test_sales_cannot_go_to_the_deleted_branch(branch_sales):
+    assert branch_sales.delete_branch(1, 1) is None
+    assert branch_sales.count_branch_sales(1) == 10
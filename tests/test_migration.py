@@ -0,0 +1,66 @@
+import sqlite3
+
+import main
+
+# Таблица продаж в том виде, в каком её создавала прежняя версия программы
+LEGACY_SALES = '''
+    CREATE TABLE sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        revenue REAL NOT NULL,
+        transactions INTEGER NOT NULL,
+        average_check REAL,
+        employee_id INTEGER,
+        branch_id INTEGER,
+        notes TEXT,
+        user_id INTEGER NOT NULL
+    )
+'''
+
+
+def legacy_database(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SALES)
+    conn.executemany("INSERT INTO sales (date, revenue, transactions, branch_id, notes, user_id) "
+                     "VALUES (?, ?, ?, 1, '', 1)", rows)
+    conn.execute("DELETE FROM sales WHERE id = (SELECT MAX(id) FROM sales)")  # id удалённой продажи не выдаётся снова
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_legacy_sales_to_kopecks_and_days(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path, [('2024-03-01', 123.45, 3), ('2025-03-01', 0.1 + 0.2, 1), ('2025-03-02', 1, 1)])
+
+    db = main.DatabaseManager(path)
+
+    assert db.execute_query("PRAGMA user_version") == [(db.SCHEMA_VERSION,)]
+    assert db.execute_query("SELECT id, day, revenue_kopecks, transactions FROM sales_records ORDER BY id") == [
+        (1, db.to_day('2024-03-01'), 12345, 3), (2, db.to_day('2025-03-01'), 30, 1)]
+    assert db.execute_query("SELECT type FROM sqlite_master WHERE name = 'sales'") == [('view',)]
+    assert db.execute_query("SELECT date, revenue FROM sales WHERE id = 1") == [('2024-03-01', 123.45)]
+    assert db.add_sale('2025-04-01', 5, 1, None, 1, '', 1) == 4
+    assert db.execute_query("SELECT SUM(revenue_kopecks), SUM(sales_count) FROM daily_sales") == [(12875, 3)]
+
+
+def test_unparsable_rows_are_set_aside(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path, [('2024-03-01', 10, 1), ('01.03.2024', 5, 1), ('2024-03-05', '1 000,5', 1),
+                           ('2024-03-06', 7, 'x'), ('2024-03-07 12:30:00', 2, 1), ('2024-03-08', 1, 1)])
+
+    db = main.DatabaseManager(path)
+
+    assert db.execute_query("SELECT id FROM sales_records ORDER BY id") == [(1,), (5,)]
+    assert db.execute_query("SELECT id, date FROM sales_migration_rejects ORDER BY id") == [
+        (2, '01.03.2024'), (3, '2024-03-05'), (4, '2024-03-06')]
+    assert db.execute_query("SELECT type FROM sqlite_master WHERE name = 'sales'") == [('view',)]
+
+
+def test_migration_runs_once(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path, [('2024-03-01', 10, 1), ('2024-03-02', 20, 1)])
+    main.DatabaseManager(path)
+
+    db = main.DatabaseManager(path)
+
+    assert db.execute_query("SELECT COUNT(*), SUM(revenue_kopecks) FROM sales_records") == [(1, 1000)]
@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "journal"
+    monkeypatch.setattr(main.PendingSalesQueue, "JOURNAL_DIR", str(directory))
+    return directory
+
+
+def sale(day, revenue=10):
+    return [f'2025-01-{day:02d}', revenue, 1, None, 1, '', 1]
+
+
+def write_journal(db, lines):
+    path = main.PendingSalesQueue.journal_path_for(db.db_name, 1)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as journal:
+        journal.write("".join(line + "\n" for line in lines))
+    return path
+
+
+def open_queue(db, qapp):
+    """Очередь после восстановления журнала и завершения фоновой записи"""
+    queue = main.PendingSalesQueue(db, 1)
+    queue.write_pool.waitForDone()
+    qapp.processEvents()
+    return queue
+
+
+def sales_count(db):
+    return db.execute_query("SELECT COUNT(*) FROM sales_records")[0][0]
+
+
+def test_recover_writes_only_sales_missing_from_database(db, qapp, journal_dir):
+    # До сбоя в базу попала строка 2 журнала, а переписать журнал не удалось
+    db.add_sales([tuple(sale(2))], ('j1', 2))
+    path = write_journal(db, [json.dumps({'journal': 'j1', 'seq': 1}),
+                              json.dumps({'seq': 2, 'sale': sale(2)}), json.dumps({'seq': 3, 'sale': sale(3)})])
+
+    queue = open_queue(db, qapp)
+
+    assert queue.damaged_journal is None
+    assert (queue.journal_id, queue.seq, queue.entries) == ('j1', 3, [])
+    assert sales_count(db) == 2
+    assert open(path, encoding="utf-8").read().splitlines() == [json.dumps({'journal': 'j1', 'seq': 3})]
+    queue.close()
+
+
+@pytest.mark.parametrize("lines", [
+    ['{"journ', json.dumps({'seq': 1, 'sale': sale(1)}), json.dumps({'seq': 2, 'sale': sale(2)})],
+    [json.dumps({'seq': 1, 'sale': sale(1)}), json.dumps({'seq': 2, 'sale': sale(2)})],
+    [json.dumps({'journal': 'j1', 'seq': 0}), json.dumps({'seq': 1, 'sale': sale(1)}), '{"seq": 7, "sa',
+     json.dumps({'seq': 2, 'sale': sale(2)})],
+], ids=["truncated header", "no header", "broken line"])
+def test_recover_keeps_damaged_journal_and_readable_sales(db, qapp, journal_dir, lines):
+    path = write_journal(db, lines)
+    original = open(path, encoding="utf-8").read()
+
+    queue = open_queue(db, qapp)
+
+    assert queue.damaged_journal is not None and queue.damaged_journal != path
+    assert open(queue.damaged_journal, encoding="utf-8").read() == original
+    assert sales_count(db) == 2
+    # Новый журнал - уже без продаж, которые записаны в базу
+    assert [json.loads(line) for line in open(path, encoding="utf-8")] == [{'journal': queue.journal_id, 'seq': 2}]
+    queue.close()
+
+    # Повторное повреждение не заменяет уже отложенный файл
+    write_journal(db, lines)
+    second = open_queue(db, qapp)
+    assert second.damaged_journal != queue.damaged_journal
+    assert open(queue.damaged_journal, encoding="utf-8").read() == original
+    second.close()
+
+
+def test_missing_journal_starts_a_new_one(db, qapp, journal_dir):
+    queue = open_queue(db, qapp)
+
+    assert queue.damaged_journal is None and queue.entries == []
+    header = json.loads(open(queue.journal_path, encoding="utf-8").read())
+    assert header == {'journal': queue.journal_id, 'seq': 0}
+    queue.close()
+
+
+def test_flush_writes_in_background_and_retries_busy_database(db, qapp, journal_dir):
+    queue = open_queue(db, qapp)
+    results = []
+    queue.flushed.connect(results.append)
+    queue.flush_failed.connect(lambda: results.append('failed'))
+    db.BUSY_TIMEOUT, db.WRITE_RETRIES = 0.1, 0
+    lock = sqlite3.connect(db.db_name, isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+
+    seqs = [queue.append(tuple(sale(day))) for day in (1, 2, 3)]
+    queue.flush()
+    queue.write_pool.waitForDone()
+    qapp.processEvents()
+
+    assert results == ['failed'] and not queue.available
+    assert len(queue.sales()) == 3 and queue.timer.isActive()
+    lock.rollback()
+    lock.close()
+
+    queue.flush()
+    queue.write_pool.waitForDone()
+    qapp.processEvents()
+
+    assert results == ['failed', 3] and queue.available and queue.is_written(seqs[-1])
+    assert sales_count(db) == 3
+    queue.close()
+
+
+def test_close_writes_queue_synchronously(db, qapp, journal_dir):
+    queue = open_queue(db, qapp)
+    queue.append(tuple(sale(1)))
+
+    queue.close()
+
+    assert sales_count(db) == 1
+    assert db.get_pending_journal_seq(queue.journal_id) == 0  # журнал пуст - номер в базе не нужен
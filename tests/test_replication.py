@@ -0,0 +1,76 @@
+import shutil
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def central(tmp_path):
+    return main.DatabaseManager(str(tmp_path / "central.db"))
+
+
+def sales(db):
+    return sorted(db.execute_query("SELECT day, revenue_kopecks, notes FROM all_sales_records", with_archives=True))
+
+
+def test_sync_transfers_each_change_once(db, central):
+    db.add_employee("Иванов", "Кассир", "", 2)
+    employee = db.execute_query("SELECT id FROM employees")[0][0]
+    first = db.add_sale('2025-01-10', 100, 2, employee, 2, 'первая', 1)
+    second = db.add_sale('2025-01-11', 50, 1, None, 1, 'вторая', 1)
+    replicator = main.BranchReplicator(db, central)
+
+    assert replicator.sync() > 0
+    assert sales(central) == sales(db)
+    assert central.execute_query("SELECT e.name, b.name FROM employees e JOIN branches b ON b.id = e.branch_id") == [
+        ("Иванов", "Северный")]
+    # Повторный перенос ничего не меняет
+    assert replicator.sync() == 0
+    assert central.execute_query("SELECT COUNT(*) FROM sales_records") == [(2,)]
+
+    db.update_sale(first, '2025-01-12', 120, 2, employee, 2, 'исправлена', 1)
+    db.delete_sale(second)
+    assert replicator.sync() == 2
+    assert sales(central) == sales(db) == [(db.to_day('2025-01-12'), 12000, 'исправлена')]
+    # Пароли не переносятся
+    assert central.execute_query("SELECT COUNT(*) FROM users WHERE password = 'admin123'") == [(1,)]
+
+
+def test_sync_after_trimmed_source_log(db, central):
+    replicator = main.BranchReplicator(db, central)
+    db.add_sale('2025-02-01', 10, 1, None, 1, '', 1)
+    assert replicator.sync(trim=True) is not None
+    assert db.execute_query("SELECT COUNT(*) FROM sales_change_log") == [(0,)]
+
+    db.add_sale('2025-02-02', 20, 1, None, 1, '', 1)
+
+    assert replicator.sync() == 1
+    assert sales(central) == sales(db)
+
+
+def test_changes_to_closed_central_year_are_recorded_as_conflicts(db, central):
+    central.add_sale('2024-06-01', 5, 1, None, None, '', 1)
+    assert central.archive_sales(2024) == 1
+    db.add_sales([('2024-06-02', 10, 1, None, 1, '', 1), ('2025-06-02', 20, 1, None, 1, '', 1)])
+
+    assert main.BranchReplicator(db, central).sync() is not None
+
+    assert central.execute_query("SELECT table_name, op, year FROM replication_conflicts") == [
+        ('sales_records', 'insert', 2024)]
+    assert central.execute_query("SELECT day FROM sales_records") == [(db.to_day('2025-06-02'),)]
+
+
+def test_copied_database_is_refused_until_it_gets_own_id(db, central, tmp_path):
+    db.add_sale('2025-03-01', 10, 1, None, 1, '', 1)
+    assert main.BranchReplicator(db, central).sync() is not None
+    shutil.copy(db.db_name, tmp_path / "copy.db")
+    copy = main.DatabaseManager(str(tmp_path / "copy.db"))
+
+    assert copy.is_copied_file()
+    assert main.BranchReplicator(copy, central).sync() is None
+
+    assert copy.set_instance(reset=True) is not None
+    assert copy.get_database_info('instance_id') != db.get_database_info('instance_id')
+    assert main.BranchReplicator(copy, central).sync() is not None
+    assert central.execute_query("SELECT COUNT(DISTINCT source) FROM replication_sources") == [(2,)]
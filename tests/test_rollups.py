@@ -0,0 +1,36 @@
+from conftest import table_rows
+
+
+def assert_rollups_match_rebuild(db):
+    """Итоги, поддержанные триггерами, совпадают с пересчётом с нуля"""
+    daily, monthly = table_rows(db, "daily_sales"), table_rows(db, "branch_monthly_totals")
+    assert db.rebuild_daily_sales() is not None
+    assert table_rows(db, "daily_sales") == daily
+    assert table_rows(db, "branch_monthly_totals") == monthly
+
+
+def test_rollups_follow_inserts_updates_and_deletes(db):
+    db.add_employee("Иванов", "Кассир", "", 1)
+    employee = db.execute_query("SELECT id FROM employees")[0][0]
+    first = db.add_sale('2025-01-31', 100.10, 2, employee, 1, '', 1)
+    second = db.add_sale('2025-01-31', 50, 1, None, 1, '', 1)
+    assert first and second
+    db.add_sales([('2025-02-01', 10, 1, employee, 2, '', 1), ('2025-02-01', 0.01, 1, None, None, '', 1)])
+    assert_rollups_match_rebuild(db)
+
+    # Перенос продажи в другой день, месяц, филиал и к другому сотруднику
+    db.update_sale(first, '2025-02-28', 70, 3, None, 2, '', 1)
+    assert_rollups_match_rebuild(db)
+
+    db.delete_sale(second)
+    assert_rollups_match_rebuild(db)
+    # Ячейка без продаж удаляется, а не остаётся нулевой
+    assert db.execute_query("SELECT COUNT(*) FROM daily_sales WHERE day = ?", (db.to_day('2025-01-31'),)) == [(0,)]
+
+
+def test_monthly_totals_sum_daily_rows(db):
+    db.add_sales([(f'2025-03-{day:02d}', day, 1, None, 1 + day % 2, '', 1) for day in range(1, 32)])
+
+    assert db.execute_query("SELECT branch_id, revenue_kopecks, sales_count FROM branch_monthly_totals "
+                            "WHERE year = 2025 AND month = 3 ORDER BY branch_id") == [(1, 24000, 15), (2, 25600, 16)]
+    assert_rollups_match_rebuild(db)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def service(db):
+    service = main.SalesService(db)
+    yield service
+    service.writer.shutdown()
+    service.readers.shutdown()
+
+
+def call(service, name, params=None, body=None):
+    if body is None:
+        body = json.dumps({'params': params if params is not None else []}).encode('utf-8')
+    status, payload = asyncio.run(service.dispatch('POST', f'/api/{name}', body))
+    return int(status.split()[0]), payload
+
+
+def test_only_listed_methods_are_served(service):
+    assert call(service, 'execute_query', ["SELECT email, password FROM users"])[0] == 404
+    # Роль выбирает регистрирующийся - через службу любой создал бы администратора
+    assert call(service, 'create_user', ["Взломщик", "x@x.ru", "secret", "admin"])[0] == 404
+    assert call(service, 'get_all_branches')[0] == 200
+
+
+def test_authentication(service):
+    status, payload = call(service, 'authenticate_user', ['admin@system.com', 'admin123'])
+    assert status == 200 and tuple(payload['result'][2:]) == ('admin@system.com', 'admin')
+    assert call(service, 'authenticate_user', ['admin@system.com', 'wrong']) == (200, {'result': None})
+
+
+def test_client_mode_does_not_register_users():
+    success, message = main.ServiceDatabaseManager("client.db").create_user("Иванов", "i@x.ru", "123456")
+    assert not success and "регистрация недоступна" in message
+
+
+@pytest.mark.parametrize("name, params", [
+    ('add_sale', ['2025-13-45', 10, 1, None, 1, '', 1]),
+    ('add_sale', ['2025-01-05', '10', 1, None, 1, '', 1]),
+    ('add_sale', ['2025-01-05', 10, 1.5, None, 1, '', 1]),
+    ('add_sales', [[['2025-01-05', 10, 1, None, 1, '', 1], ['вчера', 10, 1, None, 1, '', 1]]]),
+    ('get_sale_rows', [[1, 'x']]),
+    ('delete_sale', [1, 2]),
+])
+def test_invalid_parameters_get_fixed_400(service, name, params):
+    status, payload = call(service, name, params)
+
+    assert status == 400
+    assert payload['error'].startswith(("некорректный параметр", "неверное число параметров"))
+    assert service.db.execute_query("SELECT COUNT(*) FROM sales_records") == [(0,)]
+
+
+def test_malformed_requests(service):
+    assert call(service, 'get_all_branches', body=b'{') == (400, {'error': "Некорректный JSON"})
+    assert call(service, 'get_all_branches', body=b'[1]')[0] == 400
+    assert call(service, 'get_all_branches', body=json.dumps({'params': 'x'}).encode())[0] == 400
+    assert call(service, 'batch', body=json.dumps({'calls': [['get_all_branches']]}).encode())[0] == 400
+
+
+def test_internal_errors_are_not_echoed(service, monkeypatch):
+    def fail():
+        raise RuntimeError("no such table: /srv/secret/sales.db")
+
+    monkeypatch.setattr(service.db, 'get_all_branches', fail)
+
+    assert call(service, 'get_all_branches') == (500, {'error': "Внутренняя ошибка службы"})
+
+
+def test_writes_and_batches(service):
+    status, payload = call(service, 'add_sale', ['2025-01-05', 10.5, 1, None, 1, '', 1])
+    assert status == 200 and payload['result'] == 1
+
+    body = json.dumps({'calls': [['delete_sale', [1]], ['get_sale_facts', [1]]]}).encode()
+    status, payload = asyncio.run(service.dispatch('POST', '/api/batch', body))
+    assert status == "200 OK" and payload['results'][1] is None